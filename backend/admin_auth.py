@@ -0,0 +1,14 @@
+import os
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+
+def require_admin(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Dependency guarding support/admin routes with the ADMIN_API_KEY shared secret"""
+    admin_key = os.environ.get('ADMIN_API_KEY')
+    if not admin_key:
+        raise HTTPException(status_code=403, detail="Admin API is not enabled")
+    if not x_admin_key or not secrets.compare_digest(x_admin_key.encode(), admin_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
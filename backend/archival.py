@@ -0,0 +1,76 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Cold collection holding transactions that will never be paid
+ARCHIVE_COLLECTION = "payment_transactions_archive"
+
+
+class TransactionArchiver:
+    """Moves old unpaid transactions out of payment_transactions in batches
+
+    Any transaction that is not paid and was created more than ``max_age``
+    ago is copied into payment_transactions_archive and then deleted from
+    the hot collection, so request paths and their indexes only see live
+    data. Paid transactions stay hot because download access is checked
+    against them.
+
+    Each batch is idempotent: copies left behind by an interrupted run are
+    skipped on insert, and the delete only removes documents that are
+    still unpaid.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient, max_age: Optional[timedelta] = None,
+                 batch_size: Optional[int] = None):
+        self.db = db
+        self.max_age = max_age or timedelta(days=float(os.environ.get('ARCHIVE_AFTER_DAYS', '90')))
+        self.batch_size = batch_size or int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+
+    async def run(self) -> Dict[str, int]:
+        """Archive every eligible transaction, returning how many were moved"""
+        # _id encodes the insert time, which also covers records stored without created_at
+        cutoff = ObjectId.from_datetime(datetime.utcnow() - self.max_age)
+        cursor = None
+        archived = batches = 0
+        while True:
+            id_range: Dict[str, Any] = {"$lt": cutoff}
+            if cursor is not None:
+                id_range["$gt"] = cursor
+            page = await self.db.payment_transactions.find(
+                {"_id": id_range, "payment_status": {"$ne": "paid"}}
+            ).sort("_id", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not page:
+                break
+            cursor = page[-1]["_id"]
+            archived += await self._move(page)
+            batches += 1
+
+        logger.info("Archived %s transactions in %s batches", archived, batches)
+        return {"archived": archived, "batches": batches}
+
+    async def _move(self, page: List[Dict[str, Any]]) -> int:
+        archive = self.db[ARCHIVE_COLLECTION]
+        now = datetime.utcnow()
+        try:
+            await archive.insert_many([{**doc, "archived_at": now} for doc in page], ordered=False)
+        except BulkWriteError as e:
+            # Documents copied by an interrupted run are already archived
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+        ids = [doc["_id"] for doc in page]
+        result = await self.db.payment_transactions.delete_many(
+            {"_id": {"$in": ids}, "payment_status": {"$ne": "paid"}}
+        )
+        if result.deleted_count < len(ids):
+            # Transactions paid while being archived stay hot, so drop their archive copies
+            still_hot = [doc["_id"] async for doc in self.db.payment_transactions.find({"_id": {"$in": ids}}, {"_id": 1})]
+            await archive.delete_many({"_id": {"$in": still_hot}})
+        return result.deleted_count
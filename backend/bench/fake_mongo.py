@@ -0,0 +1,760 @@
+"""In-memory stand-in for the parts of Motor the services use
+
+Supports the query, update and aggregation operators the backend issues,
+unique indexes, an injected per-call latency and a per-(collection, op)
+call counter so the benchmark can report database calls per request.
+It is deliberately small: anything it does not understand raises
+NotImplementedError rather than silently returning wrong data.
+"""
+import asyncio
+import copy
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+_MISSING = object()
+
+
+def _get_path(doc: Any, path: str) -> Any:
+    """Resolve a dotted path, fanning out over arrays like MongoDB does"""
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            values = [_get_path(item, part) for item in value if isinstance(item, dict)]
+            value = [item for item in values if item is not _MISSING]
+        elif isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc: Dict[str, Any], path: str) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    # Mirror MongoDB's cross-type ordering closely enough for sorting
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (4, str(value))
+    if isinstance(value, datetime):
+        return (6, value)
+    return (3, str(value))
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    if isinstance(value, list):
+        return any(_compare(item, op, operand) for item in value)
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise NotImplementedError(op)
+
+
+def _equals(value: Any, operand: Any) -> bool:
+    if value is _MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def _match_operators(value: Any, condition: Dict[str, Any]) -> bool:
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = _equals(value, operand)
+        elif op == "$ne":
+            ok = not _equals(value, operand)
+        elif op == "$in":
+            ok = any(_equals(value, item) for item in operand)
+        elif op == "$nin":
+            ok = not any(_equals(value, item) for item in operand)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = _compare(value, op, operand)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(operand)
+        elif op == "$regex":
+            ok = isinstance(value, str) and re.search(operand, value) is not None
+        else:
+            raise NotImplementedError(f"Query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    """Whether a document satisfies a MongoDB query"""
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        else:
+            value = _get_path(doc, key)
+            if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+                if not _match_operators(value, condition):
+                    return False
+            elif not _equals(value, condition):
+                return False
+    return True
+
+
+def _apply_update(doc: Dict[str, Any], update: Any, inserting: bool) -> None:
+    if isinstance(update, list):
+        # Update pipeline: each $set stage sees the document as the previous stage left it
+        for stage in update:
+            (op, fields), = stage.items()
+            if op != "$set":
+                raise NotImplementedError(f"Update pipeline stage {op}")
+            values = {path: _evaluate(expression, doc) for path, expression in fields.items()}
+            for path, value in values.items():
+                _set_path(doc, path, value)
+        return
+    if not all(key.startswith("$") for key in update):
+        raise NotImplementedError("Replacement documents go through replace_one")
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            if op in ("$set", "$setOnInsert"):
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$max":
+                current = _get_path(doc, path)
+                if current is _MISSING or value > current:
+                    _set_path(doc, path, value)
+            elif op == "$min":
+                current = _get_path(doc, path)
+                if current is _MISSING or value < current:
+                    _set_path(doc, path, value)
+            elif op == "$push":
+                current = _get_path(doc, path)
+                _set_path(doc, path, ([] if current is _MISSING else current) + [copy.deepcopy(value)])
+            elif op == "$pull":
+                current = _get_path(doc, path)
+                if current is not _MISSING:
+                    _set_path(doc, path, [item for item in current if not _equals(item, value)])
+            else:
+                raise NotImplementedError(f"Update operator {op}")
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {key for key, flag in projection.items() if flag and key != "_id"}
+    if include:
+        result = {}
+        for key in include:
+            value = _get_path(doc, key)
+            if value is not _MISSING:
+                _set_path(result, key, copy.deepcopy(value))
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    result = copy.deepcopy(doc)
+    for key, flag in projection.items():
+        if not flag:
+            _unset_path(result, key)
+    return result
+
+
+def _sort_docs(docs: List[Dict[str, Any]], spec: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    for key, direction in reversed(spec):
+        docs.sort(key=lambda doc: _sort_key(_get_path(doc, key)), reverse=direction < 0)
+    return docs
+
+
+def _normalize_sort(key_or_list: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return list(key_or_list)
+
+
+def _evaluate(expression: Any, doc: Dict[str, Any]) -> Any:
+    """Evaluate the small subset of aggregation expressions the services use"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get_path(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            op, args = next(iter(expression.items()))
+            if op.startswith("$"):
+                values = [_evaluate(arg, doc) for arg in (args if isinstance(args, list) else [args])]
+                if op == "$dateTrunc":
+                    raise NotImplementedError(op)
+                if op == "$add":
+                    return sum(values)
+                if op == "$multiply":
+                    result = 1
+                    for value in values:
+                        result *= value
+                    return result
+                if op == "$subtract":
+                    difference = values[0] - values[1]
+                    # Subtracting dates gives milliseconds, as on the server
+                    return difference.total_seconds() * 1000 if isinstance(difference, timedelta) else difference
+                if op == "$divide":
+                    return values[0] / values[1]
+                if op == "$min":
+                    return min(value for value in values if value is not None)
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    return _compare(values[0], op, values[1])
+                if op == "$ifNull":
+                    return values[0] if values[0] is not None else values[1]
+                if op == "$eq":
+                    return values[0] == values[1]
+                if op == "$cond":
+                    return values[1] if values[0] else values[2]
+                raise NotImplementedError(f"Expression operator {op}")
+        return {key: _evaluate(value, doc) for key, value in expression.items()}
+    return expression
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class FakeCursor:
+    """Lazy cursor supporting sort/skip/limit/to_list and async iteration"""
+
+    def __init__(self, collection: "FakeCollection", query: Optional[Dict[str, Any]],
+                 projection: Optional[Dict[str, Any]] = None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[Dict[str, Any]]] = None
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "FakeCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "FakeCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "FakeCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "FakeCursor":
+        return self
+
+    def _execute(self) -> List[Dict[str, Any]]:
+        docs = [doc for doc in self._collection._docs if matches(doc, self._query)]
+        if self._sort:
+            docs = _sort_docs(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        await self._collection._call("find")
+        results = self._execute()
+        return results[:length] if length else results
+
+    async def explain(self) -> Dict[str, Any]:
+        raise OperationFailure("explain is not supported by the in-memory database")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._results is None:
+            await self._collection._call("find")
+            self._results = self._execute()
+        if not self._results:
+            raise StopAsyncIteration
+        return self._results.pop(0)
+
+
+class FakeAggregationCursor:
+    def __init__(self, collection: "FakeCollection", pipeline: List[Dict[str, Any]]):
+        self._collection = collection
+        self._pipeline = pipeline
+        self._results: Optional[List[Dict[str, Any]]] = None
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        await self._collection._call("aggregate")
+        results = self._collection._aggregate(self._pipeline)
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._results is None:
+            await self._collection._call("aggregate")
+            self._results = self._collection._aggregate(self._pipeline)
+        if not self._results:
+            raise StopAsyncIteration
+        return self._results.pop(0)
+
+
+class FakeCollection:
+    def __init__(self, database: "FakeDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: List[Dict[str, Any]] = []
+        self._indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", 1)], "unique": True}}
+
+    async def _call(self, op: str) -> None:
+        self.database.client.calls[(self.name, op)] += 1
+        latency = self.database.client.latency
+        await asyncio.sleep(latency() if callable(latency) else latency)
+
+    # Indexes
+
+    async def create_index(self, keys: Any, **options: Any) -> str:
+        await self._call("create_index")
+        keys = _normalize_sort(keys)
+        name = options.get("name") or "_".join(f"{key}_{direction}" for key, direction in keys)
+        existing = self._indexes.get(name)
+        spec = {"key": keys, **{k: v for k, v in options.items() if k != "name"}}
+        if existing and existing != spec:
+            raise OperationFailure(f"Index {name} already exists with different options", code=85)
+        for other_name, other in self._indexes.items():
+            if other_name != name and other["key"] == keys:
+                raise OperationFailure(f"Index already exists with a different name: {other_name}", code=85)
+        if options.get("unique"):
+            # Like the server, refuse to build a unique index over existing duplicates
+            seen = set()
+            for doc in self._docs:
+                if options.get("partialFilterExpression") and not matches(doc, options["partialFilterExpression"]):
+                    continue
+                key = tuple(_freeze(_get_path(doc, field)) for field, _ in keys)
+                if key in seen:
+                    raise DuplicateKeyError(f"E11000 duplicate key error index: {name}", code=11000)
+                seen.add(key)
+        self._indexes[name] = spec
+        return name
+
+    async def drop_index(self, name: str) -> None:
+        await self._call("drop_index")
+        if self._indexes.pop(name, None) is None:
+            raise OperationFailure(f"index not found with name [{name}]", code=27)
+
+    async def index_information(self) -> Dict[str, Dict[str, Any]]:
+        await self._call("index_information")
+        return copy.deepcopy(self._indexes)
+
+    def _check_unique(self, doc: Dict[str, Any], ignore: Optional[Dict[str, Any]] = None) -> None:
+        for name, spec in self._indexes.items():
+            if not spec.get("unique"):
+                continue
+            partial = spec.get("partialFilterExpression")
+            if partial and not matches(doc, partial):
+                continue
+            key = tuple(_freeze(_get_path(doc, field)) for field, _ in spec["key"])
+            for other in self._docs:
+                if other is doc or other is ignore:
+                    continue
+                if partial and not matches(other, partial):
+                    continue
+                if tuple(_freeze(_get_path(other, field)) for field, _ in spec["key"]) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error index: {name}", code=11000)
+
+    # Reads
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+             sort: Any = None, limit: int = 0, **kwargs: Any) -> FakeCursor:
+        cursor = FakeCursor(self, query, projection)
+        if sort:
+            cursor.sort(sort)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+                       sort: Any = None, **kwargs: Any) -> Optional[Dict[str, Any]]:
+        await self._call("find_one")
+        cursor = FakeCursor(self, query, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        results = cursor._execute()
+        return results[0] if results else None
+
+    async def count_documents(self, query: Dict[str, Any], **kwargs: Any) -> int:
+        await self._call("count_documents")
+        return sum(1 for doc in self._docs if matches(doc, query))
+
+    async def estimated_document_count(self) -> int:
+        await self._call("estimated_document_count")
+        return len(self._docs)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs: Any) -> FakeAggregationCursor:
+        return FakeAggregationCursor(self, pipeline)
+
+    def _aggregate(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        docs = [copy.deepcopy(doc) for doc in self._docs]
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = [doc for doc in docs if matches(doc, spec)]
+            elif op == "$limit":
+                docs = docs[:spec]
+            elif op == "$skip":
+                docs = docs[spec:]
+            elif op == "$sort":
+                docs = _sort_docs(docs, list(spec.items()))
+            elif op == "$count":
+                docs = [{spec: len(docs)}]
+            elif op == "$project":
+                projected = []
+                for doc in docs:
+                    if all(value in (0, 1, True, False) for value in spec.values()):
+                        projected.append(_project(doc, spec))
+                        continue
+                    result = {} if spec.get("_id", 1) == 0 else {"_id": doc.get("_id")}
+                    for key, value in spec.items():
+                        if key == "_id" and value == 0:
+                            continue
+                        if value in (1, True):
+                            found = _get_path(doc, key)
+                            if found is not _MISSING:
+                                _set_path(result, key, found)
+                        elif value not in (0, False):
+                            _set_path(result, key, _evaluate(value, doc))
+                    projected.append(result)
+                docs = projected
+            elif op == "$lookup":
+                other = self.database[spec["from"]]
+                for doc in docs:
+                    local = _get_path(doc, spec["localField"])
+                    doc[spec["as"]] = [
+                        copy.deepcopy(candidate) for candidate in other._docs
+                        if _equals(_get_path(candidate, spec["foreignField"]), None if local is _MISSING else local)
+                    ]
+            elif op == "$unwind":
+                path = spec if isinstance(spec, str) else spec["path"]
+                unwound = []
+                for doc in docs:
+                    for item in _get_path(doc, path[1:]) or []:
+                        clone = copy.deepcopy(doc)
+                        _set_path(clone, path[1:], item)
+                        unwound.append(clone)
+                docs = unwound
+            elif op == "$group":
+                groups: Dict[Any, Dict[str, Any]] = {}
+                for doc in docs:
+                    group_id = _evaluate(spec["_id"], doc)
+                    group = groups.setdefault(_freeze(group_id), {"_id": group_id})
+                    for field, accumulator in spec.items():
+                        if field == "_id":
+                            continue
+                        (acc_op, acc_expr), = accumulator.items()
+                        value = _evaluate(acc_expr, doc)
+                        if acc_op == "$sum":
+                            group[field] = group.get(field, 0) + (value or 0)
+                        elif acc_op == "$min":
+                            group[field] = value if field not in group else min(group[field], value)
+                        elif acc_op == "$max":
+                            group[field] = value if field not in group else max(group[field], value)
+                        elif acc_op == "$first":
+                            group.setdefault(field, value)
+                        elif acc_op == "$last":
+                            group[field] = value
+                        elif acc_op == "$push":
+                            group.setdefault(field, []).append(value)
+                        else:
+                            raise NotImplementedError(f"Accumulator {acc_op}")
+                docs = list(groups.values())
+            else:
+                raise NotImplementedError(f"Aggregation stage {op}")
+        return docs
+
+    # Writes
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        doc = copy.deepcopy(document)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self._docs.append(doc)
+        # Like pymongo, the caller's document gets the generated _id
+        document.setdefault("_id", doc["_id"])
+        return doc["_id"]
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs: Any) -> SimpleNamespace:
+        await self._call("insert_one")
+        return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    async def insert_many(self, documents: Iterable[Dict[str, Any]], ordered: bool = True,
+                          **kwargs: Any) -> SimpleNamespace:
+        await self._call("insert_many")
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted, acknowledged=True)
+
+    def _update(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool,
+                many: bool) -> Tuple[int, int, Any]:
+        matched = modified = 0
+        for doc in self._docs:
+            if not matches(doc, query):
+                continue
+            before = copy.deepcopy(doc)
+            _apply_update(doc, update, inserting=False)
+            try:
+                self._check_unique(doc)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+            matched += 1
+            modified += doc != before
+            if not many:
+                break
+        upserted_id = None
+        if not matched and upsert:
+            doc = {
+                key: copy.deepcopy(value) for key, value in query.items()
+                if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+            }
+            _apply_update(doc, update, inserting=True)
+            upserted_id = self._insert(doc)
+        return matched, modified, upserted_id
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                         **kwargs: Any) -> SimpleNamespace:
+        await self._call("update_one")
+        matched, modified, upserted_id = self._update(query, update, upsert, many=False)
+        return SimpleNamespace(matched_count=matched, modified_count=modified, upserted_id=upserted_id)
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                          **kwargs: Any) -> SimpleNamespace:
+        await self._call("update_many")
+        matched, modified, upserted_id = self._update(query, update, upsert, many=True)
+        return SimpleNamespace(matched_count=matched, modified_count=modified, upserted_id=upserted_id)
+
+    async def replace_one(self, query: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False,
+                          **kwargs: Any) -> SimpleNamespace:
+        await self._call("replace_one")
+        return SimpleNamespace(**self._replace(query, replacement, upsert))
+
+    def _replace(self, query: Dict[str, Any], replacement: Dict[str, Any], upsert: bool) -> Dict[str, Any]:
+        for index, doc in enumerate(self._docs):
+            if matches(doc, query):
+                new_doc = {**copy.deepcopy(replacement), "_id": doc["_id"]}
+                self._check_unique(new_doc, ignore=doc)
+                self._docs[index] = new_doc
+                return {"matched_count": 1, "modified_count": int(new_doc != doc), "upserted_id": None}
+        upserted_id = None
+        if upsert:
+            doc = copy.deepcopy(replacement)
+            if "_id" in query and "_id" not in doc:
+                doc["_id"] = query["_id"]
+            upserted_id = self._insert(doc)
+        return {"matched_count": 0, "modified_count": 0, "upserted_id": upserted_id}
+
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any],
+                                  projection: Optional[Dict[str, Any]] = None, sort: Any = None,
+                                  upsert: bool = False, return_document: bool = False,
+                                  **kwargs: Any) -> Optional[Dict[str, Any]]:
+        await self._call("find_one_and_update")
+        candidates = [doc for doc in self._docs if matches(doc, query)]
+        if sort:
+            candidates = _sort_docs(candidates, _normalize_sort(sort))
+        if candidates:
+            doc = candidates[0]
+            before = copy.deepcopy(doc)
+            _apply_update(doc, update, inserting=False)
+            try:
+                self._check_unique(doc)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+            return _project(doc if return_document else before, projection)
+        if not upsert:
+            return None
+        _, _, upserted_id = self._update(query, update, upsert=True, many=False)
+        if not return_document:
+            return None
+        inserted = next(doc for doc in self._docs if doc["_id"] == upserted_id)
+        return _project(inserted, projection)
+
+    async def find_one_and_delete(self, query: Dict[str, Any], sort: Any = None,
+                                  **kwargs: Any) -> Optional[Dict[str, Any]]:
+        await self._call("find_one_and_delete")
+        candidates = [doc for doc in self._docs if matches(doc, query)]
+        if sort:
+            candidates = _sort_docs(candidates, _normalize_sort(sort))
+        if not candidates:
+            return None
+        self._docs.remove(candidates[0])
+        return candidates[0]
+
+    def _delete(self, query: Dict[str, Any], many: bool) -> int:
+        deleted = 0
+        for doc in list(self._docs):
+            if matches(doc, query):
+                self._docs.remove(doc)
+                deleted += 1
+                if not many:
+                    break
+        return deleted
+
+    async def delete_one(self, query: Dict[str, Any], **kwargs: Any) -> SimpleNamespace:
+        await self._call("delete_one")
+        return SimpleNamespace(deleted_count=self._delete(query, many=False))
+
+    async def delete_many(self, query: Dict[str, Any], **kwargs: Any) -> SimpleNamespace:
+        await self._call("delete_many")
+        return SimpleNamespace(deleted_count=self._delete(query, many=True))
+
+    async def bulk_write(self, operations: List[Any], ordered: bool = True, **kwargs: Any) -> SimpleNamespace:
+        await self._call("bulk_write")
+        totals = Counter()
+        upserted_ids = {}
+        errors = []
+        for index, operation in enumerate(operations):
+            try:
+                if isinstance(operation, InsertOne):
+                    self._insert(operation._doc)
+                    totals["inserted_count"] += 1
+                elif isinstance(operation, (UpdateOne, UpdateMany)):
+                    matched, modified, upserted_id = self._update(
+                        operation._filter, operation._doc, operation._upsert,
+                        many=isinstance(operation, UpdateMany)
+                    )
+                    totals["matched_count"] += matched
+                    totals["modified_count"] += modified
+                    if upserted_id is not None:
+                        totals["upserted_count"] += 1
+                        upserted_ids[index] = upserted_id
+                elif isinstance(operation, ReplaceOne):
+                    result = self._replace(operation._filter, operation._doc, operation._upsert)
+                    totals["matched_count"] += result["matched_count"]
+                    totals["modified_count"] += result["modified_count"]
+                    if result["upserted_id"] is not None:
+                        totals["upserted_count"] += 1
+                        upserted_ids[index] = result["upserted_id"]
+                elif isinstance(operation, (DeleteOne, DeleteMany)):
+                    totals["deleted_count"] += self._delete(operation._filter, many=isinstance(operation, DeleteMany))
+                else:
+                    raise NotImplementedError(type(operation).__name__)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, **totals})
+        return SimpleNamespace(
+            inserted_count=totals["inserted_count"],
+            matched_count=totals["matched_count"],
+            modified_count=totals["modified_count"],
+            deleted_count=totals["deleted_count"],
+            upserted_count=totals["upserted_count"],
+            upserted_ids=upserted_ids,
+            acknowledged=True
+        )
+
+    def watch(self, *args: Any, **kwargs: Any):
+        # A stand-alone server: callers are expected to fall back to polling
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+
+class FakeDatabase:
+    def __init__(self, client: "FakeMotorClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    async def command(self, command: Any, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        if command == "ping":
+            return {"ok": 1}
+        raise NotImplementedError(f"Command {command}")
+
+
+class FakeMotorClient:
+    """Drop-in for AsyncIOMotorClient backed by in-process lists"""
+
+    # Seconds (or a callable returning seconds) slept before every call
+    latency: Any = 0.0
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self.calls: Counter = Counter()
+        self._databases: Dict[str, FakeDatabase] = {}
+        self.admin = self["admin"]
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self, name)
+        return self._databases[name]
+
+    def close(self) -> None:
+        pass
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
@@ -0,0 +1,75 @@
+"""Minimal in-process SMTP server for exercising the outbox dispatcher
+
+Speaks just enough SMTP (EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT) for
+smtplib, keeps received messages in memory and can add per-message latency
+or reject recipients to test retries.
+"""
+import asyncio
+from typing import List, Optional, Set
+
+
+class FakeSmtpServer:
+    """Local SMTP stand-in listening on 127.0.0.1"""
+
+    def __init__(self, latency: float = 0.0, reject: Optional[Set[str]] = None):
+        self.latency = latency
+        self.reject = reject or set()
+        self.messages: List[bytes] = []
+        self.connections = 0
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        async def reply(line: str) -> None:
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 fake-smtp ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    await reply("250-fake-smtp")
+                    await reply("250 8BITMIME")
+                elif verb == "HELO":
+                    await reply("250 fake-smtp")
+                elif verb == "RCPT":
+                    address = command.partition(":")[2].strip().strip("<>")
+                    await reply("550 rejected" if address in self.reject else "250 OK")
+                elif verb == "DATA":
+                    await reply("354 end with .")
+                    data = bytearray()
+                    while True:
+                        chunk = await reader.readline()
+                        if chunk in (b".\r\n", b".\n", b""):
+                            break
+                        data += chunk
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages.append(bytes(data))
+                    await reply("250 queued")
+                elif verb == "QUIT":
+                    await reply("221 bye")
+                    break
+                elif verb in ("MAIL", "RSET", "NOOP"):
+                    await reply("250 OK")
+                else:
+                    await reply("502 not implemented")
+        finally:
+            writer.close()
@@ -0,0 +1,114 @@
+"""Offline stand-in for emergentintegrations' Stripe checkout client
+
+``install()`` registers this module under the import path the services use,
+so the app can be benchmarked without the real package or network access.
+Webhook bodies are JSON ``{"id", "session_id", "payment_status"}`` and any
+signature other than ``"invalid"`` is accepted.
+"""
+import asyncio
+import json
+import sys
+import types
+import uuid
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+MODULE_PATH = "emergentintegrations.payments.stripe.checkout"
+
+
+class CheckoutSessionRequest(BaseModel):
+    amount: float
+    currency: str
+    success_url: str
+    cancel_url: str
+    metadata: Optional[Dict[str, str]] = None
+
+
+class CheckoutSessionResponse(BaseModel):
+    url: str
+    session_id: str
+
+
+class CheckoutStatusResponse(BaseModel):
+    status: str
+    payment_status: str
+    amount_total: int
+    currency: str
+    metadata: Dict[str, str] = {}
+
+
+class CheckoutWebhookResponse(BaseModel):
+    event_type: str
+    event_id: str
+    session_id: str
+    payment_status: str
+    metadata: Dict[str, str] = {}
+
+
+class StripeCheckout:
+    """Fake client keeping session state in memory"""
+
+    # Seconds slept before every call, shared by all instances
+    latency: float = 0.0
+    calls: Dict[str, int] = {}
+    sessions: Dict[str, Dict[str, Any]] = {}
+
+    def __init__(self, api_key: str, webhook_url: str):
+        self.api_key = api_key
+        self.webhook_url = webhook_url
+
+    async def _call(self, name: str) -> None:
+        StripeCheckout.calls[name] = StripeCheckout.calls.get(name, 0) + 1
+        await asyncio.sleep(StripeCheckout.latency)
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        await self._call("create_checkout_session")
+        session_id = f"cs_bench_{uuid.uuid4().hex}"
+        StripeCheckout.sessions[session_id] = {
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": int(round(request.amount * 100)),
+            "currency": request.currency,
+            "metadata": request.metadata or {}
+        }
+        return CheckoutSessionResponse(url=f"https://checkout.stripe.test/{session_id}", session_id=session_id)
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        await self._call("get_checkout_status")
+        session = StripeCheckout.sessions.get(session_id) or {
+            "status": "open", "payment_status": "unpaid", "amount_total": 2000, "currency": "gbp", "metadata": {}
+        }
+        return CheckoutStatusResponse(**session)
+
+    async def handle_webhook(self, body: bytes, signature: str) -> CheckoutWebhookResponse:
+        await self._call("handle_webhook")
+        if signature == "invalid":
+            raise ValueError("Invalid signature")
+        event = json.loads(body)
+        payment_status = event.get("payment_status", "paid")
+        session = StripeCheckout.sessions.setdefault(event["session_id"], {
+            "status": "open", "payment_status": "unpaid", "amount_total": 2000, "currency": "gbp", "metadata": {}
+        })
+        session["payment_status"] = payment_status
+        if payment_status == "paid":
+            session["status"] = "complete"
+        return CheckoutWebhookResponse(
+            event_type=event.get("type", "checkout.session.completed"),
+            event_id=event.get("id") or f"evt_{uuid.uuid4().hex}",
+            session_id=event["session_id"],
+            payment_status=payment_status,
+            metadata=event.get("metadata", {})
+        )
+
+
+def install() -> None:
+    """Register this module as emergentintegrations.payments.stripe.checkout"""
+    parts = MODULE_PATH.split(".")
+    for depth in range(1, len(parts)):
+        name = ".".join(parts[:depth])
+        if name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = []
+            sys.modules[name] = package
+    sys.modules[MODULE_PATH] = sys.modules[__name__]
@@ -0,0 +1,74 @@
+"""Measure email outbox dispatch throughput against a local SMTP stand-in
+
+Queues download-links emails in the in-memory Mongo stand-in and drains them
+through OutboxDispatcher over a real SMTP connection to FakeSmtpServer.
+
+    cd backend
+    python -m bench.outbox --messages 500 --max-per-second 200
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+from bench.fake_mongo import FakeMotorClient
+from bench.fake_smtp import FakeSmtpServer
+from email_outbox import EmailOutbox, OutboxDispatcher, SmtpTransport
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    smtp = FakeSmtpServer(latency=args.smtp_latency_ms / 1000, reject={"bounce@bench.test"})
+    port = await smtp.start()
+    db = FakeMotorClient()["guru_killer_bench"]
+    outbox = EmailOutbox(db)
+
+    links = [{"name": "AI Lead Generation System", "size": "15 MB", "url": "https://bench.test/file"}]
+    results = [
+        {"email": f"buyer{i}@bench.test", "session_id": f"cs_outbox_{i:06d}", "package_type": "guru_killer_main",
+         "download_links": links}
+        for i in range(args.messages)
+    ]
+    results.append({"email": "bounce@bench.test", "session_id": "cs_outbox_bounce",
+                    "package_type": "guru_killer_main", "download_links": links})
+    queued = await outbox.enqueue_many(results)
+
+    dispatcher = OutboxDispatcher(
+        db,
+        SmtpTransport("127.0.0.1", port, starttls=False),
+        batch_size=args.batch_size,
+        max_per_second=args.max_per_second
+    )
+    started = time.perf_counter()
+    while await dispatcher.dispatch_once():
+        pass
+    elapsed = time.perf_counter() - started
+    await dispatcher.transport.close()
+    await smtp.stop()
+
+    stats = await dispatcher.get_stats()
+    return {
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "queued": queued,
+        "delivered": len(smtp.messages),
+        "smtp_connections": smtp.connections,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(smtp.messages) / elapsed, 1) if elapsed else None,
+        "queue_depth": stats["queue_depth"],
+        "failed": stats["failed"]
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--max-per-second", type=float, default=200.0)
+    parser.add_argument("--smtp-latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
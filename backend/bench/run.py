@@ -0,0 +1,366 @@
+"""Offline load test and latency benchmark for every /api route
+
+Starts the FastAPI app in-process against the in-memory Mongo stand-in and
+the fake Stripe client, drives each route at a fixed concurrency and writes
+throughput, latency percentiles and calls per request as JSON.
+
+    cd backend
+    python -m bench.run --requests 500 --concurrency 50 --output bench.json
+    python -m bench.run --db-latency-ms 2 --stripe-latency-ms 150 --baseline bench.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from bench import fake_stripe
+from bench.fake_mongo import FakeMotorClient
+
+BENCH_FILE = "ai-lead-generation.zip"
+BENCH_FILE_SIZE = 1024 * 1024
+BENCH_ADMIN_KEY = "bench-admin-key"
+
+
+@dataclass
+class Fixtures:
+    """Seeded sessions handed out to the scenarios"""
+    paid: List[str] = field(default_factory=list)
+    open: List[str] = field(default_factory=list)
+    emails: Dict[str, str] = field(default_factory=dict)
+    signed_urls: List[str] = field(default_factory=list)
+    packages_etag: str = ""
+
+
+@dataclass
+class Scenario:
+    """One route under test"""
+    name: str
+    method: str
+    path: Callable[[int, Fixtures], str]
+    body: Optional[Callable[[int, Fixtures], Any]] = None
+    headers: Optional[Callable[[int, Fixtures], Dict[str, str]]] = None
+    expected: tuple = (200,)
+    raw_body: bool = False
+
+
+def _pick(sessions: List[str], i: int) -> str:
+    return sessions[i % len(sessions)]
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("health", "GET", lambda i, f: "/api/"),
+    Scenario("packages_list", "GET", lambda i, f: "/api/packages"),
+    Scenario(
+        "packages_list_revalidate", "GET", lambda i, f: "/api/packages",
+        headers=lambda i, f: {"If-None-Match": f.packages_etag},
+        expected=(304,)
+    ),
+    Scenario("package_get", "GET", lambda i, f: "/api/packages/guru_killer_main"),
+    Scenario(
+        "checkout_create", "POST", lambda i, f: "/api/checkout/session",
+        body=lambda i, f: {"package_id": "guru_killer_main", "origin_url": "https://bench.test"}
+    ),
+    Scenario(
+        "checkout_create_consulting", "POST", lambda i, f: "/api/checkout/session",
+        body=lambda i, f: {
+            "package_id": "guru_killer_consulting",
+            "origin_url": "https://bench.test",
+            "email": f.emails[_pick(f.paid, i)]
+        }
+    ),
+    Scenario("checkout_status_open", "GET", lambda i, f: f"/api/checkout/status/{_pick(f.open, i)}"),
+    Scenario("checkout_status_paid", "GET", lambda i, f: f"/api/checkout/status/{_pick(f.paid, i)}"),
+    Scenario("checkout_status_stream", "GET", lambda i, f: f"/api/checkout/status/{_pick(f.paid, i)}/stream"),
+    Scenario(
+        "webhook", "POST", lambda i, f: "/api/webhook/stripe",
+        body=lambda i, f: json.dumps({"id": f"evt_{uuid.uuid4().hex}", "session_id": _pick(f.open, i)}).encode(),
+        headers=lambda i, f: {"Stripe-Signature": "bench"},
+        raw_body=True
+    ),
+    Scenario(
+        "webhook_inbox_stats", "GET", lambda i, f: "/api/webhook/inbox/stats",
+        headers=lambda i, f: {"X-Admin-Key": BENCH_ADMIN_KEY}
+    ),
+    Scenario(
+        "downloads_generate", "POST", lambda i, f: "/api/downloads/generate",
+        body=lambda i, f: {
+            "email": f.emails[_pick(f.paid, i)],
+            "session_id": _pick(f.paid, i),
+            "package_type": "guru_killer_main"
+        }
+    ),
+    Scenario(
+        "downloads_bulk_50", "POST", lambda i, f: "/api/admin/downloads/bulk",
+        body=lambda i, f: {"session_ids": [_pick(f.paid, i + n) for n in range(50)]},
+        headers=lambda i, f: {"X-Admin-Key": BENCH_ADMIN_KEY}
+    ),
+    Scenario("downloads_get", "GET", lambda i, f: f"/api/downloads/{_pick(f.paid, i)}"),
+    Scenario(
+        "downloads_fetch", "GET", lambda i, f: _pick(f.signed_urls, i),
+        expected=(200, 503)
+    ),
+    Scenario(
+        "downloads_fetch_range", "GET", lambda i, f: _pick(f.signed_urls, i),
+        headers=lambda i, f: {"Range": "bytes=0-65535"},
+        expected=(206, 503)
+    ),
+    Scenario("stats_public", "GET", lambda i, f: "/api/stats/public"),
+    Scenario("transaction_get", "GET", lambda i, f: f"/api/transactions/{_pick(f.paid, i)}"),
+    Scenario("metrics", "GET", lambda i, f: "/metrics", headers=lambda i, f: {"X-Admin-Key": BENCH_ADMIN_KEY}),
+]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=25, help="in-flight requests per route")
+    parser.add_argument("--db-latency-ms", type=float, default=0.5, help="latency injected per Mongo call")
+    parser.add_argument("--stripe-latency-ms", type=float, default=50.0, help="latency injected per Stripe call")
+    parser.add_argument("--seed-transactions", type=int, default=2000, help="transactions seeded before the run")
+    parser.add_argument("--routes", nargs="*", help="only run these scenarios")
+    parser.add_argument("--output", help="write results JSON to this file")
+    parser.add_argument("--baseline", help="compare against a previous results JSON")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed relative p95/throughput regression against the baseline")
+    return parser.parse_args(argv)
+
+
+def configure_environment(storage_dir: str) -> None:
+    """Point the app at offline dependencies before it is imported"""
+    os.environ["MONGO_URL"] = "mongodb://bench.invalid:27017"
+    os.environ["DB_NAME"] = "guru_killer_bench"
+    os.environ.setdefault("STRIPE_API_KEY", "sk_test_bench")
+    os.environ.setdefault("DOWNLOAD_SIGNING_KEYS", "bench:bench-secret")
+    os.environ["ADMIN_API_KEY"] = BENCH_ADMIN_KEY
+    os.environ["DOWNLOAD_STORAGE_DIR"] = storage_dir
+    # The webhook scenario wakes the inbox worker directly; idle polling would skew other routes
+    os.environ.setdefault("WEBHOOK_POLL_INTERVAL_SECONDS", "3600")
+    # Keep per-request info lines out of the measurements
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Every bench request comes from one client, so rate limits would turn most of them into 429s
+    for rule in ("CHECKOUT_IP", "STATUS_IP", "STATUS_SESSION"):
+        os.environ.setdefault(f"RATE_LIMIT_{rule}", "1000000000/1")
+
+    fake_stripe.install()
+    import motor.motor_asyncio
+    motor.motor_asyncio.AsyncIOMotorClient = FakeMotorClient
+
+
+async def seed(server: Any, count: int) -> Fixtures:
+    """Insert paid and open transactions plus their downloads records"""
+    fixtures = Fixtures()
+    now = datetime.utcnow()
+    transactions = []
+    downloads = []
+    for i in range(count):
+        session_id = f"cs_seed_{i:06d}_{uuid.uuid4().hex[:8]}"
+        paid = i % 2 == 0
+        email = f"buyer{i}@bench.test"
+        transactions.append({
+            "session_id": session_id,
+            "package_id": "guru_killer_main",
+            "amount": 20.0,
+            "currency": "gbp",
+            "email": email if paid else "",
+            "payment_status": "paid" if paid else "initiated",
+            "metadata": {"package_id": "guru_killer_main", "source": "bench"},
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now - timedelta(minutes=i)
+        })
+        if paid:
+            fixtures.paid.append(session_id)
+            fixtures.emails[session_id] = email
+            downloads.append({
+                "id": str(uuid.uuid4()),
+                "email": email,
+                "session_id": session_id,
+                "package_type": "guru_killer_main",
+                "download_links": [],
+                "generated_at": now,
+                "access_expires": now + timedelta(days=30)
+            })
+        else:
+            fixtures.open.append(session_id)
+            fake_stripe.StripeCheckout.sessions[session_id] = {
+                "status": "open", "payment_status": "unpaid", "amount_total": 2000,
+                "currency": "gbp", "metadata": {}
+            }
+
+    services = server.app.state.services
+    await services.db.payment_transactions.insert_many(transactions)
+    await services.db.downloads.insert_many(downloads)
+    await services.payment_service.stats.rebuild()
+    await services.payment_service.entitlements.backfill()
+
+    fixtures.packages_etag = server.packages_response.etag
+
+    signer = services.download_service.url_signer
+    expires = int(time.time()) + 3600
+    for session_id in fixtures.paid:
+        key_id, signature = signer.sign(session_id, BENCH_FILE, expires)
+        fixtures.signed_urls.append(
+            f"/api/downloads/fetch/{session_id}/{BENCH_FILE}?expires={expires}&kid={key_id}&sig={signature}"
+        )
+    return fixtures
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, fixtures: Fixtures,
+                       requests: int, concurrency: int, mongo: FakeMotorClient) -> Dict[str, Any]:
+    latencies: List[float] = []
+    status_counts: Dict[int, int] = {}
+    errors = 0
+    counter = itertools.count()
+    db_before = mongo.total_calls()
+    stripe_before = sum(fake_stripe.StripeCheckout.calls.values())
+
+    async def worker() -> None:
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            kwargs: Dict[str, Any] = {}
+            if scenario.body:
+                body = scenario.body(i, fixtures)
+                kwargs["content" if scenario.raw_body else "json"] = body
+            if scenario.headers:
+                kwargs["headers"] = scenario.headers(i, fixtures)
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, scenario.path(i, fixtures), **kwargs)
+                status = response.status_code
+            except Exception:
+                status = 0
+            latencies.append((time.perf_counter() - started) * 1000)
+            status_counts[status] = status_counts.get(status, 0) + 1
+            if status not in scenario.expected:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "status_counts": {str(code): count for code, count in sorted(status_counts.items())},
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+        "db_calls_per_request": round((mongo.total_calls() - db_before) / requests, 3),
+        "stripe_calls_per_request": round(
+            (sum(fake_stripe.StripeCheckout.calls.values()) - stripe_before) / requests, 3
+        )
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """List the routes that regressed against a baseline run"""
+    regressions = []
+    for name, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+        if current["db_calls_per_request"] > previous["db_calls_per_request"]:
+            regressions.append(
+                f"{name}: db calls/request {previous['db_calls_per_request']} -> {current['db_calls_per_request']}"
+            )
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="guru-bench-") as storage_dir:
+        with open(Path(storage_dir) / BENCH_FILE, "wb") as bench_file:
+            bench_file.write(os.urandom(BENCH_FILE_SIZE))
+
+        configure_environment(storage_dir)
+        import server
+
+        FakeMotorClient.latency = args.db_latency_ms / 1000
+        fake_stripe.StripeCheckout.latency = args.stripe_latency_ms / 1000
+
+        scenarios = [s for s in SCENARIOS if not args.routes or s.name in args.routes]
+        routes: Dict[str, Any] = {}
+        async with server.app.router.lifespan_context(server.app):
+            mongo = server.app.state.services.client
+            fixtures = await seed(server, args.seed_transactions)
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench.test") as client:
+                for scenario in scenarios:
+                    routes[scenario.name] = await run_scenario(
+                        client, scenario, fixtures, args.requests, args.concurrency, mongo
+                    )
+
+    return {
+        "meta": {
+            "generated_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "db_latency_ms": args.db_latency_ms,
+            "stripe_latency_ms": args.stripe_latency_ms,
+            "seed_transactions": args.seed_transactions
+        },
+        "routes": routes
+    }
+
+
+def print_table(results: Dict[str, Any]) -> None:
+    header = f"{'route':<26}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'db/req':>8}{'stripe/req':>11}{'err':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["routes"].items():
+        print(f"{name:<26}{r['throughput_rps']:>10.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['db_calls_per_request']:>8.2f}{r['stripe_calls_per_request']:>11.2f}"
+              f"{r['errors']:>6}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    print_table(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional
+
+from metrics import CIRCUIT_BREAKER_STATE, CIRCUIT_BREAKER_TRIPS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_GAUGE_VALUES = {CLOSED: 0.0, HALF_OPEN: 0.5, OPEN: 1.0}
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker over the last ``window`` calls
+
+    While closed every call goes through. Once at least ``min_calls`` of
+    the last ``window`` calls have finished and the share of failures
+    reaches ``failure_threshold``, the breaker opens and ``allow()`` refuses
+    calls for ``open_seconds``. It then lets one probe through at a time;
+    a successful probe closes it again and a failed one re-opens it.
+
+    State is per process, so each worker trips on what it sees itself.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_threshold: float = 0.5,
+        open_seconds: float = 30.0
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        CIRCUIT_BREAKER_STATE.set(0.0, name=name)
+        self.trips = 0
+        self._outcomes: Deque[bool] = deque(maxlen=self.window)
+        self._opened_at = 0.0
+        self._last_tripped_at: Optional[datetime] = None
+        self._probing = False
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; a True in half-open state reserves the probe"""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                return False
+            self._set_state(HALF_OPEN)
+            logger.info("Circuit %s half-open, probing", self.name)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self._probing = False
+            self._set_state(CLOSED)
+            self._outcomes.clear()
+            logger.info("Circuit %s closed", self.name)
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._probing = False
+            self._trip()
+            return
+        self._outcomes.append(False)
+        if self.state == CLOSED and len(self._outcomes) >= self.min_calls and self.failure_rate() >= self.failure_threshold:
+            self._trip()
+
+    def release(self) -> None:
+        """Give back a half-open probe that ended without a verdict, e.g. when cancelled"""
+        self._probing = False
+
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def _trip(self) -> None:
+        self._set_state(OPEN)
+        self.trips += 1
+        CIRCUIT_BREAKER_TRIPS.inc(name=self.name)
+        self._opened_at = time.monotonic()
+        self._last_tripped_at = datetime.utcnow()
+        logger.warning(
+            "Circuit %s opened for %ss (failure rate %.0f%% over %s calls)",
+            self.name, self.open_seconds, self.failure_rate() * 100, len(self._outcomes)
+        )
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_BREAKER_STATE.set(_GAUGE_VALUES[state], name=self.name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Breaker state and trip count for monitoring"""
+        return {
+            "name": self.name,
+            "state": self.state,
+            "trips": self.trips,
+            "failure_rate": round(self.failure_rate(), 3),
+            "window_calls": len(self._outcomes),
+            "retry_after_seconds": round(self.retry_after(), 1),
+            "last_tripped_at": self._last_tripped_at
+        }
@@ -0,0 +1,41 @@
+import os
+from typing import Any, Dict
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from metrics import MongoCommandMetrics
+
+# Optional pymongo settings passed through only when set, as (env var, client option)
+OPTIONAL_TIMEOUTS = (
+    ('MONGO_SOCKET_TIMEOUT_MS', 'socketTimeoutMS'),
+    ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS'),
+    ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS'),
+)
+
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Connection pool and timeout settings for the Motor client
+
+    Every worker process opens its own pool, so the server sees up to
+    workers x MONGO_MAX_POOL_SIZE connections.
+    """
+    options: Dict[str, Any] = {
+        'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '10000')),
+    }
+    for env_var, option in OPTIONAL_TIMEOUTS:
+        value = os.environ.get(env_var)
+        if value:
+            options[option] = int(value)
+    return options
+
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    """Create a Motor client for the current process and event loop"""
+    return AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        event_listeners=[MongoCommandMetrics()],
+        **mongo_client_options()
+    )
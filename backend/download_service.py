@@ -1,17 +1,60 @@
 import os
 import logging
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 from motor.motor_asyncio import AsyncIOMotorClient
-from models import DownloadLink, PACKAGES
-from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from models import DownloadLink, DownloadFile, DOWNLOAD_CATALOG, PACKAGES, transaction_paid_at
+from url_signing import UrlSigner
+from entitlements import normalize_email
+from email_outbox import EmailOutbox
+from cache import TTLCache, MISSING
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, urlencode
+import time
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Days of download access granted per purchase
+ACCESS_DAYS = 30
+
+# Transaction fields access expiry is computed from
+ACCESS_FIELDS = {"paid_at": 1, "updated_at": 1, "created_at": 1}
+
+# Hours a signed download URL stays valid
+URL_TTL_HOURS = 48
+
+# Links signed less than this long ago are handed out again instead of being re-signed
+LINK_REUSE_HOURS = URL_TTL_HOURS // 2
+
+def access_expires_at(transaction: Dict[str, Any]) -> datetime:
+    """End of the download window, counted from when the transaction was paid"""
+    return transaction_paid_at(transaction) + timedelta(days=ACCESS_DAYS)
+
 class DownloadService:
-    def __init__(self, db: AsyncIOMotorClient):
+    def __init__(self, db: AsyncIOMotorClient, url_signer: Optional[UrlSigner] = None,
+                 outbox: Optional[EmailOutbox] = None):
         self.db = db
+        self.url_signer = url_signer or UrlSigner.from_env()
+        self.outbox = outbox or EmailOutbox(db)
+        self._entitlements = TTLCache(
+            maxsize=int(os.environ.get('ENTITLEMENT_CACHE_SIZE', '10000')),
+            ttl=float(os.environ.get('ENTITLEMENT_CACHE_TTL_SECONDS', '300'))
+        )
+        self.download_base_url = os.environ.get(
+            'DOWNLOAD_BASE_URL', 'https://secure-downloads.gurukiller.com'
+        ).rstrip('/')
+        missing = set(PACKAGES) - set(DOWNLOAD_CATALOG)
+        if missing:
+            raise ValueError(f"No download catalog entry for packages: {', '.join(sorted(missing))}")
+        self.catalog = DOWNLOAD_CATALOG
+        self.filenames = frozenset(
+            catalog_file.filename
+            for catalog_files in DOWNLOAD_CATALOG.values()
+            for catalog_file in catalog_files
+            if catalog_file.filename
+        )
     
     async def generate_download_links(self, email: str, session_id: str, package_type: str) -> List[DownloadLink]:
         """Generate secure download links for a completed purchase"""
@@ -25,92 +68,173 @@ class DownloadService:
             if not transaction:
                 raise HTTPException(status_code=404, detail="Payment not found or not completed")
             
+            now = datetime.utcnow()
+            access_expires = access_expires_at(transaction)
+            if access_expires <= now:
+                raise HTTPException(status_code=403, detail="Download access has expired")
+            
             # Verify package exists
-            if package_type not in PACKAGES:
+            catalog_files = self.catalog.get(package_type)
+            if catalog_files is None:
                 raise HTTPException(status_code=400, detail="Invalid package type")
             
-            package = PACKAGES[package_type]
-            
-            # Generate download links based on package type
-            download_links = []
-            
-            if package_type == "guru_killer_main":
+            # Refreshes and retries get the links already handed out while they have time left
+            key = {"session_id": session_id, "package_type": package_type}
+            existing = await self.db.downloads.find_one(key, {"_id": 0, "download_links": 1, "last_generated_at": 1})
+            if existing and existing.get("last_generated_at", datetime.min) > now - timedelta(hours=LINK_REUSE_HOURS):
+                download_links = [DownloadLink(**link) for link in existing["download_links"]]
+            else:
+                # Only the URLs are built per request; names and sizes come from the catalog
                 download_links = [
-                    DownloadLink(
-                        name="AI Lead Generation System",
-                        url=self._generate_secure_url("ai-lead-generation.zip"),
-                        size="15 MB"
-                    ),
-                    DownloadLink(
-                        name="Content Creation Automation", 
-                        url=self._generate_secure_url("content-automation.zip"),
-                        size="12 MB"
-                    ),
-                    DownloadLink(
-                        name="Customer Support AI Agent",
-                        url=self._generate_secure_url("support-agent.zip"), 
-                        size="18 MB"
-                    ),
-                    DownloadLink(
-                        name="Sales Funnel Optimizer",
-                        url=self._generate_secure_url("funnel-optimizer.zip"),
-                        size="8 MB"
-                    ),
-                    DownloadLink(
-                        name="Complete Implementation Guide",
-                        url=self._generate_secure_url("implementation-guide.pdf"),
-                        size="5 MB"
-                    ),
-                    DownloadLink(
-                        name="Video Walkthrough Series",
-                        url=self._generate_secure_url("video-walkthroughs.zip"),
-                        size="156 MB"
-                    )
+                    self._build_link(catalog_file, session_id, access_expires) for catalog_file in catalog_files
                 ]
+                
+                # Upsert so the session keeps a single record instead of adding rows
+                await self.db.downloads.update_one(
+                    key,
+                    {
+                        "$set": {
+                            "download_links": [link.dict() for link in download_links],
+                            "last_generated_at": now,
+                            "access_expires": access_expires
+                        },
+                        "$setOnInsert": {
+                            "id": str(uuid.uuid4()),
+                            "email": email,
+                            "generated_at": now
+                        }
+                    },
+                    upsert=True
+                )
+                self.invalidate_session(session_id)
             
-            elif package_type == "guru_killer_consulting":
-                download_links = [
-                    DownloadLink(
-                        name="Consultation Booking Link",
-                        url=self._generate_booking_url(session_id),
-                        size="N/A"
-                    ),
-                    DownloadLink(
-                        name="Pre-Session Preparation Guide",
-                        url=self._generate_secure_url("pre-session-guide.pdf"),
-                        size="2 MB"
-                    )
-                ]
-            
-            # Store the generated downloads in database
-            download_record = {
-                "id": str(uuid.uuid4()),
-                "email": email,
-                "session_id": session_id,
-                "package_type": package_type,
-                "download_links": [link.dict() for link in download_links],
-                "generated_at": datetime.utcnow(),
-                "access_expires": datetime.utcnow() + timedelta(days=30)  # 30-day access
-            }
-            
-            await self.db.downloads.insert_one(download_record)
+            # Delivered by the outbox dispatcher, so the mail server never sits on this request
+            await self.outbox.enqueue_download_links(
+                transaction.get("email") or email, session_id, package_type, download_links
+            )
             
-            logger.info(f"Generated download links for session: {session_id}, package: {package_type}")
+            logger.info("Generated download links for session: %s, package: %s", session_id, package_type)
             
             return download_links
             
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Error generating download links: {str(e)}")
+            logger.error("Error generating download links: %s", e)
             raise HTTPException(status_code=500, detail="Failed to generate download links")
     
-    def _generate_secure_url(self, filename: str) -> str:
-        """Generate a secure, time-limited download URL"""
-        # In production, this would be a signed URL to cloud storage
-        # For now, we'll use a mock URL structure
-        token = str(uuid.uuid4())
-        return f"https://secure-downloads.gurukiller.com/{token}/{filename}?expires={int((datetime.utcnow() + timedelta(hours=48)).timestamp())}"
+    async def generate_bulk(self, session_ids: List[str], emails: List[str],
+                            batch_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Regenerate links for many paid sessions, yielding one result per session
+        
+        Sessions are matched by id or buyer email with a single query, and each
+        batch of results is written with one bulk_write. Sessions whose access
+        window has ended are reported as expired, and requested ids and emails
+        without a paid transaction as not_found at the end.
+        """
+        batch_size = batch_size or int(os.environ.get('BULK_DOWNLOAD_BATCH_SIZE', '500'))
+        emails = [normalize_email(email) for email in emails]
+        clauses = []
+        if session_ids:
+            clauses.append({"session_id": {"$in": session_ids}})
+        if emails:
+            clauses.append({"email": {"$in": emails}})
+        if not clauses:
+            return
+        
+        found_sessions, found_emails = set(), set()
+        cursor = self.db.payment_transactions.find(
+            {"payment_status": "paid", "$or": clauses},
+            {"session_id": 1, "email": 1, "package_id": 1, **ACCESS_FIELDS}
+        )
+        batch = []
+        async for transaction in cursor:
+            found_sessions.add(transaction["session_id"])
+            found_emails.add(transaction.get("email"))
+            batch.append(transaction)
+            if len(batch) >= batch_size:
+                for result in await self._generate_batch(batch):
+                    yield result
+                batch = []
+        if batch:
+            for result in await self._generate_batch(batch):
+                yield result
+        
+        for session_id in session_ids:
+            if session_id not in found_sessions:
+                yield {"session_id": session_id, "status": "not_found"}
+        for email in emails:
+            if email not in found_emails:
+                yield {"email": email, "status": "not_found"}
+    
+    async def _generate_batch(self, transactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Build and store links for a batch of paid transactions with one bulk_write"""
+        now = datetime.utcnow()
+        operations, results, expired = [], [], []
+        for transaction in transactions:
+            session_id, package_type = transaction["session_id"], transaction["package_id"]
+            access_expires = access_expires_at(transaction)
+            if access_expires <= now:
+                expired.append({"session_id": session_id, "email": transaction.get("email"), "status": "expired"})
+                continue
+            links = [
+                self._build_link(catalog_file, session_id, access_expires).dict()
+                for catalog_file in self.catalog[package_type]
+            ]
+            # Same record semantics as generate_download_links
+            operations.append(UpdateOne(
+                {"session_id": session_id, "package_type": package_type},
+                {
+                    "$set": {"download_links": links, "last_generated_at": now, "access_expires": access_expires},
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "email": transaction.get("email", ""), "generated_at": now}
+                },
+                upsert=True
+            ))
+            results.append({
+                "session_id": session_id,
+                "email": transaction.get("email"),
+                "package_type": package_type,
+                "status": "ok",
+                "download_links": links
+            })
+        
+        if operations:
+            await self.db.downloads.bulk_write(operations, ordered=True)
+            for result in results:
+                self.invalidate_session(result["session_id"])
+            await self.outbox.enqueue_many(results)
+        
+        logger.info("Generated download links for %s sessions in bulk, %s expired", len(results), len(expired))
+        return results + expired
+    
+    def _build_link(self, catalog_file: DownloadFile, session_id: str, access_expires: datetime) -> DownloadLink:
+        """Build the download link for one catalog entry"""
+        if catalog_file.kind == "booking":
+            url = self._generate_booking_url(session_id)
+        else:
+            url = self._generate_secure_url(session_id, catalog_file.filename, access_expires)
+        return DownloadLink(name=catalog_file.name, url=url, size=catalog_file.size)
+    
+    def _generate_secure_url(self, session_id: str, filename: str, access_expires: datetime) -> str:
+        """Generate a signed, time-limited download URL that never outlives the access window"""
+        expires = min(
+            int(time.time()) + URL_TTL_HOURS * 3600,
+            int(access_expires.replace(tzinfo=timezone.utc).timestamp())
+        )
+        key_id, signature = self.url_signer.sign(session_id, filename, expires)
+        query = urlencode({"expires": expires, "kid": key_id, "sig": signature})
+        return f"{self.download_base_url}/api/downloads/fetch/{quote(session_id)}/{quote(filename)}?{query}"
+    
+    def verify_signed_url(self, session_id: str, filename: str, expires: int, key_id: str, signature: str) -> None:
+        """Check a signed download URL without touching the database"""
+        if filename not in self.filenames:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        valid, expired = self.url_signer.verify(session_id, filename, expires, key_id, signature)
+        if not valid:
+            raise HTTPException(status_code=403, detail="Invalid download signature")
+        if expired:
+            raise HTTPException(status_code=410, detail="Download link has expired")
     
     def _generate_booking_url(self, session_id: str) -> str:
         """Generate a calendar booking URL for consulting sessions"""
@@ -120,32 +244,57 @@ class DownloadService:
     async def get_downloads_by_session(self, session_id: str) -> Optional[dict]:
         """Retrieve existing download record by session ID"""
         try:
-            download_record = await self.db.downloads.find_one({"session_id": session_id})
+            download_record = await self.db.downloads.find_one({"session_id": session_id}, {"_id": 0})
             return download_record
         except Exception as e:
-            logger.error(f"Error retrieving downloads: {str(e)}")
+            logger.error("Error retrieving downloads: %s", e)
             return None
     
+    def invalidate_session(self, session_id: Optional[str]) -> None:
+        """Drop cached download entitlements for a session, or all of them for None"""
+        if session_id is None:
+            self._entitlements.clear()
+        else:
+            self._entitlements.invalidate(session_id)
+    
     async def verify_download_access(self, email: str, session_id: str) -> bool:
         """Verify user has access to downloads"""
+        # Entries are keyed by session so a payment update can drop them in O(1)
+        cached = self._entitlements.get(session_id)
+        if cached is not MISSING and email in cached:
+            return cached[email]
+        
         try:
-            # Check if transaction exists and is paid
-            transaction = await self.db.payment_transactions.find_one({
-                "session_id": session_id,
-                "email": email,
-                "payment_status": "paid"
-            })
-            
-            if not transaction:
-                return False
-            
-            # Check if downloads haven't expired
-            download_record = await self.db.downloads.find_one({"session_id": session_id})
-            if download_record and download_record["access_expires"] > datetime.utcnow():
-                return True
-            
-            return bool(transaction)  # Allow re-generation if paid but expired
-            
+            allowed, valid_until = await self._check_download_access(email, session_id)
         except Exception as e:
-            logger.error(f"Error verifying download access: {str(e)}")
-            return False
\ No newline at end of file
+            logger.error("Error verifying download access: %s", e)
+            return False
+        
+        # Never cache a grant beyond the moment access expires
+        ttl = self._entitlements.ttl
+        if valid_until is not None:
+            ttl = min(ttl, (valid_until - datetime.utcnow()).total_seconds())
+        if ttl > 0:
+            entry = {} if cached is MISSING else dict(cached)
+            entry[email] = allowed
+            self._entitlements.set(session_id, entry, ttl=ttl)
+        
+        return allowed
+    
+    async def _check_download_access(self, email: str, session_id: str) -> Tuple[bool, Optional[datetime]]:
+        """Check payment and access expiry in one round trip, returning (allowed, valid_until)
+        
+        Expiry is computed from the payment time, so it holds whether or not a
+        downloads record exists; the TTL index only cleans those records up.
+        """
+        transaction = await self.db.payment_transactions.find_one(
+            {"session_id": session_id, "email": email, "payment_status": "paid"},
+            ACCESS_FIELDS
+        )
+        if not transaction:
+            return False, None
+        
+        access_expires = access_expires_at(transaction)
+        if access_expires > datetime.utcnow():
+            return True, access_expires
+        return False, None
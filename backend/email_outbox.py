@@ -0,0 +1,380 @@
+import asyncio
+import os
+import logging
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from metrics import EMAIL_OUTBOX_QUEUE_DEPTH, EMAIL_OUTBOX_SENT
+from models import DownloadLink
+from rate_limit import MongoBackend, RateLimitRule
+
+logger = logging.getLogger(__name__)
+
+# Repeat requests for the same links inside this window queue a single email
+DEDUPE_WINDOW_SECONDS = 600
+
+# rate_limits bucket holding the send budget shared by every worker's dispatcher
+SEND_BUCKET_KEY = "email_outbox:send"
+
+
+def render_download_email(links: List[Dict[str, Any]]) -> str:
+    lines = ["Thanks for your purchase! Your download links are below.", ""]
+    for link in links:
+        lines.append(f"{link['name']} ({link['size']}): {link['url']}")
+    lines += ["", "Links stay valid for 48 hours; you can request fresh ones at any time."]
+    return "\n".join(lines)
+
+
+class EmailOutbox:
+    """Queues outgoing email in the email_outbox collection for the dispatcher"""
+
+    def __init__(self, db: AsyncIOMotorClient):
+        self.db = db
+
+    def _download_links_message(self, email: str, session_id: str, package_type: str,
+                                links: List[Dict[str, Any]], now: datetime) -> Dict[str, Any]:
+        window = int(now.timestamp()) // DEDUPE_WINDOW_SECONDS
+        return {
+            "_id": f"download_links:{session_id}:{package_type}:{window}",
+            "to": email,
+            "subject": "Your Guru Killer download links",
+            "body": render_download_email(links),
+            "session_id": session_id,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now
+        }
+
+    async def enqueue_download_links(self, email: str, session_id: str, package_type: str,
+                                     links: List[DownloadLink]) -> bool:
+        """Queue the download links email, returning False if one was queued moments ago"""
+        if not email:
+            return False
+        message = self._download_links_message(
+            email, session_id, package_type, [link.dict() for link in links], datetime.utcnow()
+        )
+        try:
+            await self.db.email_outbox.insert_one(message)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def enqueue_many(self, results: List[Dict[str, Any]]) -> int:
+        """Queue download links emails for bulk results with one insert_many"""
+        now = datetime.utcnow()
+        messages = [
+            self._download_links_message(
+                result["email"], result["session_id"], result["package_type"], result["download_links"], now
+            )
+            for result in results if result.get("email")
+        ]
+        if not messages:
+            return 0
+        try:
+            inserted = len((await self.db.email_outbox.insert_many(messages, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            # Messages already queued inside the dedupe window are skipped
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            inserted = e.details.get("nInserted", 0)
+        return inserted
+
+
+class SmtpTransport:
+    """One persistent SMTP connection, reopened when the server drops it
+
+    smtplib is blocking, so every call runs in a worker thread; the
+    dispatcher only ever makes one call at a time. A lock held for each
+    send makes ``close()`` wait for a send that is still running in its
+    thread, even after the coroutine awaiting it was cancelled.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 starttls: bool = True, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["SmtpTransport"]:
+        """Build a transport from SMTP_* settings, or None when SMTP_HOST is unset"""
+        host = os.environ.get('SMTP_HOST')
+        if not host:
+            return None
+        return cls(
+            host=host,
+            port=int(os.environ.get('SMTP_PORT', '587')),
+            username=os.environ.get('SMTP_USERNAME') or None,
+            password=os.environ.get('SMTP_PASSWORD') or None,
+            starttls=os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true',
+            timeout=float(os.environ.get('SMTP_TIMEOUT_SECONDS', '30'))
+        )
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        return smtp
+
+    def _send(self, message: EmailMessage) -> None:
+        with self._lock:
+            if self._smtp is None:
+                self._smtp = self._connect()
+            try:
+                self._smtp.send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                # Idle connections get closed by the server; reconnect once and retry
+                self._smtp = self._connect()
+                self._smtp.send_message(message)
+
+    async def send(self, message: EmailMessage) -> None:
+        await asyncio.to_thread(self._send, message)
+
+    def _close(self, timeout: float) -> None:
+        if not self._lock.acquire(timeout=timeout):
+            logger.warning("SMTP send still running after %ss, leaving the connection to close with it", timeout)
+            return
+        try:
+            if self._smtp is not None:
+                try:
+                    self._smtp.quit()
+                except smtplib.SMTPException:
+                    pass
+                self._smtp = None
+        finally:
+            self._lock.release()
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Close the connection once any in-flight send has finished, waiting at most timeout seconds"""
+        await asyncio.to_thread(self._close, self.timeout if timeout is None else timeout)
+
+
+class OutboxDispatcher:
+    """Background sender draining email_outbox in batches
+
+    Each batch is claimed with a claim id so several workers can run the
+    dispatcher without sending a message twice; claims older than
+    ``claim_timeout`` are taken over. Sends go out one at a time over the
+    transport's persistent connection. ``max_per_second`` caps the sends of
+    all workers together: each send takes a token from a bucket in the
+    rate_limits collection, the same store RATE_LIMIT_BACKEND=mongo uses.
+    Failed sends are retried with exponential backoff up to
+    ``max_attempts``, and outcomes are written back with one bulk_write.
+
+    ``stop()`` lets the current send finish, records the batch and hands
+    unsent messages back to the queue, cancelling only after
+    ``stop_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorClient,
+        transport: Optional[SmtpTransport],
+        sender: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_per_second: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        retry_base: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+        claim_timeout: Optional[float] = None,
+        stop_timeout: Optional[float] = None,
+        send_limiter: Optional[MongoBackend] = None
+    ):
+        self.db = db
+        self.transport = transport
+        self.sender = sender or os.environ.get('SMTP_FROM', 'Guru Killer <downloads@gurukiller.com>')
+        self.batch_size = batch_size or int(os.environ.get('EMAIL_BATCH_SIZE', '50'))
+        self.max_per_second = max_per_second or float(os.environ.get('EMAIL_MAX_PER_SECOND', '10'))
+        self.max_attempts = max_attempts or int(os.environ.get('EMAIL_MAX_ATTEMPTS', '5'))
+        self.retry_base = retry_base or float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+        self.poll_interval = poll_interval or float(os.environ.get('EMAIL_POLL_INTERVAL_SECONDS', '5'))
+        self.claim_timeout = claim_timeout or float(os.environ.get('EMAIL_CLAIM_TIMEOUT_SECONDS', '300'))
+        self.stop_timeout = stop_timeout or float(os.environ.get('EMAIL_STOP_TIMEOUT_SECONDS', '10'))
+        self.send_limiter = send_limiter or MongoBackend(db)
+        burst = max(1, int(self.max_per_second))
+        self._send_rule = RateLimitRule("email_send", (), "global", burst, burst / self.max_per_second)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._sent_total = 0
+        self._failed_total = 0
+        self._last_batch_rate: Optional[float] = None
+        self._last_sent_at: Optional[datetime] = None
+
+    def start(self) -> None:
+        """Start the dispatcher; without an SMTP transport messages just stay queued"""
+        if self.transport is None:
+            logger.warning("SMTP_HOST is not set, download emails stay queued in email_outbox")
+            return
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop after the current send, then close the SMTP connection"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        done, _ = await asyncio.wait({self._task}, timeout=self.stop_timeout)
+        if not done:
+            logger.warning("Email outbox dispatcher did not stop within %ss, cancelling it", self.stop_timeout)
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.transport.close(self.stop_timeout)
+
+    async def _pause(self, seconds: float) -> bool:
+        """Sleep for seconds, returning True early if the dispatcher is stopping"""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                sent = await self.dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Email outbox dispatch failed: %s", e)
+                sent = 0
+            if sent < self.batch_size and await self._pause(self.poll_interval):
+                return
+
+    async def _take_send_token(self) -> bool:
+        """Wait for the shared send budget to allow one more email, False if stopping first"""
+        while True:
+            wait = await self.send_limiter.take(SEND_BUCKET_KEY, self._send_rule)
+            if wait <= 0:
+                return True
+            if await self._pause(wait):
+                return False
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        due = {
+            "$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "claimed_at": {"$lt": now - timedelta(seconds=self.claim_timeout)}}
+            ]
+        }
+        candidates = await self.db.email_outbox.find(due, {"_id": 1}).sort(
+            "next_attempt_at", 1
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        claim_id = str(uuid.uuid4())
+        await self.db.email_outbox.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, **due},
+            {"$set": {"status": "sending", "claim_id": claim_id, "claimed_at": now}}
+        )
+        return await self.db.email_outbox.find({"claim_id": claim_id}).to_list(self.batch_size)
+
+    def _build_message(self, doc: Dict[str, Any]) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = doc["to"]
+        message["Subject"] = doc["subject"]
+        message.set_content(doc["body"])
+        return message
+
+    async def dispatch_once(self) -> int:
+        """Send one claimed batch, returning how many messages were processed"""
+        batch = await self._claim()
+        if not batch:
+            EMAIL_OUTBOX_QUEUE_DEPTH.set(0)
+            return 0
+
+        started = time.perf_counter()
+        operations = []
+        sent = 0
+        for index, doc in enumerate(batch):
+            if self._stopping.is_set() or not await self._take_send_token():
+                # Hand the rest back so another worker sends them without waiting out claim_timeout
+                operations.extend(
+                    UpdateOne({"_id": unsent["_id"], "claim_id": unsent["claim_id"]},
+                              {"$set": {"status": "pending"}, "$unset": {"claim_id": ""}})
+                    for unsent in batch[index:]
+                )
+                break
+            try:
+                await self.transport.send(self._build_message(doc))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+                # The address itself was rejected, so retrying cannot help
+                operations.append(self._failed(doc, e, permanent=True))
+            except Exception as e:
+                operations.append(self._failed(doc, e, permanent=False))
+            else:
+                sent += 1
+                EMAIL_OUTBOX_SENT.inc(outcome="sent")
+                operations.append(UpdateOne(
+                    {"_id": doc["_id"], "claim_id": doc["claim_id"]},
+                    {"$set": {"status": "sent", "sent_at": datetime.utcnow()}, "$unset": {"claim_id": ""}}
+                ))
+
+        await self.db.email_outbox.bulk_write(operations, ordered=False)
+
+        elapsed = time.perf_counter() - started
+        self._sent_total += sent
+        self._last_batch_rate = sent / elapsed if elapsed > 0 else None
+        if sent:
+            self._last_sent_at = datetime.utcnow()
+        EMAIL_OUTBOX_QUEUE_DEPTH.set(await self.db.email_outbox.count_documents({"status": "pending"}))
+
+        logger.info("Sent %s of %s outbox emails in %.2fs", sent, len(batch), elapsed)
+        return len(batch)
+
+    def _failed(self, doc: Dict[str, Any], error: Exception, permanent: bool) -> UpdateOne:
+        attempts = doc.get("attempts", 0) + 1
+        if permanent or attempts >= self.max_attempts:
+            self._failed_total += 1
+            EMAIL_OUTBOX_SENT.inc(outcome="failed")
+            logger.error("Giving up on outbox email %s after %s attempts: %s", doc["_id"], attempts, error)
+            update = {"status": "failed", "attempts": attempts, "last_error": str(error)}
+        else:
+            EMAIL_OUTBOX_SENT.inc(outcome="retry")
+            backoff = self.retry_base * 2 ** (attempts - 1)
+            update = {
+                "status": "pending",
+                "attempts": attempts,
+                "last_error": str(error),
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff)
+            }
+        return UpdateOne(
+            {"_id": doc["_id"], "claim_id": doc["claim_id"]},
+            {"$set": update, "$unset": {"claim_id": ""}}
+        )
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Queue depth and send throughput for monitoring"""
+        pending = await self.db.email_outbox.count_documents({"status": "pending"})
+        failed = await self.db.email_outbox.count_documents({"status": "failed"})
+        return {
+            "queue_depth": pending,
+            "failed": failed,
+            "sent_total": self._sent_total,
+            "failed_total": self._failed_total,
+            "last_batch_rate_per_second": self._last_batch_rate,
+            "last_sent_at": self._last_sent_at
+        }
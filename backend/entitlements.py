@@ -0,0 +1,110 @@
+import asyncio
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_email(email: Optional[str]) -> str:
+    return (email or "").strip().lower()
+
+
+class EntitlementService:
+    """Which emails own which packages, mirrored in memory by every worker
+
+    A row in the entitlements collection is written the first time a
+    transaction becomes paid. Each worker keeps the (email, package_id)
+    pairs it has seen in a set, filled by a full load at startup and then
+    tailed every ``refresh_interval`` seconds by ``_id``. A pair missing
+    from the set is looked up through the unique (email, package_id) index,
+    so grants made by other workers are never refused while the tail
+    catches up.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient, refresh_interval: Optional[float] = None):
+        self.db = db
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(
+            os.environ.get('ENTITLEMENT_REFRESH_SECONDS', '30')
+        )
+        self._owned: Set[Tuple[str, str]] = set()
+        self._last_id: Optional[ObjectId] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def grant(self, transaction: Dict[str, Any]) -> None:
+        """Record that a paid transaction's buyer owns its package"""
+        email = normalize_email(transaction.get("email"))
+        if not email:
+            logger.info("Paid transaction %s has no email, no entitlement recorded", transaction.get("session_id"))
+            return
+        package_id = transaction["package_id"]
+        try:
+            await self.db.entitlements.insert_one({
+                "email": email,
+                "package_id": package_id,
+                "session_id": transaction.get("session_id"),
+                "granted_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            pass
+        self._owned.add((email, package_id))
+
+    async def has(self, email: Optional[str], package_id: str) -> bool:
+        """Whether email owns package_id, answered from memory when possible"""
+        key = (normalize_email(email), package_id)
+        if not key[0]:
+            return False
+        if key in self._owned:
+            return True
+        found = await self.db.entitlements.find_one({"email": key[0], "package_id": package_id}, {"_id": 1})
+        if found:
+            self._owned.add(key)
+        return found is not None
+
+    async def refresh(self) -> int:
+        """Add entitlements granted since the last refresh, returning how many were read"""
+        query = {"_id": {"$gt": self._last_id}} if self._last_id is not None else {}
+        count = 0
+        async for row in self.db.entitlements.find(query, {"email": 1, "package_id": 1}).sort("_id", 1):
+            self._owned.add((row["email"], row["package_id"]))
+            self._last_id = row["_id"]
+            count += 1
+        return count
+
+    async def start(self) -> None:
+        """Load every entitlement, then keep tailing new ones in the background"""
+        loaded = await self.refresh()
+        logger.info("Loaded %s entitlements", loaded)
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Entitlement refresh failed: %s", e)
+
+    async def backfill(self) -> int:
+        """Grant entitlements for every paid transaction, returning how many were processed"""
+        count = 0
+        async for transaction in self.db.payment_transactions.find({"payment_status": "paid"}):
+            await self.grant(transaction)
+            count += 1
+        return count
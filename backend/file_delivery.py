@@ -0,0 +1,210 @@
+import os
+import logging
+import mimetypes
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from disk per body message
+CHUNK_SIZE = 64 * 1024
+
+
+class DeliveryLimiter:
+    """Caps concurrent file transfers globally and per download session"""
+
+    def __init__(self, max_total: Optional[int] = None, max_per_session: Optional[int] = None):
+        self.max_total = max_total or int(os.environ.get('DOWNLOAD_MAX_CONCURRENT', '8'))
+        self.max_per_session = max_per_session or int(os.environ.get('DOWNLOAD_MAX_PER_SESSION', '2'))
+        self.active = 0
+        self._per_session: Dict[str, int] = {}
+
+    def acquire(self, session_id: str) -> Callable[[], None]:
+        """Take a transfer slot or raise 503, returning the release callback"""
+        if self.active >= self.max_total or self._per_session.get(session_id, 0) >= self.max_per_session:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many downloads in progress, please retry shortly",
+                headers={"Retry-After": "5"}
+            )
+        self.active += 1
+        self._per_session[session_id] = self._per_session.get(session_id, 0) + 1
+
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.active -= 1
+            remaining = self._per_session[session_id] - 1
+            if remaining:
+                self._per_session[session_id] = remaining
+            else:
+                del self._per_session[session_id]
+
+        return release
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range Range header into an inclusive (start, end)
+
+    Returns None when the whole file should be sent and raises 416 when the
+    range cannot be satisfied. Multi-range requests are answered with the
+    whole file, which RFC 9110 allows.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError
+            start = max(size - suffix, 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """Streams a file from disk with Range, ETag and Last-Modified support
+
+    Memory use is bounded by CHUNK_SIZE regardless of file size.
+    """
+
+    def __init__(self, path: Path, stat_result: os.stat_result, request: Request,
+                 on_complete: Optional[Callable[[], None]] = None):
+        self.path = path
+        self.on_complete = on_complete
+        self.background = None
+        size = stat_result.st_size
+        etag = f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-disposition": f'attachment; filename="{path.name}"',
+        }
+        self.range: Optional[Tuple[int, int]] = None
+
+        if self._not_modified(request, etag, stat_result.st_mtime):
+            self.status_code = 304
+        else:
+            if self._if_range_matches(request.headers.get("if-range"), etag, stat_result.st_mtime):
+                self.range = parse_range(request.headers.get("range"), size)
+            if self.range:
+                start, end = self.range
+                self.status_code = 206
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+                headers["content-length"] = str(end - start + 1)
+            else:
+                self.status_code = 200
+                self.range = (0, size - 1) if size else None
+                headers["content-length"] = str(size)
+            headers["content-type"] = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+        self.send_body = self.status_code != 304 and request.method != "HEAD"
+        self.init_headers(headers)
+
+    @staticmethod
+    def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(if_range: Optional[str], etag: str, mtime: float) -> bool:
+        if if_range is None:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_range).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.range is None:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            start, end = self.range
+            remaining = end - start + 1
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                while remaining > 0:
+                    chunk = await file.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; close the body so the client sees a short read
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if self.on_complete:
+                self.on_complete()
+
+
+class FileDelivery:
+    """Serves catalog files from local storage"""
+
+    def __init__(self, storage_dir: Optional[str] = None, limiter: Optional[DeliveryLimiter] = None):
+        self.storage_dir = Path(
+            storage_dir or os.environ.get('DOWNLOAD_STORAGE_DIR', str(Path(__file__).parent / 'storage'))
+        ).resolve()
+        self.limiter = limiter or DeliveryLimiter()
+
+    def respond(self, session_id: str, filename: str, request: Request) -> RangeFileResponse:
+        """Build the streaming response for a file that has already been authorized"""
+        path = (self.storage_dir / filename).resolve()
+        if path.parent != self.storage_dir:
+            raise HTTPException(status_code=404, detail="File not found")
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            logger.error("Download file missing from storage: %s", filename)
+            raise HTTPException(status_code=404, detail="File not found")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404, detail="File not found")
+
+        release = self.limiter.acquire(session_id)
+        try:
+            return RangeFileResponse(path, stat_result, request, on_complete=release)
+        except Exception:
+            release()
+            raise
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import os
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from cache import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """Stable hash of the request a key was first used with"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Responses remembered per Idempotency-Key in the idempotency_keys collection
+
+    The first request with a key claims it with a unique insert, holding a
+    lease for ``lock_timeout`` seconds while it does the work, and then
+    stores the response on the record. Repeats get the stored response
+    back. A duplicate that arrives while the first is still in flight waits
+    for it: inside one worker it joins the same call, across workers it
+    polls the record, taking the key over if the lease runs out. A failed
+    attempt deletes its claim so the client can retry with the same key.
+    Records expire ``ttl`` after they were created.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient, ttl: Optional[timedelta] = None,
+                 lock_timeout: Optional[float] = None, poll_interval: Optional[float] = None):
+        self.db = db
+        self.ttl = ttl or timedelta(hours=float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24')))
+        self.lock_timeout = lock_timeout or float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+        self.poll_interval = poll_interval or float(os.environ.get('IDEMPOTENCY_POLL_SECONDS', '0.1'))
+        self._flight = SingleFlight()
+
+    async def run(self, key: str, fingerprint: str, create: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Return the response stored for key, running create() only if no request has yet"""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+        return await self._flight.do((key, fingerprint), lambda: self._run(key, fingerprint, create))
+
+    async def _run(self, key: str, fingerprint: str, create: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        lock_id = str(uuid.uuid4())
+        while True:
+            record = await self._claim(key, fingerprint, lock_id)
+            if record is None:
+                break
+            if record["fingerprint"] != fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used with a different request"
+                )
+            if record["status"] == "completed":
+                return record["response"]
+            # Another worker holds the key; wait for its response or for its lease to run out
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            response = await create()
+        except BaseException:
+            await self.db.idempotency_keys.delete_one({"_id": key, "lock_id": lock_id})
+            raise
+        await self.db.idempotency_keys.update_one(
+            {"_id": key, "lock_id": lock_id},
+            {"$set": {"status": "completed", "response": response, "completed_at": datetime.utcnow()}}
+        )
+        return response
+
+    async def _claim(self, key: str, fingerprint: str, lock_id: str) -> Optional[Dict[str, Any]]:
+        """Claim key for this request, or return the record that someone else holds"""
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=self.lock_timeout)
+        try:
+            await self.db.idempotency_keys.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "lock_id": lock_id,
+                "locked_until": locked_until,
+                "created_at": now,
+                "expires_at": now + self.ttl
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        # Take over a claim whose holder died before storing a response
+        record = await self.db.idempotency_keys.find_one_and_update(
+            {"_id": key, "status": "pending", "fingerprint": fingerprint, "locked_until": {"$lt": now}},
+            {"$set": {"lock_id": lock_id, "locked_until": locked_until}},
+            return_document=ReturnDocument.AFTER
+        )
+        if record is not None:
+            logger.warning("Took over idempotency key %s after its lease expired", key)
+            return None
+
+        record = await self.db.idempotency_keys.find_one({"_id": key})
+        if record is None:
+            # Released by a failed attempt or expired in the meantime; claim it afresh
+            return await self._claim(key, fingerprint, lock_id)
+        return record
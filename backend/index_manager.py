@@ -0,0 +1,227 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# (collection, keys, options) for every index the services rely on
+INDEX_SPECS: List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]] = [
+    ("payment_transactions", [("session_id", ASCENDING)], {"name": "session_id_unique", "unique": True}),
+    (
+        "payment_transactions",
+        [("session_id", ASCENDING), ("email", ASCENDING), ("payment_status", ASCENDING)],
+        {"name": "session_email_status"}
+    ),
+    ("payment_transactions", [("email", ASCENDING), ("payment_status", ASCENDING)], {"name": "email_status"}),
+    # Polled for cross-worker cache invalidation when change streams are unavailable
+    ("payment_transactions", [("updated_at", ASCENDING)], {"name": "updated_at"}),
+    # Transactions whose status side effects have not all run yet, for the replay sweep
+    ("payment_transactions", [("status_batch_id", ASCENDING)], {"name": "status_batch_id", "sparse": True}),
+    # Keyset pagination for the admin listing and export, walked in either direction
+    ("payment_transactions", [("created_at", ASCENDING), ("_id", ASCENDING)], {"name": "created_at_id"}),
+    (
+        "payment_transactions",
+        [("payment_status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+        {"name": "status_created_at_id"}
+    ),
+    ("downloads", [("session_id", ASCENDING)], {"name": "session_id"}),
+    (
+        "downloads",
+        [("session_id", ASCENDING), ("package_type", ASCENDING)],
+        {"name": "session_package_unique", "unique": True}
+    ),
+    # Download records are deleted by the server once their access window has ended
+    ("downloads", [("access_expires", ASCENDING)], {"name": "access_expires_ttl", "expireAfterSeconds": 0}),
+    ("webhook_inbox", [("status", ASCENDING), ("received_at", ASCENDING)], {"name": "status_received_at"}),
+    ("webhook_inbox", [("claim_id", ASCENDING)], {"name": "claim_id", "sparse": True}),
+    # Applied events are kept for a week so duplicate deliveries can still be dropped
+    ("webhook_inbox", [("applied_at", ASCENDING)], {"name": "applied_at_ttl", "expireAfterSeconds": 7 * 24 * 3600}),
+    ("payment_transactions_archive", [("session_id", ASCENDING)], {"name": "session_id"}),
+    (
+        "entitlements",
+        [("email", ASCENDING), ("package_id", ASCENDING)],
+        {"name": "email_package_unique", "unique": True}
+    ),
+    ("email_outbox", [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {"name": "status_next_attempt"}),
+    ("email_outbox", [("claim_id", ASCENDING)], {"name": "claim_id", "sparse": True}),
+    ("email_outbox", [("sent_at", ASCENDING)], {"name": "sent_at_ttl", "expireAfterSeconds": 30 * 24 * 3600}),
+    (
+        "revenue_rollups",
+        [("granularity", ASCENDING), ("bucket_start", ASCENDING), ("package_id", ASCENDING)],
+        {"name": "granularity_bucket_package"}
+    ),
+    # Checkout responses are replayed for repeated Idempotency-Keys until the record expires
+    ("idempotency_keys", [("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    # Shared rate limit buckets are dropped once they would have refilled
+    ("rate_limits", [("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    # Per-worker metrics snapshots outlive a worker by a few publish intervals
+    ("metrics_snapshots", [("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+]
+
+# Server error codes for an index that exists with other options or under another name
+INDEX_CONFLICT_CODES = (85, 86)
+
+# Server error code for a unique index that documents already in the collection violate
+DUPLICATE_KEY_CODE = 11000
+
+# Server error code for dropping an index that is already gone, e.g. dropped by a concurrent migration
+INDEX_NOT_FOUND_CODE = 27
+
+# (description, collection, filter) for the hot queries issued by the services
+QUERY_PLANS: List[Tuple[str, str, Dict[str, Any]]] = [
+    ("PaymentService.get_transaction_by_session", "payment_transactions", {"session_id": "cs_plan_check"}),
+    (
+        "DownloadService.verify_download_access",
+        "payment_transactions",
+        {"session_id": "cs_plan_check", "email": "plan@check", "payment_status": "paid"}
+    ),
+    ("DownloadService.get_downloads_by_session", "downloads", {"session_id": "cs_plan_check"}),
+    (
+        "DownloadService.generate_bulk",
+        "payment_transactions",
+        {"payment_status": "paid", "$or": [{"session_id": {"$in": ["cs_plan_check"]}}, {"email": {"$in": ["plan@check"]}}]}
+    ),
+    ("WebhookInbox.drain_once", "webhook_inbox", {"status": "pending"}),
+    (
+        "EntitlementService.has",
+        "entitlements",
+        {"email": "plan@check", "package_id": "guru_killer_main"}
+    ),
+    (
+        "TransactionExporter.list_page",
+        "payment_transactions",
+        {"payment_status": "paid", "created_at": {"$gte": datetime(2000, 1, 1)}}
+    ),
+    (
+        "TransactionReconciler._next_page",
+        "payment_transactions",
+        {"_id": {"$gt": ObjectId("0" * 24)}, "payment_status": {"$nin": ["paid", "failed", "expired"]}}
+    ),
+]
+
+
+class QueryPlanError(RuntimeError):
+    """Raised when a service query is not served by an index"""
+
+
+class DuplicateIndexKeysError(RuntimeError):
+    """Raised when a unique index cannot be built over existing duplicates and no cleanup is known"""
+
+
+class IndexManager:
+    """Creates the indexes the services depend on and verifies they are used
+
+    Migrations, i.e. rebuilding an index whose spec changed or removing
+    duplicates ahead of a unique index, run once per deploy through
+    ``manage.py ensure-indexes``. Web workers call ``ensure_indexes`` with
+    ``migrate=False`` so N workers starting together only create what is
+    missing and never race each other dropping indexes.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient):
+        self.db = db
+        # Cleanups run when a unique index meets duplicates written before it existed
+        self._dedupers = {("downloads", "session_package_unique"): self.dedupe_downloads}
+
+    async def ensure_indexes(self, migrate: bool = True) -> List[str]:
+        """Idempotently create every index in INDEX_SPECS
+
+        Without ``migrate``, an index that needs a migration is left as it is
+        and logged instead of being rebuilt.
+        """
+        created = []
+        for collection, keys, options in INDEX_SPECS:
+            try:
+                name = await self.db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                if not migrate and e.code in (DUPLICATE_KEY_CODE, *INDEX_CONFLICT_CODES):
+                    logger.error(
+                        "Index %s.%s needs a migration, run 'manage.py ensure-indexes': %s",
+                        collection, options["name"], e
+                    )
+                    continue
+                if e.code == DUPLICATE_KEY_CODE:
+                    deduper = self._dedupers.get((collection, options["name"]))
+                    if deduper is None:
+                        raise DuplicateIndexKeysError(
+                            f"Cannot build unique index {collection}.{options['name']}: {e}"
+                        ) from e
+                    await deduper()
+                elif e.code in INDEX_CONFLICT_CODES:
+                    # The spec changed since the index was built, e.g. a plain index that became a TTL index
+                    await self._drop_conflicting(collection, keys, options["name"])
+                else:
+                    raise
+                name = await self.db[collection].create_index(keys, **options)
+            created.append(f"{collection}.{name}")
+        logger.info("Ensured %s indexes", len(created))
+        return created
+
+    async def dedupe_downloads(self, batch_size: int = 1000) -> int:
+        """Keep only the newest downloads record per (session_id, package_type), returning how many were removed
+
+        Older code wrote a new record on every link generation, so these
+        duplicates predate the session_package_unique index.
+        """
+        pipeline = [
+            {"$sort": {"last_generated_at": -1, "generated_at": -1, "_id": -1}},
+            {"$group": {
+                "_id": {"session_id": "$session_id", "package_type": "$package_type"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}}
+        ]
+        stale: List[Any] = []
+        removed = 0
+        async for group in self.db.downloads.aggregate(pipeline, allowDiskUse=True):
+            stale.extend(group["ids"][1:])
+            if len(stale) >= batch_size:
+                removed += (await self.db.downloads.delete_many({"_id": {"$in": stale}})).deleted_count
+                stale = []
+        if stale:
+            removed += (await self.db.downloads.delete_many({"_id": {"$in": stale}})).deleted_count
+        logger.warning("Removed %s duplicate downloads records", removed)
+        return removed
+
+    async def _drop_conflicting(self, collection: str, keys: List[Tuple[str, int]], name: str) -> None:
+        """Drop existing indexes that share the key pattern or name of a spec"""
+        for existing_name, info in (await self.db[collection].index_information()).items():
+            if existing_name == "_id_":
+                continue
+            if existing_name == name or [tuple(key) for key in info["key"]] == list(keys):
+                logger.warning("Dropping index %s.%s to rebuild it from the current spec", collection, existing_name)
+                try:
+                    await self.db[collection].drop_index(existing_name)
+                except OperationFailure as e:
+                    if e.code != INDEX_NOT_FOUND_CODE:
+                        raise
+                    logger.info("Index %s.%s was already dropped", collection, existing_name)
+
+    async def verify_query_plans(self) -> None:
+        """Explain every hot query and fail if any of them scans a whole collection"""
+        failures = []
+        for description, collection, query in QUERY_PLANS:
+            plan = await self.db[collection].find(query).explain()
+            winning_plan = plan.get("queryPlanner", {}).get("winningPlan", {})
+            if "COLLSCAN" in self._stages(winning_plan):
+                failures.append(f"{description} ({collection} {query})")
+
+        if failures:
+            raise QueryPlanError(f"Queries doing a COLLSCAN: {'; '.join(failures)}")
+        logger.info("Verified query plans for %s queries", len(QUERY_PLANS))
+
+    def _stages(self, plan: Dict[str, Any]) -> List[str]:
+        """Flatten the stage names of an explain() plan tree"""
+        stages = [plan["stage"]] if "stage" in plan else []
+        children = list(plan.get("inputStages", []))
+        for key in ("inputStage", "queryPlan"):
+            if key in plan:
+                children.append(plan[key])
+        for child in children:
+            stages.extend(self._stages(child))
+        return stages
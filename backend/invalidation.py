@@ -0,0 +1,182 @@
+import asyncio
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Collections whose changes invalidate caches, with the timestamp every write sets for the polling fallback
+WATCHED_COLLECTIONS: Dict[str, str] = {
+    "payment_transactions": "updated_at",
+}
+
+# Server error codes meaning change streams are not available, e.g. a stand-alone mongod
+CHANGE_STREAMS_UNSUPPORTED_CODES = (40573, 40324)
+
+# Server error codes meaning the stored resume token can no longer be resumed from
+RESUME_TOKEN_LOST_CODES = (280, 286)
+
+# Subscribers get the changed session id, or None when every entry must be dropped
+Subscriber = Callable[[Optional[str]], None]
+
+# Turns the updated and removed field paths of an update event into their top-level names
+CHANGED_FIELDS = {"$map": {
+    "input": {"$concatArrays": [
+        {"$map": {
+            "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+            "in": "$$this.k"
+        }},
+        {"$ifNull": ["$updateDescription.removedFields", []]}
+    ]},
+    "in": {"$arrayElemAt": [{"$split": ["$$this", "."]}, 0]}
+}}
+
+
+class InvalidationBus:
+    """Per-worker fan-out of changes to payment_transactions
+
+    In-process caches register a callback per collection with
+    ``subscribe()`` and get the session id of every changed document,
+    whichever worker wrote it. A subscriber that passes ``fields`` only hears
+    about updates that set or remove one of them, e.g. stats caches that
+    only change when payment_status moves. Deletes are not delivered: they
+    come from the archiver moving old transactions out, which changes
+    nothing a cache holds, and the event carries no session id to target.
+
+    Changes come from a MongoDB change stream per collection. The last
+    resume token is kept in memory to resume after a disconnect but never
+    persisted: the bus only keeps this worker's in-memory caches fresh, and
+    those start empty after a restart, so there is nothing to catch up on.
+    A shared saved token would also be overwritten by every worker. If the
+    token is too old to resume from, subscribers are told to drop
+    everything and the stream starts afresh.
+
+    Without a replica set there are no change streams, so each collection
+    is polled every ``poll_interval`` seconds for documents whose write
+    timestamp moved, re-reading ``poll_overlap`` seconds back to cover clock
+    skew between workers. Which fields an update touched is not seen in
+    this mode, so subscribers with ``fields`` rely on their caches' own TTLs.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient, poll_interval: Optional[float] = None,
+                 poll_overlap: Optional[float] = None):
+        self.db = db
+        self.poll_interval = poll_interval or float(os.environ.get('INVALIDATION_POLL_SECONDS', '2'))
+        self.poll_overlap = poll_overlap or float(os.environ.get('INVALIDATION_POLL_OVERLAP_SECONDS', '2'))
+        self.enabled = os.environ.get('CACHE_INVALIDATION_ENABLED', 'true').lower() == 'true'
+        self._subscribers: Dict[str, List[Tuple[Subscriber, Optional[FrozenSet[str]]]]] = defaultdict(list)
+        self._tokens: Dict[str, Any] = {}
+        self._modes: Dict[str, str] = {}
+        self._events: Dict[str, int] = defaultdict(int)
+        self._tasks: List[asyncio.Task] = []
+
+    def subscribe(self, collection: str, callback: Subscriber, fields: Optional[Iterable[str]] = None) -> None:
+        """Call callback with the session id of every change to collection, or only of updates to fields"""
+        if collection not in WATCHED_COLLECTIONS:
+            raise ValueError(f"{collection} is not watched for cache invalidation")
+        self._subscribers[collection].append((callback, frozenset(fields) if fields else None))
+
+    def publish(self, collection: str, session_id: Optional[str], changed_fields: Optional[Set[str]] = None) -> None:
+        """Deliver one change to the collection's subscribers
+
+        ``changed_fields`` names the top-level fields an update touched; it is
+        None for inserts, replaces and polled changes, which reach field
+        subscribers only when everything must be dropped. A None session id
+        is reserved for a lost resume token.
+        """
+        self._events[collection] += 1
+        for callback, fields in self._subscribers[collection]:
+            if fields is not None and session_id is not None and not (changed_fields and fields & changed_fields):
+                continue
+            try:
+                callback(session_id)
+            except Exception as e:
+                logger.error("Cache invalidation callback failed for %s: %s", collection, e)
+
+    def start(self) -> None:
+        """Follow every subscribed collection in the background"""
+        if not self.enabled or self._tasks:
+            return
+        for collection in self._subscribers:
+            self._tasks.append(asyncio.create_task(self._follow(collection)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _follow(self, collection: str) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                self._modes[collection] = "change_stream"
+                await self._watch(collection)
+                backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAMS_UNSUPPORTED_CODES:
+                    logger.warning("Change streams unavailable (%s), polling %s for changes", e, collection)
+                    self._modes[collection] = "polling"
+                    await self._poll(collection)
+                    return
+                if e.code in RESUME_TOKEN_LOST_CODES:
+                    logger.warning("Cannot resume %s change stream, dropping cached entries: %s", collection, e)
+                    self._tokens.pop(collection, None)
+                    self.publish(collection, None)
+                    continue
+                logger.error("%s change stream failed: %s", collection, e)
+            except PyMongoError as e:
+                logger.warning("%s change stream disconnected: %s", collection, e)
+            self._modes[collection] = "reconnecting"
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    async def _watch(self, collection: str) -> None:
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$addFields": {"changedFields": CHANGED_FIELDS}},
+            {"$project": {"operationType": 1, "documentKey": 1, "fullDocument.session_id": 1, "changedFields": 1}}
+        ]
+        resume_after = self._tokens.get(collection)
+        async with self.db[collection].watch(pipeline, full_document="updateLookup", resume_after=resume_after) as stream:
+            logger.info("Watching %s for cache invalidation", collection)
+            async for change in stream:
+                # An update to a document deleted since has no document left to name a session
+                session_id = (change.get("fullDocument") or {}).get("session_id")
+                if session_id is not None:
+                    changed_fields = set(change["changedFields"]) if change["operationType"] == "update" else None
+                    self.publish(collection, session_id, changed_fields)
+                self._tokens[collection] = stream.resume_token
+
+    async def _poll(self, collection: str) -> None:
+        field = WATCHED_COLLECTIONS[collection]
+        since = datetime.utcnow()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            polled_at = datetime.utcnow()
+            try:
+                async for doc in self.db[collection].find({field: {"$gte": since}}, {"_id": 0, "session_id": 1}):
+                    if doc.get("session_id") is not None:
+                        self.publish(collection, doc["session_id"])
+            except PyMongoError as e:
+                logger.warning("Polling %s for changes failed: %s", collection, e)
+                continue
+            since = polled_at - timedelta(seconds=self.poll_overlap)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """How each collection is followed and how many changes were delivered"""
+        return {
+            collection: {"mode": self._modes.get(collection, "stopped"), "events": self._events[collection]}
+            for collection in self._subscribers
+        }
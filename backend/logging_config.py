@@ -0,0 +1,160 @@
+"""Queue-based structured logging that keeps handler I/O off the event loop
+
+Log calls only build a LogRecord and put it on a bounded queue; a
+QueueListener thread formats it as JSON and writes it out. When the queue
+is full the record is dropped and counted rather than blocking the loop.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import REGISTRY, Counter, match_route
+
+# Fields attached to every record logged while handling a request
+_log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Polling endpoints whose info-level lines are sampled
+DEFAULT_SAMPLED_ROUTES = (
+    "/api/checkout/status/{session_id}",
+    "/api/checkout/status/{session_id}/stream",
+    "/api/webhook/inbox/stats",
+)
+
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full", ["reason"]
+))
+
+
+def bind_log_context(**fields: Any) -> None:
+    """Attach fields such as session_id to the records logged for the current request"""
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the request context onto records in the calling thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of info-and-below records from polling routes"""
+
+    def __init__(self, rate: float, routes: Iterable[str]):
+        super().__init__()
+        self.rate = rate
+        self.routes = frozenset(routes)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or getattr(record, "route", None) not in self.routes:
+            return True
+        if random.random() < self.rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason="sampled")
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args and render the traceback here; JSON formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the request context fields"""
+
+    CONTEXT_FIELDS = ("route", "method", "session_id", "package_id", "event_type")
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LogContextMiddleware:
+    """ASGI middleware binding route, method and session_id for each request
+
+    session_id comes from the path, which covers the status and download
+    routes; handlers that only learn it from the body or from Stripe, such
+    as checkout and the webhook, add it with ``bind_log_context()``.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route, path_params = match_route(scope)
+        context = {"route": route, "method": scope["method"]}
+        if "session_id" in path_params:
+            context["session_id"] = path_params["session_id"]
+        token = _log_context.set(context)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _log_context.reset(token)
+
+
+def configure_logging(level: Optional[str] = None) -> logging.handlers.QueueListener:
+    """Route all logging through a background listener thread and return the listener"""
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0.1'))
+    sampled_routes = [
+        route.strip() for route in
+        os.environ.get('LOG_SAMPLED_ROUTES', ",".join(DEFAULT_SAMPLED_ROUTES)).split(",")
+        if route.strip()
+    ]
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', '10000')))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate, sampled_routes))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
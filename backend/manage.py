@@ -0,0 +1,163 @@
+"""Operational commands for the Guru Killer backend
+
+Run from the backend directory, e.g. ``python manage.py rebuild-stats``.
+"""
+import asyncio
+import os
+import logging
+from pathlib import Path
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+
+import typer
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from database import create_mongo_client
+from stats_service import StatsService
+from index_manager import IndexManager
+from payment_service import PaymentService
+from reconciliation import TransactionReconciler
+from archival import TransactionArchiver
+from entitlements import EntitlementService
+from rollups import RollupService
+from transaction_export import TransactionExporter
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+cli = typer.Typer(help="Guru Killer backend maintenance commands")
+
+
+def _run(job: Callable[[AsyncIOMotorClient], Awaitable]):
+    """Run an async job against the configured database and close the client"""
+    async def runner():
+        client = create_mongo_client()
+        try:
+            return await job(client[os.environ['DB_NAME']])
+        finally:
+            client.close()
+    return asyncio.run(runner())
+
+
+@cli.command("rebuild-stats")
+def rebuild_stats():
+    """Recompute the public stats counters from payment_transactions"""
+    counters = _run(lambda db: StatsService(db).rebuild())
+    typer.echo(counters)
+
+
+@cli.command("ensure-indexes")
+def ensure_indexes(verify: bool = typer.Option(False, help="Fail if any hot query still does a COLLSCAN")):
+    """Create the indexes the services rely on, migrating any whose spec changed
+
+    Run once per deploy before the workers start; workers only create
+    missing indexes.
+    """
+    async def job(db):
+        index_manager = IndexManager(db)
+        created = await index_manager.ensure_indexes()
+        if verify:
+            await index_manager.verify_query_plans()
+        return created
+    for name in _run(job):
+        typer.echo(name)
+
+
+@cli.command("dedupe-downloads")
+def dedupe_downloads():
+    """Remove duplicate downloads records ahead of building their unique index"""
+    removed = _run(lambda db: IndexManager(db).dedupe_downloads())
+    typer.echo(f"Removed {removed} duplicate downloads records")
+
+
+@cli.command("reconcile-transactions")
+def reconcile_transactions():
+    """Settle stale initiated transactions against Stripe, resuming an interrupted run"""
+    async def job(db):
+        payment_service = PaymentService(db)
+        payment_service.stripe_pool.open()
+        try:
+            return await TransactionReconciler(db, payment_service).run()
+        finally:
+            await payment_service.stripe_pool.close()
+    report = _run(job)
+    for key, value in report.items():
+        typer.echo(f"{key}: {value}")
+
+
+@cli.command("archive-transactions")
+def archive_transactions(
+    older_than_days: Optional[float] = typer.Option(None, help="Defaults to ARCHIVE_AFTER_DAYS (90)")
+):
+    """Move old unpaid transactions into payment_transactions_archive"""
+    max_age = timedelta(days=older_than_days) if older_than_days else None
+    result = _run(lambda db: TransactionArchiver(db, max_age=max_age).run())
+    typer.echo(result)
+
+
+@cli.command("backfill-entitlements")
+def backfill_entitlements():
+    """Grant entitlements for transactions paid before the entitlements collection existed"""
+    count = _run(lambda db: EntitlementService(db).backfill())
+    typer.echo(f"Processed {count} paid transactions")
+
+
+@cli.command("backfill-rollups")
+def backfill_rollups(batch_size: Optional[int] = typer.Option(None, help="Defaults to ROLLUP_BACKFILL_BATCH_SIZE (1000)")):
+    """Rebuild the hourly and daily revenue buckets from all transactions"""
+    result = _run(lambda db: RollupService(db).backfill(batch_size))
+    typer.echo(result)
+
+
+@cli.command("backfill-created-at")
+def backfill_created_at():
+    """Store created_at on legacy transactions so admin listings page through them"""
+    updated = _run(lambda db: TransactionExporter(db).backfill_created_at())
+    typer.echo(f"Backfilled created_at on {updated} transactions")
+
+
+@cli.command("serve")
+def serve(
+    host: str = typer.Option("0.0.0.0", envvar="HOST"),
+    port: int = typer.Option(8001, envvar="PORT"),
+    workers: int = typer.Option(os.cpu_count() or 1, envvar="WEB_CONCURRENCY", help="Worker processes"),
+    graceful_timeout: int = typer.Option(
+        30, envvar="GRACEFUL_SHUTDOWN_TIMEOUT_SECONDS",
+        help="Seconds to let in-flight requests finish on shutdown before they are cancelled"
+    ),
+    keep_alive: int = typer.Option(5, envvar="KEEP_ALIVE_TIMEOUT_SECONDS")
+):
+    """Run the API in N worker processes
+
+    Each worker builds its own Mongo pool and services in the app lifespan.
+    On SIGTERM a worker stops accepting connections, waits for in-flight
+    requests, then drains the webhook inbox before closing its pools.
+
+    Run 'manage.py ensure-indexes' first: workers create missing indexes
+    but leave index migrations and duplicate cleanup to that command.
+
+    Behind a load balancer, set TRUSTED_PROXIES to its addresses so rate
+    limits key on the client IP from X-Forwarded-For instead of the proxy's.
+    """
+    import uvicorn
+    uvicorn.run(
+        "server:app",
+        host=host,
+        port=port,
+        workers=workers,
+        timeout_graceful_shutdown=graceful_timeout,
+        timeout_keep_alive=keep_alive,
+        proxy_headers=True,
+        # Workers route logging through the queue listener set up in the lifespan
+        log_config=None
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,343 @@
+"""Minimal Prometheus-style metrics for the API, Mongo and Stripe
+
+Metrics are plain in-process counters guarded by a lock per metric, so
+recording costs a dict lookup and an addition. ``REGISTRY.render()``
+produces the Prometheus text exposition format.
+
+Each worker process has its own registry, so ``MetricsPublisher`` copies
+a snapshot of it into the metrics_snapshots collection, and /metrics
+renders every live worker's series labelled with ``worker``.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow Stripe calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self, extra: Tuple[Tuple[str, str], ...] = ()) -> List[str]:
+        return []
+
+    def render(self) -> List[str]:
+        return self.header() + self.samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self, extra: Tuple[Tuple[str, str], ...] = ()) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key, extra)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels: str) -> float:
+        series = self._values.get(self._key(labels))
+        return sum(series[:-1]) if series else 0.0
+
+    def samples(self, extra: Tuple[Tuple[str, str], ...] = ()) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, extra + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, extra)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, extra)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, snapshots: Optional[List[Dict[str, List[str]]]] = None) -> str:
+        """Render this process's metrics, or the given per-worker snapshots merged per metric"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            if snapshots is None:
+                lines.extend(metric.samples())
+            else:
+                for snapshot in snapshots:
+                    lines.extend(snapshot.get(metric.name, []))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, worker: str) -> Dict[str, List[str]]:
+        """Every metric's sample lines, labelled with the worker they came from"""
+        return {metric.name: metric.samples((("worker", worker),)) for metric in self._metrics}
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ["method", "route"]
+))
+MONGO_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["collection", "command", "outcome"]
+))
+STRIPE_CALL_SECONDS = REGISTRY.register(Histogram(
+    "stripe_call_duration_seconds", "Outbound Stripe call latency", ["operation", "outcome"]
+))
+WEBHOOK_INBOX_APPLY_LAG_SECONDS = REGISTRY.register(Gauge(
+    "webhook_inbox_apply_lag_seconds", "Age of the newest event in the last applied webhook batch"
+))
+RATE_LIMITED_REQUESTS = REGISTRY.register(Counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by a rate limit rule", ["rule"]
+))
+EMAIL_OUTBOX_SENT = REGISTRY.register(Counter(
+    "email_outbox_messages_total", "Outbox emails processed by outcome", ["outcome"]
+))
+EMAIL_OUTBOX_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "email_outbox_queue_depth", "Emails waiting in the outbox"
+))
+STRIPE_CALLS_SHED = REGISTRY.register(Counter(
+    "stripe_calls_shed_total", "Stripe calls rejected with 503 because the call queue was full", ["operation"]
+))
+STRIPE_STATUS_FALLBACKS = REGISTRY.register(Counter(
+    "stripe_status_fallbacks_total", "Payment status requests answered from the stored transaction because Stripe was unavailable"
+))
+CIRCUIT_BREAKER_STATE = REGISTRY.register(Gauge(
+    "circuit_breaker_open", "1 while a circuit breaker refuses calls, 0.5 while half-open, 0 when closed", ["name"]
+))
+CIRCUIT_BREAKER_TRIPS = REGISTRY.register(Counter(
+    "circuit_breaker_trips_total", "Times a circuit breaker has opened", ["name"]
+))
+
+
+def match_route(scope: Scope) -> Tuple[str, Dict[str, str]]:
+    """Resolve the route template and path params for a request, once per request"""
+    cached = scope.get("route_match")
+    if cached is None:
+        cached = ("unmatched", {})
+        router = scope["app"].router if "app" in scope else None
+        for route in getattr(router, "routes", ()):
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                cached = (getattr(route, "path", "unmatched"), child_scope.get("path_params", {}))
+                break
+        scope["route_match"] = cached
+    return cached
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests
+
+    Routes are labelled by their path template, so session ids never become
+    label values.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route, _ = match_route(scope)
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(method=method, route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(method=method, route=route)
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, method=method, route=route, status=str(status_code)
+            )
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener timing commands by collection and operation"""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[object, int], str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else ""
+        )
+
+    def _record(self, event, outcome: str) -> None:
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1_000_000,
+            collection=collection, command=event.command_name, outcome=outcome
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._record(event, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._record(event, "error")
+
+
+class MetricsPublisher:
+    """Shares this worker's registry with the others through metrics_snapshots
+
+    Every ``interval`` seconds the worker upserts its labelled samples under
+    its host and pid. ``render_all()`` merges the snapshots written within
+    the last three intervals, so a scrape landing on any worker reports all
+    of them; snapshots of workers that have exited expire on their own.
+    """
+
+    def __init__(self, db, registry: "Registry" = None, interval: Optional[float] = None):
+        self.db = db
+        self.registry = registry or REGISTRY
+        self.interval = interval or float(os.environ.get('METRICS_PUBLISH_SECONDS', '15'))
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.db.metrics_snapshots.delete_one({"_id": self.worker})
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Publishing metrics snapshot failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def publish(self) -> None:
+        """Write this worker's current snapshot"""
+        now = datetime.utcnow()
+        await self.db.metrics_snapshots.update_one(
+            {"_id": self.worker},
+            {"$set": {
+                "samples": self.registry.snapshot(self.worker),
+                "updated_at": now,
+                "expires_at": now + timedelta(seconds=self.interval * 3)
+            }},
+            upsert=True
+        )
+
+    async def render_all(self) -> str:
+        """Exposition text for every live worker, this one included as of now"""
+        await self.publish()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.interval * 3)
+        snapshots = await self.db.metrics_snapshots.find(
+            {"updated_at": {"$gte": cutoff}}, {"samples": 1}
+        ).to_list(None)
+        return self.registry.render([snapshot["samples"] for snapshot in snapshots])
+
+
+def observe_stripe_call(operation: str, started: float, outcome: str) -> None:
+    STRIPE_CALL_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome=outcome)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple
 from datetime import datetime
 import uuid
 
@@ -13,10 +13,20 @@ class PaymentTransaction(BaseModel):
     currency: str = "gbp"
     email: str
     payment_status: str = "initiated"  # initiated, pending, paid, failed, expired
+    checkout_status: Optional[str] = None  # Stripe session status: open, complete, expired
+    paid_at: Optional[datetime] = None
     metadata: Optional[Dict[str, Any]] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+def transaction_created_at(transaction: Dict[str, Any]) -> datetime:
+    """When a stored transaction was created; older records only carry it in their ObjectId"""
+    return transaction.get("created_at") or transaction["_id"].generation_time.replace(tzinfo=None)
+
+def transaction_paid_at(transaction: Dict[str, Any]) -> datetime:
+    """When a paid transaction was paid; records from before paid_at was stored use their last update"""
+    return transaction.get("paid_at") or transaction.get("updated_at") or transaction_created_at(transaction)
+
 class PaymentTransactionCreate(BaseModel):
     session_id: str
     package_id: str
@@ -29,6 +39,7 @@ class PaymentTransactionCreate(BaseModel):
 class CheckoutRequest(BaseModel):
     package_id: str
     origin_url: str
+    email: Optional[str] = None  # Required for packages restricted to existing buyers
 
 class CheckoutResponse(BaseModel):
     url: str
@@ -40,11 +51,21 @@ class DownloadLink(BaseModel):
     url: str
     size: str
 
+class DownloadFile(BaseModel):
+    name: str
+    filename: Optional[str] = None  # Stored file name, None for non-file links
+    size: str
+    kind: str = "file"  # file, booking
+
 class DownloadRequest(BaseModel):
     email: str
     session_id: str
     package_type: str
 
+class BulkDownloadRequest(BaseModel):
+    session_ids: List[str] = Field(default_factory=list, max_length=10000)
+    emails: List[str] = Field(default_factory=list, max_length=10000)
+
 class DownloadResponse(BaseModel):
     download_links: List[DownloadLink]
 
@@ -97,4 +118,25 @@ PACKAGES = {
         ],
         available_to="main_buyers"
     )
-}
\ No newline at end of file
+}
+
+# Package a buyer must own for each available_to audience
+AUDIENCE_PACKAGES = {
+    "main_buyers": "guru_killer_main"
+}
+
+# Files delivered for each package, built once at import
+DOWNLOAD_CATALOG: Dict[str, Tuple[DownloadFile, ...]] = {
+    "guru_killer_main": (
+        DownloadFile(name="AI Lead Generation System", filename="ai-lead-generation.zip", size="15 MB"),
+        DownloadFile(name="Content Creation Automation", filename="content-automation.zip", size="12 MB"),
+        DownloadFile(name="Customer Support AI Agent", filename="support-agent.zip", size="18 MB"),
+        DownloadFile(name="Sales Funnel Optimizer", filename="funnel-optimizer.zip", size="8 MB"),
+        DownloadFile(name="Complete Implementation Guide", filename="implementation-guide.pdf", size="5 MB"),
+        DownloadFile(name="Video Walkthrough Series", filename="video-walkthroughs.zip", size="156 MB")
+    ),
+    "guru_killer_consulting": (
+        DownloadFile(name="Consultation Booking Link", size="N/A", kind="booking"),
+        DownloadFile(name="Pre-Session Preparation Guide", filename="pre-session-guide.pdf", size="2 MB")
+    )
+}
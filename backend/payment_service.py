@@ -1,28 +1,254 @@
+import asyncio
 import os
 import logging
-from typing import Optional, Dict, Any
+from collections import defaultdict
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Callable, Set
 from fastapi import HTTPException, Request
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutStatusResponse, CheckoutSessionRequest
 from motor.motor_asyncio import AsyncIOMotorClient
-from models import PaymentTransaction, PaymentTransactionCreate, PACKAGES
-from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
+from models import PaymentTransaction, PaymentTransactionCreate, CheckoutResponse, PACKAGES, AUDIENCE_PACKAGES
+from stats_service import StatsService
+from entitlements import EntitlementService, normalize_email
+from rollups import RollupService
+from idempotency import IdempotencyStore, request_fingerprint
+from stripe_pool import StripeClientPool, StripeUnavailable
+from metrics import STRIPE_STATUS_FALLBACKS
+from cache import SingleFlight
+from logging_config import bind_log_context
+from datetime import datetime, timedelta
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Local payment statuses that Stripe will not change any more
+TERMINAL_STATUSES = ("paid", "failed", "expired")
+
+# Fields read to answer a status request from the stored transaction
+STATUS_FIELDS = {"_id": 0, "payment_status": 1, "checkout_status": 1, "amount": 1, "currency": 1, "metadata": 1}
+
+# Statuses whose first arrival is counted in the stats, exactly once per transaction
+COUNTED_STATUSES = ("paid", "expired")
+
+# Side effects of entering each counted status, recorded on the transaction by the write that wins the move
+ENTERED_EFFECTS = {"paid": ["stats", "rollups", "entitlements"], "expired": ["stats"]}
+
 class PaymentService:
-    def __init__(self, db: AsyncIOMotorClient):
+    def __init__(
+        self,
+        db: AsyncIOMotorClient,
+        stats_service: Optional[StatsService] = None,
+        stripe_pool: Optional[StripeClientPool] = None,
+        entitlements: Optional[EntitlementService] = None,
+        rollups: Optional[RollupService] = None,
+        idempotency: Optional[IdempotencyStore] = None
+    ):
         self.db = db
+        self.stats = stats_service or StatsService(db)
+        self.entitlements = entitlements or EntitlementService(db)
+        self.rollups = rollups or RollupService(db)
+        self.idempotency = idempotency or IdempotencyStore(db)
         self.stripe_api_key = os.environ.get('STRIPE_API_KEY')
         if not self.stripe_api_key:
             raise ValueError("STRIPE_API_KEY environment variable is required")
+        self.stripe_pool = stripe_pool or StripeClientPool(self.stripe_api_key)
+        self._status_flight = SingleFlight()
+        self._update_listeners: List[Callable[[str], None]] = []
+        # Wakes status streams when a transaction changes, here or, through the invalidation bus, elsewhere
+        self._status_waiters: Dict[str, Set[asyncio.Event]] = defaultdict(set)
+        self.add_update_listener(self.notify_status_changed)
+    
+    def add_update_listener(self, listener: Callable[[str], None]) -> None:
+        """Register a callback run with the session id whenever a transaction is updated"""
+        self._update_listeners.append(listener)
+    
+    def notify_status_changed(self, session_id: Optional[str]) -> None:
+        """Wake the status streams watching session_id, or every stream when it is None"""
+        waiters = self._status_waiters.get(session_id, ()) if session_id is not None else [
+            waiter for waiters in self._status_waiters.values() for waiter in waiters
+        ]
+        for waiter in waiters:
+            waiter.set()
+    
+    def _notify_updated(self, session_id: str) -> None:
+        for listener in self._update_listeners:
+            listener(session_id)
+    
+    async def _update_transaction(self, session_id: str, update_data: Dict[str, Any]) -> bool:
+        """Apply an update to a transaction, counting it the first time it becomes paid or expired"""
+        try:
+            new_status = update_data.get("payment_status")
+            if new_status in COUNTED_STATUSES:
+                # Only one writer can win the move into a counted status, so the counters are bumped once
+                transaction = await self.db.payment_transactions.find_one_and_update(
+                    {"session_id": session_id, "payment_status": {"$nin": ["paid", new_status]}},
+                    {"$set": self._entered_fields(update_data, str(uuid.uuid4()))},
+                    return_document=ReturnDocument.AFTER
+                )
+                if transaction:
+                    await self._run_pending_effects(transaction)
+                    return True
+                
+                result = await self.db.payment_transactions.update_one(
+                    {"session_id": session_id, "payment_status": new_status},
+                    {"$set": update_data}
+                )
+                return result.matched_count > 0
+            
+            # Never move a paid transaction back to a non-paid status
+            result = await self.db.payment_transactions.update_one(
+                {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+                {"$set": update_data}
+            )
+            return result.matched_count > 0
+        finally:
+            self._notify_updated(session_id)
+    
+    async def apply_status_updates(self, updates: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """Apply many transaction updates with one bulk_write, returning how many matched"""
+        if not updates:
+            return 0
+        
+        # Transactions this batch moves into a counted status are tagged so their side effects run once
+        batch_id = str(uuid.uuid4())
+        operations = []
+        entered: Set[Tuple[str, str]] = set()
+        for session_id, update_data in updates:
+            new_status = update_data.get("payment_status")
+            if new_status in COUNTED_STATUSES and (session_id, new_status) in entered:
+                # A repeat inside the batch lands after the first one has tagged the transaction
+                operations.append(UpdateOne(
+                    {"session_id": session_id, "payment_status": new_status},
+                    {"$set": update_data}
+                ))
+            elif new_status in COUNTED_STATUSES:
+                entered.add((session_id, new_status))
+                operations.append(UpdateOne(
+                    {"session_id": session_id, "payment_status": {"$nin": ["paid", new_status]}},
+                    {"$set": self._entered_fields(update_data, batch_id)}
+                ))
+                operations.append(UpdateOne(
+                    {"session_id": session_id, "payment_status": new_status, "status_batch_id": {"$ne": batch_id}},
+                    {"$set": update_data}
+                ))
+            else:
+                operations.append(UpdateOne(
+                    {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+                    {"$set": update_data}
+                ))
+        
+        result = await self.db.payment_transactions.bulk_write(operations, ordered=True)
+        
+        async for transaction in self.db.payment_transactions.find({"status_batch_id": batch_id}):
+            await self._run_pending_effects(transaction)
+        
+        for session_id, _ in updates:
+            self._notify_updated(session_id)
+        
+        return result.matched_count
+    
+    def _entered_fields(self, update_data: Dict[str, Any], claim_id: str) -> Dict[str, Any]:
+        """Fields set only by the write that moves a transaction into a counted status
+        
+        The pending side effects are recorded in the same single-document write,
+        so a crash before they run leaves them on the transaction for
+        replay_pending_effects instead of losing them.
+        """
+        now = datetime.utcnow()
+        fields = {
+            **update_data,
+            "pending_effects": ENTERED_EFFECTS[update_data["payment_status"]],
+            "status_batch_id": claim_id,
+            "effects_claimed_at": now
+        }
+        if update_data["payment_status"] == "paid":
+            fields["paid_at"] = now
+        return fields
+    
+    async def _run_pending_effects(self, transaction: Dict[str, Any]) -> None:
+        """Run a transaction's pending side effects, crossing each off once it is done
+        
+        Effects are at least once: only the effect in flight when a process dies
+        can run twice on replay.
+        """
+        pending = list(transaction.get("pending_effects") or [])
+        claim = {"_id": transaction["_id"], "status_batch_id": transaction.get("status_batch_id")}
+        for index, effect in enumerate(pending):
+            await self._run_effect(effect, transaction)
+            if index < len(pending) - 1:
+                await self.db.payment_transactions.update_one(claim, {"$pull": {"pending_effects": effect}})
+        await self.db.payment_transactions.update_one(
+            claim,
+            {"$unset": {"pending_effects": "", "status_batch_id": "", "effects_claimed_at": ""}}
+        )
+    
+    async def _run_effect(self, effect: str, transaction: Dict[str, Any]) -> None:
+        if effect == "stats" and transaction["payment_status"] == "paid":
+            # A checkout paid after it expired no longer counts as expired
+            await self.stats.record_paid(transaction, was_expired=bool(transaction.get("expired_counted")))
+            if transaction.get("expired_counted"):
+                await self.db.payment_transactions.update_one(
+                    {"_id": transaction["_id"]}, {"$unset": {"expired_counted": ""}}
+                )
+        elif effect == "stats":
+            await self.stats.record_expired()
+            await self.db.payment_transactions.update_one(
+                {"_id": transaction["_id"]}, {"$set": {"expired_counted": True}}
+            )
+        elif effect == "rollups":
+            await self.rollups.record_paid(transaction)
+        elif effect == "entitlements":
+            await self.entitlements.grant(transaction)
+    
+    async def replay_pending_effects(self, older_than: Optional[float] = None) -> int:
+        """Run side effects left pending by a process that died, returning how many transactions were replayed"""
+        older_than = older_than if older_than is not None else float(
+            os.environ.get('EFFECTS_REPLAY_AFTER_SECONDS', '300')
+        )
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        replayed = 0
+        async for stale in self.db.payment_transactions.find(
+            {"status_batch_id": {"$exists": True}}, {"status_batch_id": 1, "effects_claimed_at": 1}
+        ):
+            claimed_at = stale.get("effects_claimed_at")
+            if claimed_at is not None and claimed_at >= cutoff:
+                continue
+            # Re-claim first so two sweepers never replay the same transaction
+            transaction = await self.db.payment_transactions.find_one_and_update(
+                {"_id": stale["_id"], "status_batch_id": stale["status_batch_id"]},
+                {"$set": {"status_batch_id": str(uuid.uuid4()), "effects_claimed_at": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
+            )
+            if transaction is None:
+                continue
+            if not transaction.get("pending_effects"):
+                logger.warning("Clearing stale status batch on session %s", transaction.get("session_id"))
+            else:
+                logger.warning(
+                    "Replaying %s for session %s", ", ".join(transaction["pending_effects"]), transaction.get("session_id")
+                )
+            await self._run_pending_effects(transaction)
+            replayed += 1
+        return replayed
     
-    def _get_stripe_checkout(self, request: Request) -> StripeCheckout:
-        """Initialize Stripe checkout with webhook URL"""
-        host_url = str(request.base_url).rstrip('/')
-        webhook_url = f"{host_url}/api/webhook/stripe"
-        return StripeCheckout(api_key=self.stripe_api_key, webhook_url=webhook_url)
+    async def create_checkout_session(self, package_id: str, origin_url: str, request: Request,
+                                      email: Optional[str] = None,
+                                      idempotency_key: Optional[str] = None) -> CheckoutResponse:
+        """Create a Stripe checkout session, only once per Idempotency-Key when one is given"""
+        if idempotency_key is None:
+            return await self._create_checkout_session(package_id, origin_url, request, email)
+        
+        async def create() -> Dict[str, Any]:
+            session = await self._create_checkout_session(package_id, origin_url, request, email)
+            return session.dict()
+        
+        fingerprint = request_fingerprint(
+            {"package_id": package_id, "origin_url": origin_url, "email": normalize_email(email)}
+        )
+        return CheckoutResponse(**await self.idempotency.run(idempotency_key, fingerprint, create))
     
-    async def create_checkout_session(self, package_id: str, origin_url: str, request: Request) -> CheckoutSessionResponse:
+    async def _create_checkout_session(self, package_id: str, origin_url: str, request: Request,
+                                       email: Optional[str] = None) -> CheckoutResponse:
         """Create a Stripe checkout session for the specified package"""
         try:
             # Validate package exists
@@ -31,13 +257,17 @@ class PaymentService:
             
             package = PACKAGES[package_id]
             
-            # TODO: Add consulting package availability check
-            # if package.available_to == "main_buyers":
-            #     # Check if user has purchased main package
-            #     pass
+            # Restricted packages need the buyer to own the audience package, usually answered from memory
+            if package.available_to:
+                required_package = AUDIENCE_PACKAGES[package.available_to]
+                if not await self.entitlements.has(email, required_package):
+                    raise HTTPException(
+                        status_code=403,
+                        detail=f"{package.name} is only available to {PACKAGES[required_package].name} buyers"
+                    )
             
             # Initialize Stripe checkout
-            stripe_checkout = self._get_stripe_checkout(request)
+            stripe_checkout = self.stripe_pool.get()
             
             # Build URLs
             success_url = f"{origin_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
@@ -57,7 +287,11 @@ class PaymentService:
             )
             
             # Create session with Stripe
-            session = await stripe_checkout.create_checkout_session(checkout_request)
+            session = await self.stripe_pool.call(
+                "create_checkout_session",
+                lambda: stripe_checkout.create_checkout_session(checkout_request)
+            )
+            bind_log_context(session_id=session.session_id)
             
             # Store transaction in database
             transaction = PaymentTransactionCreate(
@@ -65,82 +299,208 @@ class PaymentService:
                 package_id=package_id,
                 amount=package.price,
                 currency=package.currency,
-                email="",  # Will be updated when we get webhook
+                email=normalize_email(email),  # Filled from the webhook when not given at checkout
                 metadata=checkout_request.metadata
             )
             
-            await self.db.payment_transactions.insert_one(transaction.dict())
+            # Store the full record so status and created_at are set for the reconciliation sweep
+            transaction_doc = PaymentTransaction(**transaction.dict()).dict()
+            await self.db.payment_transactions.insert_one(transaction_doc)
+            await self.stats.record_initiated()
+            await self.rollups.record_initiated(transaction_doc)
             
-            logger.info(f"Created checkout session: {session.session_id} for package: {package_id}")
+            logger.info("Created checkout session: %s for package: %s", session.session_id, package_id)
             
-            return session
+            return CheckoutResponse(url=session.url, session_id=session.session_id)
             
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"Error creating checkout session: {str(e)}")
+            logger.error("Error creating checkout session: %s", e)
             raise HTTPException(status_code=500, detail="Failed to create checkout session")
     
     async def get_payment_status(self, session_id: str, request: Request) -> CheckoutStatusResponse:
         """Get the current status of a payment session"""
         try:
-            # Get status from Stripe
-            stripe_checkout = self._get_stripe_checkout(request)
-            status = await stripe_checkout.get_checkout_status(session_id)
-            
-            # Update local database record
-            update_data = {
-                "payment_status": status.payment_status,
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Extract email from metadata if available
-            if status.metadata and "customer_email" in status.metadata:
-                update_data["email"] = status.metadata["customer_email"]
-            
-            await self.db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": update_data}
-            )
-            
-            logger.info(f"Updated payment status for session {session_id}: {status.payment_status}")
+            # Terminal sessions are answered from our own record without calling Stripe
+            transaction = await self.db.payment_transactions.find_one({"session_id": session_id})
+            if transaction and transaction.get("payment_status") in TERMINAL_STATUSES:
+                return self._status_from_transaction(transaction)
             
-            return status
+            # Concurrent polls for the same session share one Stripe request
+            try:
+                return await self._status_flight.do(
+                    session_id,
+                    lambda: self._fetch_payment_status(session_id, request)
+                )
+            except StripeUnavailable as e:
+                if transaction is None:
+                    raise
+                # Answer with the last known state while Stripe is failing or the breaker is open
+                STRIPE_STATUS_FALLBACKS.inc()
+                logger.warning("Serving stored status for session %s: %s", session_id, e.detail)
+                return self._status_from_transaction(transaction)
             
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"Error getting payment status: {str(e)}")
+            logger.error("Error getting payment status: %s", e)
             raise HTTPException(status_code=500, detail="Failed to get payment status")
     
+    async def _fetch_payment_status(self, session_id: str, request: Request) -> CheckoutStatusResponse:
+        """Get status from Stripe and record it on the transaction"""
+        status = await self.check_stripe_status(session_id, self.stripe_pool.get())
+        
+        # Update local database record
+        await self._update_transaction(session_id, self.status_update_data(status))
+        
+        logger.info("Updated payment status for session %s: %s", session_id, status.payment_status)
+        
+        return status
+    
+    async def check_stripe_status(self, session_id: str, stripe_checkout: StripeCheckout,
+                                  shed: bool = True) -> CheckoutStatusResponse:
+        """Ask Stripe for a checkout session's status without recording it"""
+        return await self.stripe_pool.call(
+            "get_checkout_status",
+            lambda: stripe_checkout.get_checkout_status(session_id),
+            shed=shed,
+            idempotent=True
+        )
+    
+    def status_update_data(self, status: CheckoutStatusResponse) -> Dict[str, Any]:
+        """Build the transaction update for a status fetched from Stripe"""
+        update_data = {
+            "payment_status": "expired" if status.status == "expired" else status.payment_status,
+            "checkout_status": status.status,
+            "updated_at": datetime.utcnow()
+        }
+        
+        # Extract email from metadata if available
+        if status.metadata and "customer_email" in status.metadata:
+            update_data["email"] = status.metadata["customer_email"]
+        
+        return update_data
+    
+    def _status_from_transaction(self, transaction: Dict[str, Any]) -> CheckoutStatusResponse:
+        """Build a status response from the stored transaction record"""
+        payment_status = transaction.get("payment_status") or "initiated"
+        default_checkout_status = "complete" if payment_status in TERMINAL_STATUSES else "open"
+        checkout_status = {"paid": "complete", "expired": "expired"}.get(
+            payment_status, transaction.get("checkout_status") or default_checkout_status
+        )
+        return CheckoutStatusResponse(
+            status=checkout_status,
+            payment_status="unpaid" if payment_status in ("expired", "initiated") else payment_status,
+            amount_total=int(round(transaction["amount"] * 100)),
+            currency=transaction.get("currency", "gbp"),
+            metadata=transaction.get("metadata") or {}
+        )
+    
+    def is_terminal_status(self, status: CheckoutStatusResponse) -> bool:
+        """Whether a checkout status will not change any more"""
+        return status.payment_status in TERMINAL_STATUSES or status.status == "expired"
+    
+    async def watch_payment_status(self, session_id: str, request: Request, interval: float, timeout: float,
+                                   stripe_interval: Optional[float] = None) -> AsyncIterator[CheckoutStatusResponse]:
+        """Yield the payment status each time it changes, until it is terminal or timeout passes
+        
+        The stored transaction, kept current by webhooks and the reconciler,
+        is re-read as soon as a change to it is recorded and at least every
+        ``interval`` seconds. Stripe is only asked every ``stripe_interval``
+        seconds, in case a webhook is late, or straight away for a session
+        with no stored transaction.
+        """
+        if stripe_interval is None:
+            stripe_interval = float(os.environ.get('CHECKOUT_STREAM_STRIPE_INTERVAL_SECONDS', '30'))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        next_stripe_check = loop.time() + stripe_interval
+        changed = asyncio.Event()
+        self._status_waiters[session_id].add(changed)
+        try:
+            last_seen = None
+            while True:
+                changed.clear()
+                transaction = await self.db.payment_transactions.find_one({"session_id": session_id}, STATUS_FIELDS)
+                if transaction is None or loop.time() >= next_stripe_check:
+                    status = await self.get_payment_status(session_id, request)
+                    next_stripe_check = loop.time() + stripe_interval
+                else:
+                    status = self._status_from_transaction(transaction)
+                current = (status.status, status.payment_status)
+                if current != last_seen:
+                    last_seen = current
+                    yield status
+                if self.is_terminal_status(status):
+                    return
+                
+                remaining = deadline - loop.time()
+                if remaining <= 0 or await request.is_disconnected():
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters = self._status_waiters[session_id]
+            waiters.discard(changed)
+            if not waiters:
+                del self._status_waiters[session_id]
+    
+    async def verify_webhook(self, request_body: bytes, stripe_signature: str, request: Request):
+        """Verify a Stripe webhook signature and parse the event"""
+        stripe_checkout = self.stripe_pool.get()
+        # Webhooks are never shed: Stripe's retries would only add to the load
+        return await self.stripe_pool.call(
+            "handle_webhook",
+            lambda: stripe_checkout.handle_webhook(request_body, stripe_signature),
+            shed=False,
+            breaker=False
+        )
+    
+    def webhook_update_data(self, event_type: str, payment_status: str, session_id: str,
+                            metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Build the transaction update for a webhook event, or None if it is not relevant"""
+        if event_type not in ["checkout.session.completed", "payment_intent.succeeded"]:
+            return None
+        
+        update_data = {
+            "payment_status": payment_status,
+            "payment_id": session_id,  # This might be payment_intent_id
+            "updated_at": datetime.utcnow()
+        }
+        
+        # Extract email from metadata
+        if metadata and "customer_email" in metadata:
+            update_data["email"] = metadata["customer_email"]
+        
+        return update_data
+    
     async def handle_webhook(self, request_body: bytes, stripe_signature: str, request: Request):
-        """Handle Stripe webhook events"""
+        """Handle Stripe webhook events inline"""
         try:
-            stripe_checkout = self._get_stripe_checkout(request)
-            webhook_response = await stripe_checkout.handle_webhook(request_body, stripe_signature)
+            webhook_response = await self.verify_webhook(request_body, stripe_signature, request)
             
             # Update transaction record based on webhook
-            if webhook_response.event_type in ["checkout.session.completed", "payment_intent.succeeded"]:
-                update_data = {
-                    "payment_status": webhook_response.payment_status,
-                    "payment_id": webhook_response.session_id,  # This might be payment_intent_id
-                    "updated_at": datetime.utcnow()
-                }
-                
-                # Extract email from metadata
-                if webhook_response.metadata and "customer_email" in webhook_response.metadata:
-                    update_data["email"] = webhook_response.metadata["customer_email"]
-                
-                result = await self.db.payment_transactions.update_one(
-                    {"session_id": webhook_response.session_id},
-                    {"$set": update_data}
-                )
+            update_data = self.webhook_update_data(
+                webhook_response.event_type,
+                webhook_response.payment_status,
+                webhook_response.session_id,
+                webhook_response.metadata
+            )
+            if update_data:
+                updated = await self._update_transaction(webhook_response.session_id, update_data)
                 
-                if result.modified_count > 0:
-                    logger.info(f"Webhook updated transaction for session: {webhook_response.session_id}")
+                if updated:
+                    logger.info("Webhook updated transaction for session: %s", webhook_response.session_id)
                 else:
-                    logger.warning(f"No transaction found for session: {webhook_response.session_id}")
+                    logger.warning("No transaction found for session: %s", webhook_response.session_id)
             
             return {"status": "success"}
             
         except Exception as e:
-            logger.error(f"Error handling webhook: {str(e)}")
+            logger.error("Error handling webhook: %s", e)
             raise HTTPException(status_code=400, detail="Webhook processing failed")
     
     async def get_transaction_by_session(self, session_id: str) -> Optional[PaymentTransaction]:
@@ -151,25 +511,19 @@ class PaymentService:
                 return PaymentTransaction(**transaction_doc)
             return None
         except Exception as e:
-            logger.error(f"Error getting transaction: {str(e)}")
+            logger.error("Error getting transaction: %s", e)
             return None
     
     async def get_public_stats(self) -> Dict[str, Any]:
         """Get public analytics stats"""
         try:
-            # Get basic stats from database
-            total_transactions = await self.db.payment_transactions.count_documents({"payment_status": "paid"})
-            
-            # Calculate total revenue
-            pipeline = [
-                {"$match": {"payment_status": "paid"}},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            revenue_result = await self.db.payment_transactions.aggregate(pipeline).to_list(1)
-            total_revenue = revenue_result[0]["total"] if revenue_result else 0
-            
-            # Calculate success rate (paid vs total initiated)
-            total_initiated = await self.db.payment_transactions.count_documents({})
+            # Read the materialized counters instead of scanning payment_transactions
+            counters = await self.stats.get_counters()
+            total_transactions = counters["paid_count"]
+            total_revenue = sum(counters["revenue"].values())
+            
+            # Calculate success rate (paid vs initiated, leaving out checkouts that expired unpaid)
+            total_initiated = counters["initiated_count"] - counters["expired_count"]
             success_rate = (total_transactions / max(total_initiated, 1)) * 100 if total_initiated > 0 else 0
             
             return {
@@ -180,7 +534,7 @@ class PaymentService:
             }
             
         except Exception as e:
-            logger.error(f"Error getting public stats: {str(e)}")
+            logger.error("Error getting public stats: %s", e)
             # Return mock stats as fallback
             return {
                 "total_revenue": "£247,000+",
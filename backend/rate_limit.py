@@ -0,0 +1,234 @@
+"""Token-bucket rate limiting for the Stripe-bound checkout routes
+
+Each rule is a bucket of ``capacity`` tokens refilled evenly over
+``period`` seconds, keyed by client IP or by the session id in the path.
+Behind a load balancer the client IP is read from X-Forwarded-For, trusting
+only the hops listed in TRUSTED_PROXIES (comma separated addresses or
+networks); without it every request would share the proxy's bucket.
+Buckets live in process memory by default; set RATE_LIMIT_BACKEND=mongo to
+share them between worker processes through the rate_limits collection.
+"""
+import ipaddress
+import json
+import math
+import os
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from cache import TTLCache, MISSING
+from metrics import RATE_LIMITED_REQUESTS, match_route
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_ROUTES = (("POST", "/api/checkout/session"),)
+STATUS_ROUTES = (
+    ("GET", "/api/checkout/status/{session_id}"),
+    ("GET", "/api/checkout/status/{session_id}/stream"),
+)
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_trusted_proxies(value: Optional[str] = None) -> List[Network]:
+    """Networks from TRUSTED_PROXIES whose X-Forwarded-For entries are believed"""
+    if value is None:
+        value = os.environ.get('TRUSTED_PROXIES', '')
+    return [ipaddress.ip_network(entry.strip(), strict=False) for entry in value.split(",") if entry.strip()]
+
+
+def _is_trusted(address: str, trusted: Sequence[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted)
+
+
+def client_ip(scope: Scope, trusted: Sequence[Network]) -> str:
+    """The address a request came from, looking through trusted proxies
+
+    X-Forwarded-For is walked from the right, since each proxy appends the
+    peer it saw; the first hop that is not a trusted proxy is the client.
+    Entries further left were written by the client and are ignored.
+    """
+    peer = scope["client"][0] if scope.get("client") else "unknown"
+    if not trusted or not _is_trusted(peer, trusted):
+        return peer
+    forwarded = b",".join(value for name, value in scope.get("headers", []) if name == b"x-forwarded-for")
+    hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, trusted):
+            return hop
+    return hops[0] if hops else peer
+
+
+class RateLimitRule:
+    """A token bucket applied per client IP or per session id on a set of routes"""
+
+    def __init__(self, name: str, routes: Iterable[Tuple[str, str]], key: str, capacity: int, period: float):
+        self.name = name
+        self.routes = frozenset(routes)
+        self.key = key
+        self.capacity = capacity
+        self.period = period
+        self.refill_rate = capacity / period
+
+    @classmethod
+    def from_env(cls, name: str, routes: Iterable[Tuple[str, str]], key: str, default: str) -> "RateLimitRule":
+        """Build a rule from RATE_LIMIT_<NAME>, written as "<requests>/<seconds>" """
+        capacity, _, period = os.environ.get(f"RATE_LIMIT_{name.upper()}", default).partition("/")
+        return cls(name, routes, key, int(capacity), float(period or 60))
+
+
+def default_rules() -> List[RateLimitRule]:
+    # The frontend polls status every 2 seconds, so a session normally needs 30 a minute
+    return [
+        RateLimitRule.from_env("checkout_ip", CHECKOUT_ROUTES, "ip", "10/60"),
+        RateLimitRule.from_env("status_ip", STATUS_ROUTES, "ip", "120/60"),
+        RateLimitRule.from_env("status_session", STATUS_ROUTES, "session_id", "60/60"),
+    ]
+
+
+class MemoryBackend:
+    """Buckets held in this process, bounded by an LRU of idle keys"""
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self._buckets = TTLCache(maxsize=maxsize or int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000')))
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        """Take a token, returning 0 when allowed or the seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        tokens, updated_at = (rule.capacity, now) if bucket is MISSING else bucket
+        tokens = min(rule.capacity, tokens + (now - updated_at) * rule.refill_rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rule.refill_rate
+        # An idle bucket is full again after one period, so it can be forgotten then
+        self._buckets.set(key, (tokens, now), ttl=rule.period)
+        return wait
+
+
+class MongoBackend:
+    """Buckets shared by every worker, updated atomically with a pipeline update"""
+
+    def __init__(self, db: AsyncIOMotorClient):
+        self.db = db
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        """Take a token, returning 0 when allowed or the seconds until one is available"""
+        now = datetime.utcnow()
+        refilled = {"$min": [
+            rule.capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", rule.capacity]},
+                {"$multiply": [
+                    {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]},
+                    rule.refill_rate
+                ]}
+            ]}
+        ]}
+        bucket = await self.db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "updated_at": now,
+                    "expires_at": now + timedelta(seconds=rule.period)
+                }},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / rule.refill_rate
+
+
+def create_backend(db: AsyncIOMotorClient):
+    """Pick the bucket store named by RATE_LIMIT_BACKEND"""
+    backend = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+    if backend == "mongo":
+        return MongoBackend(db)
+    if backend != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return MemoryBackend()
+
+
+class RateLimiter:
+    """Applies every matching rule to a request"""
+
+    def __init__(self, backend, rules: Optional[List[RateLimitRule]] = None,
+                 trusted_proxies: Optional[List[Network]] = None):
+        self.backend = backend
+        self.rules = default_rules() if rules is None else rules
+        self.trusted_proxies = parse_trusted_proxies() if trusted_proxies is None else trusted_proxies
+        self._by_route: Dict[Tuple[str, str], List[RateLimitRule]] = {}
+        for rule in self.rules:
+            for route in rule.routes:
+                self._by_route.setdefault(route, []).append(rule)
+
+    async def check(self, scope: Scope) -> Optional[Tuple[RateLimitRule, float]]:
+        """Return the first exhausted rule and its wait in seconds, or None if allowed"""
+        route, path_params = match_route(scope)
+        rules = self._by_route.get((scope["method"], route))
+        if not rules:
+            return None
+        for rule in rules:
+            if rule.key == "ip":
+                value = client_ip(scope, self.trusted_proxies)
+            else:
+                value = path_params.get(rule.key)
+                if value is None:
+                    continue
+            wait = await self.backend.take(f"{rule.name}:{value}", rule)
+            if wait > 0:
+                return rule, wait
+        return None
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering over-limit requests with 429 and Retry-After
+
+    The limiter is created per worker in the app lifespan and read from
+    ``app.state.services``; requests arriving before startup pass through.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        services = getattr(scope["app"].state, "services", None) if "app" in scope else None
+        limited = await services.rate_limiter.check(scope) if services else None
+        if limited is None:
+            await self.app(scope, receive, send)
+            return
+
+        rule, wait = limited
+        RATE_LIMITED_REQUESTS.inc(rule=rule.name)
+        body = json.dumps({"detail": "Too many requests, please retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from payment_service import PaymentService, TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Document in job_state holding the sweep checkpoint and lease
+JOB_ID = "reconcile_transactions"
+
+
+class ReconcileLocked(RuntimeError):
+    """Raised when another process holds the reconciliation lease"""
+
+
+class TransactionReconciler:
+    """Settles stale non-terminal transactions against Stripe
+
+    Transactions older than ``min_age`` that are not paid, failed or expired
+    are paged through in ``_id`` order, their Stripe status is fetched with
+    bounded concurrency, and changes are applied with one bulk_write per
+    page through ``PaymentService.apply_status_updates``. Those updates are
+    conditional, so a webhook landing mid-sweep is never overwritten.
+
+    The last ``_id`` of each finished page is checkpointed in job_state; a
+    run that dies part way is resumed from there by the next run. A lease
+    in the same document keeps workers from sweeping at the same time.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorClient,
+        payment_service: PaymentService,
+        min_age: Optional[timedelta] = None,
+        page_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        lease: Optional[timedelta] = None
+    ):
+        self.db = db
+        self.payment_service = payment_service
+        self.min_age = min_age or timedelta(
+            minutes=float(os.environ.get('RECONCILE_MIN_AGE_MINUTES', '60'))
+        )
+        self.page_size = page_size or int(os.environ.get('RECONCILE_PAGE_SIZE', '100'))
+        self.concurrency = concurrency or int(os.environ.get('RECONCILE_CONCURRENCY', '5'))
+        self.lease = lease or timedelta(seconds=float(os.environ.get('RECONCILE_LEASE_SECONDS', '600')))
+        self.owner = f"{os.getpid()}:{id(self)}"
+
+    async def run(self) -> Dict[str, Any]:
+        """Sweep once, resuming an interrupted sweep, and return a report of what changed"""
+        state = await self._acquire_lease()
+        resumed = state.get("cursor") is not None
+        if resumed:
+            cursor, cutoff = state["cursor"], state["cutoff"]
+        else:
+            cursor, cutoff = None, ObjectId.from_datetime(datetime.utcnow() - self.min_age)
+
+        report = {
+            "started_at": datetime.utcnow(),
+            "resumed": resumed,
+            "checked": 0,
+            "updated": 0,
+            "errors": 0,
+            "transitions": Counter()
+        }
+        try:
+            while True:
+                page = await self._next_page(cursor, cutoff)
+                if not page:
+                    break
+                await self._reconcile_page(page, report)
+                cursor = page[-1]["_id"]
+                await self._checkpoint({"cursor": cursor, "cutoff": cutoff})
+
+            # Side effects left behind by a worker that died mid-update are replayed under the same lease
+            report["effects_replayed"] = await self.payment_service.replay_pending_effects()
+            report["finished_at"] = datetime.utcnow()
+            report["transitions"] = dict(report["transitions"])
+            await self._checkpoint({"cursor": None, "cutoff": None, "last_report": report})
+        finally:
+            await self._release_lease()
+
+        logger.info(
+            "Reconciled %s transactions: %s updated, %s errors, transitions %s",
+            report["checked"], report["updated"], report["errors"], report["transitions"]
+        )
+        return report
+
+    async def _next_page(self, cursor: Optional[ObjectId], cutoff: ObjectId) -> List[Dict[str, Any]]:
+        id_range: Dict[str, Any] = {"$lt": cutoff}
+        if cursor is not None:
+            id_range["$gt"] = cursor
+        return await self.db.payment_transactions.find(
+            {"_id": id_range, "payment_status": {"$nin": list(TERMINAL_STATUSES)}},
+            {"_id": 1, "session_id": 1, "payment_status": 1, "checkout_status": 1}
+        ).sort("_id", 1).limit(self.page_size).to_list(self.page_size)
+
+    async def _reconcile_page(self, page: List[Dict[str, Any]], report: Dict[str, Any]) -> None:
+        stripe_checkout = self.payment_service.stripe_pool.get()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(transaction: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+            async with semaphore:
+                try:
+                    status = await self.payment_service.check_stripe_status(
+                        transaction["session_id"], stripe_checkout, shed=False
+                    )
+                except Exception as e:
+                    logger.warning("Reconcile lookup failed for session %s: %s", transaction["session_id"], e)
+                    report["errors"] += 1
+                    return None
+            update_data = self.payment_service.status_update_data(status)
+            old_status = transaction.get("payment_status") or "initiated"
+            if (update_data["payment_status"] == old_status
+                    and update_data["checkout_status"] == transaction.get("checkout_status")):
+                return None
+            report["transitions"][f"{old_status}->{update_data['payment_status']}"] += 1
+            return transaction["session_id"], update_data
+
+        results = await asyncio.gather(*(check(transaction) for transaction in page))
+        updates = [result for result in results if result]
+        report["checked"] += len(page)
+        report["updated"] += await self.payment_service.apply_status_updates(updates)
+
+    async def _acquire_lease(self) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        try:
+            state = await self.db.job_state.find_one_and_update(
+                {
+                    "_id": JOB_ID,
+                    "$or": [{"lease_until": {"$lt": now}}, {"lease_until": None}, {"lease_owner": self.owner}]
+                },
+                {"$set": {"lease_owner": self.owner, "lease_until": now + self.lease}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            raise ReconcileLocked("Another reconciliation run holds the lease")
+        return state or {}
+
+    async def _checkpoint(self, fields: Dict[str, Any]) -> None:
+        # Each checkpoint also extends the lease while the sweep is making progress
+        await self.db.job_state.update_one(
+            {"_id": JOB_ID, "lease_owner": self.owner},
+            {"$set": {**fields, "lease_until": datetime.utcnow() + self.lease}}
+        )
+
+    async def _release_lease(self) -> None:
+        await self.db.job_state.update_one(
+            {"_id": JOB_ID, "lease_owner": self.owner},
+            {"$set": {"lease_owner": None, "lease_until": None}}
+        )
+
+
+class ReconcileScheduler:
+    """Runs the reconciler every ``interval`` seconds inside an app worker"""
+
+    def __init__(self, reconciler: TransactionReconciler, interval: Optional[float] = None):
+        self.reconciler = reconciler
+        self.interval = interval if interval is not None else float(
+            os.environ.get('RECONCILE_INTERVAL_SECONDS', '900')
+        )
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the periodic sweep; an interval of 0 disables it"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the periodic sweep; an interrupted sweep resumes from its checkpoint"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconciler.run()
+            except ReconcileLocked:
+                logger.debug("Reconciliation skipped, another worker holds the lease")
+            except Exception as e:
+                logger.error("Reconciliation run failed: %s", e)
@@ -0,0 +1,161 @@
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
+
+from models import transaction_created_at, transaction_paid_at
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+
+# Widest range a single analytics query may cover, per granularity
+MAX_RANGE = {"hour": timedelta(days=31), "day": timedelta(days=3 * 366)}
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bucket_key(granularity: str, start: datetime, package_id: str, currency: str) -> str:
+    return f"{granularity}:{start.isoformat()}:{package_id}:{currency}"
+
+
+class RollupService:
+    """Hourly and daily revenue buckets per package and currency
+
+    Every checkout increments ``initiated`` in the buckets of its creation
+    time, and every transaction moving to paid increments ``paid`` and
+    ``revenue`` in the buckets of its payment time. Each event is a single
+    bulk_write touching the hour and the day bucket, and analytics queries
+    read only these buckets.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient):
+        self.db = db
+
+    async def _increment(self, moment: datetime, package_id: str, currency: str, inc: Dict[str, Any]) -> None:
+        operations = []
+        for granularity in GRANULARITIES:
+            start = bucket_start(moment, granularity)
+            operations.append(UpdateOne(
+                {"_id": _bucket_key(granularity, start, package_id, currency)},
+                {
+                    "$inc": inc,
+                    "$setOnInsert": {
+                        "granularity": granularity,
+                        "bucket_start": start,
+                        "package_id": package_id,
+                        "currency": currency
+                    }
+                },
+                upsert=True
+            ))
+        await self.db.revenue_rollups.bulk_write(operations, ordered=False)
+
+    async def record_initiated(self, transaction: Dict[str, Any]) -> None:
+        """Count a new checkout in the buckets of its creation time"""
+        await self._increment(
+            transaction_created_at(transaction), transaction["package_id"], transaction.get("currency") or "gbp",
+            {"initiated": 1}
+        )
+
+    async def record_paid(self, transaction: Dict[str, Any]) -> None:
+        """Count a payment and its revenue in the buckets of its payment time"""
+        await self._increment(
+            transaction_paid_at(transaction), transaction["package_id"], transaction.get("currency") or "gbp",
+            {"paid": 1, "revenue": transaction.get("amount", 0)}
+        )
+
+    async def query(self, start: datetime, end: datetime, granularity: str = "day",
+                    package_id: Optional[str] = None) -> Dict[str, Any]:
+        """Buckets starting in [start, end) with per-currency totals and conversion"""
+        if granularity not in GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if end <= start:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        if end - start > MAX_RANGE[granularity]:
+            raise HTTPException(status_code=400, detail=f"Range too wide for {granularity} buckets")
+
+        query: Dict[str, Any] = {
+            "granularity": granularity,
+            "bucket_start": {"$gte": bucket_start(start, granularity), "$lt": end}
+        }
+        if package_id:
+            query["package_id"] = package_id
+
+        buckets = []
+        totals: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"initiated": 0, "paid": 0, "revenue": 0})
+        async for row in self.db.revenue_rollups.find(query, {"_id": 0, "granularity": 0}).sort("bucket_start", 1):
+            bucket = {
+                "bucket_start": row["bucket_start"],
+                "package_id": row["package_id"],
+                "currency": row["currency"],
+                "initiated": row.get("initiated", 0),
+                "paid": row.get("paid", 0),
+                "revenue": row.get("revenue", 0)
+            }
+            buckets.append(bucket)
+            currency_totals = totals[bucket["currency"]]
+            for field in ("initiated", "paid", "revenue"):
+                currency_totals[field] += bucket[field]
+
+        for currency_totals in totals.values():
+            initiated = currency_totals["initiated"]
+            currency_totals["conversion_rate"] = currency_totals["paid"] / initiated if initiated else None
+
+        return {"granularity": granularity, "start": start, "end": end, "buckets": buckets, "totals": dict(totals)}
+
+    async def backfill(self, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """Rebuild every bucket from payment_transactions and the archive
+
+        Transactions are streamed in batches and only the bucket totals are
+        held in memory. Increments that land while the backfill is running
+        may be lost, so run this during a quiet period.
+        """
+        batch_size = batch_size or int(os.environ.get('ROLLUP_BACKFILL_BATCH_SIZE', '1000'))
+        counts: Dict[Tuple[str, datetime, str, str], Dict[str, Any]] = defaultdict(
+            lambda: {"initiated": 0, "paid": 0, "revenue": 0}
+        )
+        scanned = 0
+        projection = {"package_id": 1, "currency": 1, "amount": 1, "payment_status": 1,
+                      "created_at": 1, "updated_at": 1, "paid_at": 1}
+        for collection in (self.db.payment_transactions, self.db.payment_transactions_archive):
+            async for transaction in collection.find({}, projection).batch_size(batch_size):
+                scanned += 1
+                package_id = transaction.get("package_id") or "unknown"
+                currency = transaction.get("currency") or "gbp"
+                for granularity in GRANULARITIES:
+                    created = bucket_start(transaction_created_at(transaction), granularity)
+                    counts[(granularity, created, package_id, currency)]["initiated"] += 1
+                    if transaction.get("payment_status") == "paid":
+                        paid = counts[(granularity, bucket_start(transaction_paid_at(transaction), granularity), package_id, currency)]
+                        paid["paid"] += 1
+                        paid["revenue"] += transaction.get("amount", 0)
+
+        operations: List[ReplaceOne] = []
+        written = 0
+        for (granularity, start, package_id, currency), values in counts.items():
+            operations.append(ReplaceOne(
+                {"_id": _bucket_key(granularity, start, package_id, currency)},
+                {"granularity": granularity, "bucket_start": start, "package_id": package_id,
+                 "currency": currency, **values},
+                upsert=True
+            ))
+            if len(operations) >= batch_size:
+                await self.db.revenue_rollups.bulk_write(operations, ordered=False)
+                written += len(operations)
+                operations = []
+        if operations:
+            await self.db.revenue_rollups.bulk_write(operations, ordered=False)
+            written += len(operations)
+
+        logger.info("Rebuilt %s revenue buckets from %s transactions", written, scanned)
+        return {"transactions": scanned, "buckets": written}
@@ -1,45 +1,129 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, Header
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import json
 import logging
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Import our services and models
 from models import (
     CheckoutRequest, CheckoutResponse, DownloadRequest, DownloadResponse, 
-    PublicStats, PACKAGES, PaymentTransaction
+    BulkDownloadRequest, PublicStats, PACKAGES, PaymentTransaction
 )
 from payment_service import PaymentService
 from download_service import DownloadService
+from index_manager import IndexManager
+from webhook_inbox import WebhookInbox
+from reconciliation import TransactionReconciler, ReconcileScheduler
+from file_delivery import FileDelivery
+from metrics import MetricsMiddleware, MetricsPublisher
+from database import create_mongo_client
+from static_responses import PrecomputedJSON, dumps, orjson
+from logging_config import bind_log_context, configure_logging, LogContextMiddleware
+from rate_limit import RateLimiter, RateLimitMiddleware, create_backend
+from admin_auth import require_admin
+from email_outbox import OutboxDispatcher, SmtpTransport
+from transaction_export import TransactionExporter
+from invalidation import InvalidationBus
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+class Services:
+    """The Mongo client and services owned by one worker process
+
+    Built inside the lifespan handler so each worker opens its own
+    connection pool on its own event loop after the fork.
+    """
+
+    def __init__(self, client: AsyncIOMotorClient):
+        self.client = client
+        self.db = client[os.environ['DB_NAME']]
+        self.payment_service = PaymentService(self.db)
+        self.download_service = DownloadService(self.db)
+        self.payment_service.add_update_listener(self.download_service.invalidate_session)
+        # Writes made by other workers reach this worker's caches through the bus
+        self.invalidation_bus = InvalidationBus(self.db)
+        # Download access is computed from payment_transactions alone
+        self.invalidation_bus.subscribe("payment_transactions", self.download_service.invalidate_session)
+        # Counters only move when a transaction changes status; new checkouts show up once the stats TTL lapses
+        self.invalidation_bus.subscribe(
+            "payment_transactions", lambda session_id: self.payment_service.stats.invalidate(), fields=["payment_status"]
+        )
+        self.invalidation_bus.subscribe(
+            "payment_transactions", self.payment_service.notify_status_changed,
+            fields=["payment_status", "checkout_status"]
+        )
+        self.webhook_inbox = WebhookInbox(self.db, self.payment_service)
+        self.reconcile_scheduler = ReconcileScheduler(TransactionReconciler(self.db, self.payment_service))
+        self.rate_limiter = RateLimiter(create_backend(self.db))
+        self.outbox_dispatcher = OutboxDispatcher(self.db, SmtpTransport.from_env())
+        self.file_delivery = FileDelivery()
+        self.transaction_exporter = TransactionExporter(self.db)
+        self.metrics_publisher = MetricsPublisher(self.db)
+
+    async def start(self) -> None:
+        index_manager = IndexManager(self.db)
+        # Migrations run once per deploy from manage.py, not in every worker at once
+        await index_manager.ensure_indexes(migrate=False)
+        # Opt-in check that every hot query is served by an index
+        if os.environ.get('MONGO_VERIFY_QUERY_PLANS', 'false').lower() == 'true':
+            await index_manager.verify_query_plans()
+        
+        await self.payment_service.entitlements.start()
+        self.payment_service.stripe_pool.open()
+        self.webhook_inbox.start()
+        self.reconcile_scheduler.start()
+        self.outbox_dispatcher.start()
+        self.invalidation_bus.start()
+        self.metrics_publisher.start()
+
+    async def stop(self) -> None:
+        await self.metrics_publisher.stop()
+        await self.invalidation_bus.stop()
+        await self.reconcile_scheduler.stop()
+        await self.outbox_dispatcher.stop()
+        await self.payment_service.entitlements.stop()
+        # Let queued webhooks finish before the Stripe and Mongo pools go away
+        await self.webhook_inbox.stop()
+        await self.payment_service.stripe_pool.close()
+        self.client.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Handlers run on a listener thread so logging never blocks the event loop
+    log_listener = configure_logging()
+    
+    services = Services(create_mongo_client())
+    await services.start()
+    app.state.services = services
+    
+    yield
+    
+    await services.stop()
+    log_listener.stop()
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
 
 # Create the main app without a prefix
-app = FastAPI(title="Guru Killer API", version="1.0.0")
+app = FastAPI(
+    title="Guru Killer API",
+    version="1.0.0",
+    lifespan=lifespan,
+    # orjson is several times faster than the stdlib encoder for the remaining routes
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Initialize services
-payment_service = PaymentService(db)
-download_service = DownloadService(db)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # Health check endpoint
@@ -49,88 +133,170 @@ async def root():
 
 # Checkout endpoints
 @api_router.post("/checkout/session", response_model=CheckoutResponse)
-async def create_checkout_session(request_data: CheckoutRequest, request: Request):
-    """Create a Stripe checkout session for package purchase"""
+async def create_checkout_session(request_data: CheckoutRequest, request: Request,
+                                  idempotency_key: Optional[str] = Header(None),
+                                  services: Services = Depends(get_services)):
+    """Create a Stripe checkout session for package purchase
+    
+    Requests repeating an Idempotency-Key get the session created for its first use.
+    """
+    bind_log_context(package_id=request_data.package_id)
     try:
-        session = await payment_service.create_checkout_session(
+        return await services.payment_service.create_checkout_session(
             package_id=request_data.package_id,
             origin_url=request_data.origin_url,
-            request=request
+            request=request,
+            email=request_data.email,
+            idempotency_key=idempotency_key
         )
-        return CheckoutResponse(url=session.url, session_id=session.session_id)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Checkout session creation failed: {str(e)}")
+        logger.error("Checkout session creation failed: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create checkout session")
 
+def _status_payload(status) -> Dict[str, Any]:
+    return {
+        "status": status.status,
+        "payment_status": status.payment_status,
+        "amount_total": status.amount_total,
+        "currency": status.currency,
+        "metadata": status.metadata
+    }
+
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str, request: Request):
+async def get_checkout_status(session_id: str, request: Request, services: Services = Depends(get_services)):
     """Get the current status of a checkout session"""
     try:
-        status = await payment_service.get_payment_status(session_id, request)
-        return {
-            "status": status.status,
-            "payment_status": status.payment_status,
-            "amount_total": status.amount_total,
-            "currency": status.currency,
-            "metadata": status.metadata
-        }
+        status = await services.payment_service.get_payment_status(session_id, request)
+        return _status_payload(status)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Status check failed: {str(e)}")
+        logger.error("Status check failed: %s", e)
         raise HTTPException(status_code=500, detail="Failed to get payment status")
 
+@api_router.get("/checkout/status/{session_id}/stream")
+async def stream_checkout_status(session_id: str, request: Request, services: Services = Depends(get_services)):
+    """Push checkout status changes as Server-Sent Events until the session is terminal"""
+    interval = float(os.environ.get('CHECKOUT_STREAM_INTERVAL_SECONDS', '2'))
+    timeout = float(os.environ.get('CHECKOUT_STREAM_TIMEOUT_SECONDS', '120'))
+    
+    async def events():
+        try:
+            async for status in services.payment_service.watch_payment_status(session_id, request, interval, timeout):
+                yield f"event: status\ndata: {json.dumps(_status_payload(status))}\n\n"
+        except HTTPException:
+            yield "event: error\ndata: {\"detail\": \"Failed to get payment status\"}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Webhook endpoint
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request):
-    """Handle Stripe webhook events"""
+async def stripe_webhook(request: Request, services: Services = Depends(get_services)):
+    """Verify a Stripe webhook and queue it for background processing"""
+    body = await request.body()
+    stripe_signature = request.headers.get("Stripe-Signature")
+    
+    if not stripe_signature:
+        raise HTTPException(status_code=400, detail="Missing Stripe signature")
+    
     try:
-        body = await request.body()
-        stripe_signature = request.headers.get("Stripe-Signature")
-        
-        if not stripe_signature:
-            raise HTTPException(status_code=400, detail="Missing Stripe signature")
-        
-        result = await payment_service.handle_webhook(body, stripe_signature, request)
-        return result
+        webhook_response = await services.payment_service.verify_webhook(body, stripe_signature, request)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Webhook processing failed: {str(e)}")
+        logger.error("Webhook verification failed: %s", e)
         raise HTTPException(status_code=400, detail="Webhook processing failed")
+    bind_log_context(session_id=webhook_response.session_id, event_type=webhook_response.event_type)
+    
+    # Stripe gets its 200 once the event is durable; transactions are updated by the inbox worker
+    await services.webhook_inbox.enqueue(webhook_response)
+    return {"status": "success"}
+
+@api_router.get("/webhook/inbox/stats", dependencies=[Depends(require_admin)])
+async def get_webhook_inbox_stats(services: Services = Depends(get_services)):
+    """Get webhook inbox queue depth and apply lag"""
+    return await services.webhook_inbox.get_stats()
+
+@api_router.get("/admin/stripe/breaker", dependencies=[Depends(require_admin)])
+async def get_stripe_breaker(services: Services = Depends(get_services)):
+    """Get this worker's Stripe circuit breaker state and trip count"""
+    return services.payment_service.stripe_pool.breaker.get_stats()
+
+@api_router.get("/admin/cache/invalidation", dependencies=[Depends(require_admin)])
+async def get_invalidation_stats(services: Services = Depends(get_services)):
+    """Get how this worker follows changes for cache invalidation"""
+    return services.invalidation_bus.get_stats()
+
+@api_router.get("/admin/outbox/stats", dependencies=[Depends(require_admin)])
+async def get_outbox_stats(services: Services = Depends(get_services)):
+    """Get email outbox queue depth and send throughput"""
+    return await services.outbox_dispatcher.get_stats()
 
 # Download endpoints
 @api_router.post("/downloads/generate", response_model=DownloadResponse)
-async def generate_downloads(request_data: DownloadRequest):
+async def generate_downloads(request_data: DownloadRequest, services: Services = Depends(get_services)):
     """Generate secure download links for a completed purchase"""
     try:
-        download_links = await download_service.generate_download_links(
+        download_links = await services.download_service.generate_download_links(
             email=request_data.email,
             session_id=request_data.session_id,
             package_type=request_data.package_type
         )
         return DownloadResponse(download_links=download_links)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Download generation failed: {str(e)}")
+        logger.error("Download generation failed: %s", e)
         raise HTTPException(status_code=500, detail="Failed to generate downloads")
 
+@api_router.post("/admin/downloads/bulk", dependencies=[Depends(require_admin)])
+async def generate_downloads_bulk(request_data: BulkDownloadRequest, services: Services = Depends(get_services)):
+    """Regenerate download links for many sessions or buyer emails, streamed as NDJSON"""
+    async def lines():
+        async for result in services.download_service.generate_bulk(request_data.session_ids, request_data.emails):
+            yield dumps(result) + b"\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@api_router.api_route("/downloads/fetch/{session_id}/{filename}", methods=["GET", "HEAD"])
+async def fetch_download(session_id: str, filename: str, expires: int, kid: str, sig: str, request: Request,
+                         services: Services = Depends(get_services)):
+    """Stream a purchased file from a signed download URL"""
+    # Signature and expiry are checked in CPU only, no database access
+    services.download_service.verify_signed_url(session_id, filename, expires, kid, sig)
+    return services.file_delivery.respond(session_id, filename, request)
+
 @api_router.get("/downloads/{session_id}")
-async def get_downloads(session_id: str):
+async def get_downloads(session_id: str, services: Services = Depends(get_services)):
     """Retrieve existing download links for a session"""
     try:
-        downloads = await download_service.get_downloads_by_session(session_id)
+        downloads = await services.download_service.get_downloads_by_session(session_id)
         if not downloads:
             raise HTTPException(status_code=404, detail="Downloads not found")
         return downloads
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Download retrieval failed: {str(e)}")
+        logger.error("Download retrieval failed: %s", e)
         raise HTTPException(status_code=500, detail="Failed to retrieve downloads")
 
 # Analytics endpoints
 @api_router.get("/stats/public", response_model=PublicStats)
-async def get_public_stats():
+async def get_public_stats(services: Services = Depends(get_services)):
     """Get public analytics for the landing page"""
     try:
-        stats = await payment_service.get_public_stats()
+        stats = await services.payment_service.get_public_stats()
         return PublicStats(**stats)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Stats retrieval failed: {str(e)}")
+        logger.error("Stats retrieval failed: %s", e)
         # Return mock stats as fallback
         return PublicStats(
             total_revenue="£247,000+",
@@ -139,37 +305,81 @@ async def get_public_stats():
             customers_saved="£2.3M+"
         )
 
+@api_router.get("/admin/analytics/revenue", dependencies=[Depends(require_admin)])
+async def get_revenue_analytics(start: datetime, end: datetime, granularity: str = "day",
+                                package_id: Optional[str] = None, services: Services = Depends(get_services)):
+    """Paid counts, revenue and conversion per hour or day, read from the rollup buckets"""
+    return await services.payment_service.rollups.query(start, end, granularity, package_id)
+
 # Package information endpoint
+# Package data only changes on deploy, so the responses are serialized once at startup
+packages_response = PrecomputedJSON({
+    "packages": {package_id: package.dict() for package_id, package in PACKAGES.items()}
+})
+package_responses = {package_id: PrecomputedJSON(package.dict()) for package_id, package in PACKAGES.items()}
+
 @api_router.get("/packages")
-async def get_packages():
+async def get_packages(request: Request):
     """Get available packages information"""
-    return {
-        "packages": {package_id: package.dict() for package_id, package in PACKAGES.items()}
-    }
+    return packages_response.respond(request)
 
 @api_router.get("/packages/{package_id}")
-async def get_package(package_id: str):
+async def get_package(package_id: str, request: Request):
     """Get specific package information"""
-    if package_id not in PACKAGES:
+    if package_id not in package_responses:
         raise HTTPException(status_code=404, detail="Package not found")
-    return PACKAGES[package_id].dict()
+    return package_responses[package_id].respond(request)
 
 # Transaction lookup (for debugging)
+@api_router.get("/admin/transactions", dependencies=[Depends(require_admin)])
+async def list_transactions(status: Optional[str] = None, package_id: Optional[str] = None,
+                            created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                            fields: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None,
+                            services: Services = Depends(get_services)):
+    """List transactions newest first, paged with the opaque next_cursor"""
+    exporter = services.transaction_exporter
+    query = exporter.build_query(status, package_id, created_from, created_to)
+    return await exporter.list_page(query, exporter.parse_fields(fields), limit, cursor)
+
+@api_router.get("/admin/transactions/export", dependencies=[Depends(require_admin)])
+async def export_transactions(format: str = "ndjson", status: Optional[str] = None, package_id: Optional[str] = None,
+                              created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                              fields: Optional[str] = None, services: Services = Depends(get_services)):
+    """Stream every matching transaction as NDJSON or CSV"""
+    exporter = services.transaction_exporter
+    query = exporter.build_query(status, package_id, created_from, created_to)
+    rows = await exporter.export(query, exporter.parse_fields(fields), format)
+    if format == "csv":
+        return StreamingResponse(rows, media_type="text/csv",
+                                 headers={"Content-Disposition": 'attachment; filename="transactions.csv"'})
+    return StreamingResponse(rows, media_type="application/x-ndjson")
+
 @api_router.get("/transactions/{session_id}")
-async def get_transaction(session_id: str):
+async def get_transaction(session_id: str, services: Services = Depends(get_services)):
     """Get transaction details by session ID"""
     try:
-        transaction = await payment_service.get_transaction_by_session(session_id)
+        transaction = await services.payment_service.get_transaction_by_session(session_id)
         if not transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
         return transaction.dict()
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Transaction lookup failed: {str(e)}")
+        logger.error("Transaction lookup failed: %s", e)
         raise HTTPException(status_code=500, detail="Failed to lookup transaction")
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Prometheus metrics for every worker, served outside the /api prefix to admin-key holders only
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def metrics(services: Services = Depends(get_services)):
+    return PlainTextResponse(await services.metrics_publisher.render_all(), media_type="text/plain; version=0.0.4")
+
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(LogContextMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -179,10 +389,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
-
 if __name__ == "__main__":
+    # Single-process development server; use ``python manage.py serve`` in production
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
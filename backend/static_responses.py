@@ -0,0 +1,45 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class PrecomputedJSON:
+    """A JSON body serialized once, served with a strong ETag and Cache-Control"""
+
+    def __init__(self, content: Any, max_age: Optional[int] = None):
+        self.body = dumps(content)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        if max_age is None:
+            max_age = int(os.environ.get('STATIC_CACHE_MAX_AGE_SECONDS', '300'))
+        self.headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={max_age}"
+        }
+
+    def not_modified(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+    def respond(self, request: Request) -> Response:
+        """Return the cached body, or 304 when the client already has it"""
+        if self.not_modified(request):
+            return Response(status_code=304, headers=self.headers)
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
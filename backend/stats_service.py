@@ -0,0 +1,122 @@
+import os
+import logging
+from typing import Dict, Any
+from motor.motor_asyncio import AsyncIOMotorClient
+from datetime import datetime
+
+from cache import TTLCache, SingleFlight, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Single document in the stats_counters collection holding the public totals
+COUNTERS_ID = "public_stats"
+
+
+class StatsService:
+    """Materialized public stats counters maintained with atomic $inc updates"""
+
+    def __init__(self, db: AsyncIOMotorClient, cache_ttl: float = None):
+        self.db = db
+        if cache_ttl is None:
+            cache_ttl = float(os.environ.get('STATS_CACHE_TTL_SECONDS', '30'))
+        self._cache = TTLCache(maxsize=1, ttl=cache_ttl)
+        self._flight = SingleFlight()
+
+    async def record_initiated(self) -> None:
+        """Count a newly created checkout session"""
+        await self.db.stats_counters.update_one(
+            {"_id": COUNTERS_ID},
+            {"$inc": {"initiated_count": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def record_paid(self, transaction: Dict[str, Any], was_expired: bool = False) -> None:
+        """Count a transaction that has just moved to paid, uncounting it as expired if it was"""
+        currency = transaction.get("currency") or "gbp"
+        increments = {"paid_count": 1, f"revenue.{currency}": transaction.get("amount", 0)}
+        if was_expired:
+            increments["expired_count"] = -1
+        await self.db.stats_counters.update_one(
+            {"_id": COUNTERS_ID},
+            {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def record_expired(self) -> None:
+        """Count a checkout that expired without being paid"""
+        await self.db.stats_counters.update_one(
+            {"_id": COUNTERS_ID},
+            {"$inc": {"expired_count": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def get_counters(self) -> Dict[str, Any]:
+        """Get the counters document, served from the TTL cache when fresh"""
+        counters = self._cache.get(COUNTERS_ID)
+        if counters is not MISSING:
+            return counters
+        # A burst of cache misses shares one database read
+        return await self._flight.do(COUNTERS_ID, self._load_counters)
+
+    async def _load_counters(self) -> Dict[str, Any]:
+        doc = await self.db.stats_counters.find_one({"_id": COUNTERS_ID}) or {}
+        counters = {
+            "paid_count": doc.get("paid_count", 0),
+            "initiated_count": doc.get("initiated_count", 0),
+            "expired_count": doc.get("expired_count", 0),
+            "revenue": doc.get("revenue", {})
+        }
+        self._cache.set(COUNTERS_ID, counters)
+        return counters
+
+    def invalidate(self) -> None:
+        """Drop the cached counters so the next read goes to the database"""
+        self._cache.clear()
+
+    async def rebuild(self) -> Dict[str, Any]:
+        """Recompute the counters from payment_transactions
+
+        Increments that land while the rebuild is running may be lost, so run
+        this during a quiet period.
+        """
+        pipeline = [
+            {"$match": {"payment_status": "paid"}},
+            {"$group": {"_id": "$currency", "count": {"$sum": 1}, "total": {"$sum": "$amount"}}}
+        ]
+        paid_count = 0
+        revenue = {}
+        async for row in self.db.payment_transactions.aggregate(pipeline):
+            paid_count += row["count"]
+            revenue[row["_id"] or "gbp"] = row["total"]
+
+        # Archived transactions were never paid but still count towards initiated and expired
+        initiated_count = (
+            await self.db.payment_transactions.count_documents({})
+            + await self.db.payment_transactions_archive.count_documents({})
+        )
+        expired_count = (
+            await self.db.payment_transactions.count_documents({"payment_status": "expired"})
+            + await self.db.payment_transactions_archive.count_documents({"payment_status": "expired"})
+        )
+        # Expired transactions are now counted, so a later move to paid takes them back out
+        await self.db.payment_transactions.update_many(
+            {"payment_status": "expired", "expired_counted": {"$ne": True}},
+            {"$set": {"expired_counted": True}}
+        )
+
+        counters = {
+            "paid_count": paid_count,
+            "initiated_count": initiated_count,
+            "expired_count": expired_count,
+            "revenue": revenue
+        }
+        await self.db.stats_counters.replace_one(
+            {"_id": COUNTERS_ID},
+            {**counters, "updated_at": datetime.utcnow()},
+            upsert=True
+        )
+        self.invalidate()
+
+        logger.info("Rebuilt stats counters: %s paid of %s initiated", paid_count, initiated_count)
+
+        return counters
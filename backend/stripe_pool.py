@@ -0,0 +1,204 @@
+import asyncio
+import math
+import os
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from fastapi import HTTPException
+from emergentintegrations.payments.stripe.checkout import StripeCheckout
+
+from circuit_breaker import CircuitBreaker
+from metrics import STRIPE_CALLS_SHED, observe_stripe_call
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StripeUnavailable(HTTPException):
+    """503 for a Stripe call that was shed, refused by the breaker or ran past its deadline"""
+
+    def __init__(self, detail: str, retry_after: float = 2):
+        super().__init__(
+            status_code=503,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+def is_provider_failure(error: Exception) -> bool:
+    """Whether an error says Stripe is unhealthy, as opposed to a rejected request"""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+class StripeClientPool:
+    """One process-wide StripeCheckout client sharing keep-alive HTTP connections
+
+    The client's webhook URL comes from PUBLIC_BASE_URL rather than the Host
+    header of whichever request created it, so there is exactly one client
+    for the lifetime of the process. ``slot()`` bounds the
+    number of concurrent outbound Stripe calls; once ``max_queue`` calls are
+    already waiting for a slot, further calls are shed with a 503.
+
+    ``call()`` adds the resilience layer every Stripe request goes through:
+    a ``timeout`` deadline per attempt, jittered retries for idempotent
+    reads, and a circuit breaker that fails calls fast while Stripe is
+    erroring or timing out.
+    """
+
+    def __init__(self, api_key: str, max_concurrency: Optional[int] = None, max_queue: Optional[int] = None,
+                 timeout: Optional[float] = None, read_retries: Optional[int] = None,
+                 breaker: Optional[CircuitBreaker] = None, webhook_url: Optional[str] = None):
+        self.api_key = api_key
+        self.webhook_url = webhook_url or (
+            os.environ.get('PUBLIC_BASE_URL', 'http://localhost:8001').rstrip('/') + "/api/webhook/stripe"
+        )
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get('STRIPE_MAX_CONCURRENCY', '20'))
+        if max_queue is None:
+            max_queue = int(os.environ.get('STRIPE_MAX_QUEUE', str(max_concurrency)))
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._client: Optional[StripeCheckout] = None
+        self._http_session = None
+        self._previous_http_client: Any = None
+        self.timeout = timeout or float(os.environ.get('STRIPE_TIMEOUT_SECONDS', '10'))
+        self.read_retries = read_retries if read_retries is not None else int(
+            os.environ.get('STRIPE_READ_RETRIES', '2')
+        )
+        self.retry_base = float(os.environ.get('STRIPE_RETRY_BASE_SECONDS', '0.2'))
+        self.breaker = breaker or CircuitBreaker(
+            "stripe",
+            window=int(os.environ.get('STRIPE_BREAKER_WINDOW', '20')),
+            min_calls=int(os.environ.get('STRIPE_BREAKER_MIN_CALLS', '10')),
+            failure_threshold=float(os.environ.get('STRIPE_BREAKER_FAILURE_RATE', '0.5')),
+            open_seconds=float(os.environ.get('STRIPE_BREAKER_OPEN_SECONDS', '30'))
+        )
+
+    def open(self) -> None:
+        """Install a keep-alive HTTP client as the SDK's ``stripe.default_http_client``
+
+        StripeCheckout takes no HTTP client of its own, so the process-wide
+        default is the only way to reach it. That is safe here: each process
+        talks to Stripe with the one STRIPE_API_KEY through this pool.
+        """
+        try:
+            import requests
+            import stripe
+        except ImportError:
+            logger.warning("stripe/requests not importable, using the SDK default HTTP client")
+            return
+
+        requests_client = getattr(stripe, "RequestsClient", None) or getattr(
+            getattr(stripe, "http_client", None), "RequestsClient", None
+        )
+        if requests_client is None:
+            logger.warning("Stripe SDK has no RequestsClient, using the SDK default HTTP client")
+            return
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_concurrency
+        )
+        session.mount("https://", adapter)
+        # The SDK gives up at the same deadline call() enforces on the event loop
+        self._previous_http_client = getattr(stripe, "default_http_client", None)
+        stripe.default_http_client = requests_client(session=session, timeout=self.timeout)
+        self._http_session = session
+        self._client = None
+        logger.info("Stripe HTTP pool opened with %s connections", self.max_concurrency)
+
+    async def close(self) -> None:
+        """Drop the client, restore the SDK's HTTP client and close the shared connections"""
+        self._client = None
+        if self._http_session is not None:
+            import stripe
+            stripe.default_http_client = self._previous_http_client
+            self._previous_http_client = None
+            self._http_session.close()
+            self._http_session = None
+
+    def get(self) -> StripeCheckout:
+        """Get the shared client, creating it on first use"""
+        if self._client is None:
+            self._client = StripeCheckout(api_key=self.api_key, webhook_url=self.webhook_url)
+        return self._client
+
+    @asynccontextmanager
+    async def slot(self, operation: str, shed: bool = True):
+        """Hold one of the outbound Stripe call slots, timing the call by outcome
+
+        With ``shed`` set, a call that would join a full wait queue raises 503
+        instead; background work passes ``shed=False`` to always wait its turn.
+        """
+        if shed and self._semaphore.locked() and self._waiting >= self.max_queue:
+            STRIPE_CALLS_SHED.inc(operation=operation)
+            raise StripeUnavailable("Payment provider is busy, please retry shortly")
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            started = time.perf_counter()
+            try:
+                yield
+            except BaseException:
+                observe_stripe_call(operation, started, "error")
+                raise
+            observe_stripe_call(operation, started, "success")
+        finally:
+            self._semaphore.release()
+
+    async def call(self, operation: str, request: Callable[[], Awaitable[T]], shed: bool = True,
+                   idempotent: bool = False, breaker: bool = True) -> T:
+        """Run one Stripe request through the breaker, a call slot and the per-attempt deadline
+
+        Idempotent reads are retried up to ``read_retries`` times on provider
+        failures, sleeping a random share of an exponentially growing delay.
+        Webhook verification passes ``breaker=False`` since it never reaches
+        Stripe's API and a bad signature says nothing about Stripe's health.
+        """
+        attempts = 1 + (self.read_retries if idempotent else 0)
+        for attempt in range(attempts):
+            if breaker and not self.breaker.allow():
+                raise StripeUnavailable(
+                    "Payment provider is unavailable, please retry shortly", self.breaker.retry_after()
+                )
+            try:
+                async with self.slot(operation, shed=shed):
+                    result = await asyncio.wait_for(request(), self.timeout)
+            except StripeUnavailable:
+                if breaker:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                failure = is_provider_failure(e)
+                if breaker and failure:
+                    self.breaker.record_failure()
+                elif breaker:
+                    self.breaker.record_success()
+                if not failure:
+                    raise
+                if attempt + 1 < attempts:
+                    logger.warning("Stripe %s failed, retrying: %r", operation, e)
+                    await asyncio.sleep(random.uniform(0, self.retry_base * 2 ** attempt))
+                    continue
+                if isinstance(e, asyncio.TimeoutError):
+                    raise StripeUnavailable(f"Payment provider did not respond within {self.timeout:g}s")
+                raise
+            except BaseException:
+                if breaker:
+                    self.breaker.release()
+                raise
+            if breaker:
+                self.breaker.record_success()
+            return result
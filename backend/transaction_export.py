@@ -0,0 +1,189 @@
+import base64
+import binascii
+import csv
+import io
+import json
+import os
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from models import PaymentTransaction, transaction_created_at
+from static_responses import dumps
+
+logger = logging.getLogger(__name__)
+
+# Fields a caller may ask for, in the column order used by CSV exports
+EXPORT_FIELDS: Tuple[str, ...] = tuple(PaymentTransaction.model_fields)
+
+MAX_PAGE_SIZE = 500
+EXPORT_FORMATS = ("ndjson", "csv")
+
+
+def _plain(value: Any) -> Any:
+    """Convert BSON values to what JSON and CSV writers accept"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+def encode_cursor(transaction: Dict[str, Any]) -> str:
+    position = {"created_at": transaction_created_at(transaction).isoformat(), "id": str(transaction["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(position["created_at"]), ObjectId(position["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class TransactionExporter:
+    """Admin reads of payment_transactions that never hold the collection in memory
+
+    Listing pages are keyset paginated on (created_at, _id), newest first:
+    the cursor returned with a page encodes its last row and the next page
+    starts strictly after it, so deep pages cost the same as the first and
+    no skip is ever issued. Rows written before created_at was stored fall
+    outside that ordering until ``backfill_created_at()`` has run. Exports walk one Motor cursor oldest first and
+    write rows out batch by batch.
+    """
+
+    def __init__(self, db: AsyncIOMotorClient, batch_size: Optional[int] = None):
+        self.db = db
+        self.batch_size = batch_size or int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+
+    async def backfill_created_at(self, batch_size: Optional[int] = None) -> int:
+        """Store created_at on transactions that predate it, taken from their ObjectId
+
+        Keyset pages filter and sort on created_at, so rows without it would
+        be skipped after the first page.
+        """
+        batch_size = batch_size or self.batch_size
+        operations: List[UpdateOne] = []
+        updated = 0
+        cursor = self.db.payment_transactions.find({"created_at": {"$exists": False}}, {"_id": 1}).batch_size(batch_size)
+        async for transaction in cursor:
+            operations.append(UpdateOne(
+                {"_id": transaction["_id"], "created_at": {"$exists": False}},
+                {"$set": {"created_at": transaction_created_at(transaction)}}
+            ))
+            if len(operations) >= batch_size:
+                updated += (await self.db.payment_transactions.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        if operations:
+            updated += (await self.db.payment_transactions.bulk_write(operations, ordered=False)).modified_count
+        logger.info("Backfilled created_at on %s transactions", updated)
+        return updated
+
+    def build_query(self, status: Optional[str] = None, package_id: Optional[str] = None,
+                    created_from: Optional[datetime] = None, created_to: Optional[datetime] = None) -> Dict[str, Any]:
+        """Translate listing filters into a query; created_to is exclusive"""
+        query: Dict[str, Any] = {}
+        if status:
+            query["payment_status"] = status
+        if package_id:
+            query["package_id"] = package_id
+        created: Dict[str, datetime] = {}
+        if created_from:
+            created["$gte"] = created_from
+        if created_to:
+            created["$lt"] = created_to
+        if created:
+            query["created_at"] = created
+        return query
+
+    def parse_fields(self, fields: Optional[str]) -> List[str]:
+        """Validate a comma separated field list, defaulting to every field"""
+        if not fields:
+            return list(EXPORT_FIELDS)
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in EXPORT_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        return requested
+
+    def _projection(self, fields: List[str]) -> Dict[str, int]:
+        # created_at and _id are always read because the cursor is built from them
+        return {field: 1 for field in {*fields, "created_at", "_id"}}
+
+    def _row(self, transaction: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+        return {field: _plain(transaction.get(field)) for field in fields}
+
+    async def list_page(self, query: Dict[str, Any], fields: List[str], limit: int = 50,
+                        cursor: Optional[str] = None) -> Dict[str, Any]:
+        """One page of transactions, newest first, with the cursor for the next page"""
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            query = {
+                "$and": [
+                    query,
+                    {"$or": [
+                        {"created_at": {"$lt": created_at}},
+                        {"created_at": created_at, "_id": {"$lt": last_id}}
+                    ]}
+                ]
+            }
+
+        # One extra row tells whether another page exists without a count
+        page = await self.db.payment_transactions.find(query, self._projection(fields)).sort(
+            [("created_at", -1), ("_id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+        return {
+            "items": [self._row(transaction, fields) for transaction in page],
+            "next_cursor": encode_cursor(page[-1]) if has_more else None
+        }
+
+    async def export(self, query: Dict[str, Any], fields: List[str], export_format: str = "ndjson") -> AsyncIterator[bytes]:
+        """Stream every matching transaction, oldest first, as NDJSON lines or CSV rows"""
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+        return self._stream(query, fields, export_format)
+
+    async def _stream(self, query: Dict[str, Any], fields: List[str], export_format: str) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(fields)
+
+        exported = 0
+        chunk: List[bytes] = []
+        cursor = self.db.payment_transactions.find(query, self._projection(fields)).sort(
+            [("created_at", 1), ("_id", 1)]
+        ).batch_size(self.batch_size)
+        async for transaction in cursor:
+            row = self._row(transaction, fields)
+            if export_format == "csv":
+                writer.writerow(json.dumps(value) if isinstance(value, dict) else value for value in row.values())
+            else:
+                chunk.append(dumps(row) + b"\n")
+            exported += 1
+            if exported % self.batch_size == 0:
+                yield self._flush(buffer, chunk)
+
+        if export_format == "csv" or chunk:
+            yield self._flush(buffer, chunk)
+        logger.info("Exported %s transactions as %s", exported, export_format)
+
+    def _flush(self, buffer: io.StringIO, chunk: List[bytes]) -> bytes:
+        data = buffer.getvalue().encode("utf-8") + b"".join(chunk)
+        buffer.seek(0)
+        buffer.truncate()
+        chunk.clear()
+        return data
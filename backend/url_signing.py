@@ -0,0 +1,59 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+
+class UrlSigner:
+    """HMAC-SHA256 signatures for download URLs with key rotation
+
+    Keys are configured as ``DOWNLOAD_SIGNING_KEYS="kid2:secret2,kid1:secret1"``.
+    The first key signs new URLs; every listed key is accepted when verifying,
+    so a retired key keeps working until it is removed from the list.
+    """
+
+    def __init__(self, keys: Dict[str, bytes], active_key_id: str):
+        if active_key_id not in keys:
+            raise ValueError(f"Unknown active signing key: {active_key_id}")
+        self.keys = keys
+        self.active_key_id = active_key_id
+
+    @classmethod
+    def from_env(cls) -> "UrlSigner":
+        """Build a signer from DOWNLOAD_SIGNING_KEYS"""
+        raw_keys = os.environ.get('DOWNLOAD_SIGNING_KEYS')
+        if not raw_keys:
+            raise ValueError("DOWNLOAD_SIGNING_KEYS environment variable is required")
+
+        keys = {}
+        order = []
+        for entry in raw_keys.split(","):
+            key_id, _, secret = entry.strip().partition(":")
+            if not key_id or not secret:
+                raise ValueError("DOWNLOAD_SIGNING_KEYS entries must look like kid:secret")
+            keys[key_id] = secret.encode()
+            order.append(key_id)
+        return cls(keys, order[0])
+
+    def _signature(self, key: bytes, session_id: str, filename: str, expires: int) -> str:
+        message = f"{session_id}\n{filename}\n{expires}".encode()
+        digest = hmac.new(key, message, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def sign(self, session_id: str, filename: str, expires: int) -> Tuple[str, str]:
+        """Sign a (session, file, expiry) triple, returning (key id, signature)"""
+        key = self.keys[self.active_key_id]
+        return self.active_key_id, self._signature(key, session_id, filename, expires)
+
+    def verify(self, session_id: str, filename: str, expires: int, key_id: str, signature: str,
+               now: Optional[float] = None) -> Tuple[bool, bool]:
+        """Check a signature in constant time, returning (valid, expired)"""
+        key = self.keys.get(key_id)
+        if key is None:
+            return False, False
+        expected = self._signature(key, session_id, filename, expires)
+        if not hmac.compare_digest(expected, signature):
+            return False, False
+        return True, expires <= (time.time() if now is None else now)
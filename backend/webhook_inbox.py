@@ -0,0 +1,194 @@
+import asyncio
+import os
+import logging
+import uuid
+from typing import Any, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+
+from payment_service import PaymentService
+from metrics import WEBHOOK_INBOX_APPLY_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookInbox:
+    """Durable Mongo-backed inbox for verified Stripe webhook events
+
+    The webhook route only verifies the signature and calls ``enqueue``; a
+    background worker drains pending events and applies them to
+    payment_transactions in batches. Events are keyed by Stripe event id, so
+    duplicate deliveries are dropped on insert.
+
+    Every worker runs the drain, so each batch is claimed with a claim id
+    before it is applied; claims older than ``claim_timeout`` belong to a
+    worker that died mid-batch and are taken over.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorClient,
+        payment_service: PaymentService,
+        batch_size: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        drain_timeout: Optional[float] = None,
+        claim_timeout: Optional[float] = None
+    ):
+        self.db = db
+        self.payment_service = payment_service
+        self.batch_size = batch_size or int(os.environ.get('WEBHOOK_BATCH_SIZE', '100'))
+        self.poll_interval = poll_interval or float(os.environ.get('WEBHOOK_POLL_INTERVAL_SECONDS', '1'))
+        self.drain_timeout = drain_timeout or float(os.environ.get('WEBHOOK_DRAIN_TIMEOUT_SECONDS', '20'))
+        self.claim_timeout = claim_timeout or float(os.environ.get('WEBHOOK_CLAIM_TIMEOUT_SECONDS', '60'))
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._last_apply_lag: Optional[float] = None
+        self._last_applied_at: Optional[datetime] = None
+
+    async def enqueue(self, webhook_response: Any) -> bool:
+        """Persist a verified event, returning False if it was already received"""
+        event_id = getattr(webhook_response, "event_id", None) or (
+            f"{webhook_response.event_type}:{webhook_response.session_id}"
+        )
+        try:
+            await self.db.webhook_inbox.insert_one({
+                "_id": event_id,
+                "event_type": webhook_response.event_type,
+                "session_id": webhook_response.session_id,
+                "payment_status": webhook_response.payment_status,
+                "metadata": webhook_response.metadata,
+                "status": "pending",
+                "received_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            logger.info("Dropped duplicate webhook event: %s", event_id)
+            return False
+
+        self._wakeup.set()
+        return True
+
+    def start(self) -> None:
+        """Start the background drain worker"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the worker after its current batch, then drain what is left
+
+        Draining is bounded by drain_timeout; events still pending after that
+        stay in the inbox for the next worker to pick up.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._drain_remaining(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook inbox drain timed out after %ss", self.drain_timeout)
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._stopping = False
+
+    async def _drain_remaining(self) -> None:
+        await self._task
+        while await self.drain_once():
+            pass
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                applied = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Webhook inbox drain failed: %s", e)
+                applied = 0
+
+            if applied < self.batch_size and not self._stopping:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        due = {
+            "$or": [
+                {"status": "pending"},
+                {"status": "applying", "claimed_at": {"$lt": now - timedelta(seconds=self.claim_timeout)}}
+            ]
+        }
+        candidates = await self.db.webhook_inbox.find(due, {"_id": 1}).sort(
+            "received_at", 1
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        claim_id = str(uuid.uuid4())
+        await self.db.webhook_inbox.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, **due},
+            {"$set": {"status": "applying", "claim_id": claim_id, "claimed_at": now}}
+        )
+        return await self.db.webhook_inbox.find({"claim_id": claim_id}).sort(
+            "received_at", 1
+        ).to_list(self.batch_size)
+
+    async def drain_once(self) -> int:
+        """Apply one claimed batch of pending events, returning how many were processed"""
+        events = await self._claim()
+
+        if not events:
+            return 0
+
+        updates = []
+        for event in events:
+            update_data = self.payment_service.webhook_update_data(
+                event["event_type"],
+                event["payment_status"],
+                event["session_id"],
+                event.get("metadata")
+            )
+            if update_data:
+                updates.append((event["session_id"], update_data))
+
+        # A batch re-applied after a claim takeover is safe: transaction updates are conditional and idempotent
+        await self.payment_service.apply_status_updates(updates)
+
+        now = datetime.utcnow()
+        await self.db.webhook_inbox.update_many(
+            {"_id": {"$in": [event["_id"] for event in events]}, "claim_id": events[0]["claim_id"]},
+            {"$set": {"status": "applied", "applied_at": now}, "$unset": {"claim_id": ""}}
+        )
+
+        self._last_apply_lag = (now - events[-1]["received_at"]).total_seconds()
+        self._last_applied_at = now
+        WEBHOOK_INBOX_APPLY_LAG_SECONDS.set(self._last_apply_lag)
+
+        logger.info("Applied %s webhook events (%s transaction updates)", len(events), len(updates))
+
+        return len(events)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Queue depth and apply lag for monitoring"""
+        unapplied = {"status": {"$in": ["pending", "applying"]}}
+        depth = await self.db.webhook_inbox.count_documents(unapplied)
+        oldest = await self.db.webhook_inbox.find_one(
+            unapplied,
+            sort=[("received_at", 1)]
+        )
+        oldest_pending_age = (
+            (datetime.utcnow() - oldest["received_at"]).total_seconds() if oldest else 0.0
+        )
+        return {
+            "queue_depth": depth,
+            "oldest_pending_age_seconds": oldest_pending_age,
+            "last_apply_lag_seconds": self._last_apply_lag,
+            "last_applied_at": self._last_applied_at
+        }
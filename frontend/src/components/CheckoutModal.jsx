@@ -31,7 +31,7 @@ const CheckoutModal = ({ isOpen, onClose, onSuccess }) => {
     setIsProcessing(true);
     
     try {
-      const result = await paymentAPI.createCheckoutSession('guru_killer_main');
+      const result = await paymentAPI.createCheckoutSession('guru_killer_main', email);
       if (result.url) {
         // Redirect to Stripe checkout
         window.location.href = result.url;
@@ -49,7 +49,7 @@ const CheckoutModal = ({ isOpen, onClose, onSuccess }) => {
   const handleUpsellAccept = async () => {
     setIsProcessing(true);
     try {
-      const result = await paymentAPI.createCheckoutSession('guru_killer_consulting');
+      const result = await paymentAPI.createCheckoutSession('guru_killer_consulting', email);
       if (result.url) {
         window.location.href = result.url;
       } else {
@@ -36,13 +36,28 @@ apiClient.interceptors.response.use(
   }
 );
 
+// One Idempotency-Key per package and email, so double-clicks and retries reuse the first checkout session
+const checkoutKeys = new Map();
+
+const checkoutKey = (packageId, email) => {
+  const id = `${packageId}:${(email || '').trim().toLowerCase()}`;
+  if (!checkoutKeys.has(id)) {
+    const random = window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    checkoutKeys.set(id, random);
+  }
+  return checkoutKeys.get(id);
+};
+
 export const paymentAPI = {
   // Create checkout session
-  createCheckoutSession: async (packageId) => {
+  createCheckoutSession: async (packageId, email) => {
     const originUrl = window.location.origin;
     const response = await apiClient.post('/checkout/session', {
       package_id: packageId,
-      origin_url: originUrl
+      origin_url: originUrl,
+      email
+    }, {
+      headers: { 'Idempotency-Key': checkoutKey(packageId, email) }
     });
     return response.data;
   },
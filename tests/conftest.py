@@ -0,0 +1,29 @@
+"""Shared test setup: backend modules on the path, Mongo and Stripe replaced by the bench fakes"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("STRIPE_API_KEY", "sk_test_fake")
+os.environ.setdefault("DOWNLOAD_SIGNING_KEYS", "test:secret")
+os.environ.setdefault("DOWNLOAD_STORAGE_DIR", str(BACKEND_DIR))
+
+from bench import fake_stripe  # noqa: E402
+
+fake_stripe.install()
+
+from bench.fake_mongo import FakeMotorClient  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    return FakeMotorClient()["test"]
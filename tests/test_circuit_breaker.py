@@ -0,0 +1,118 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def _breaker(**options):
+    return CircuitBreaker("test", **{"window": 10, "min_calls": 4, "failure_threshold": 0.5, "open_seconds": 30, **options})
+
+
+def _record(breaker, outcomes):
+    for succeeded in outcomes:
+        if succeeded:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+
+def _trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+
+
+def test_stays_closed_below_min_calls_and_threshold(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker = _breaker()
+    _record(breaker, (True, True, True, False, True, False))
+    assert breaker.failure_rate() == pytest.approx(2 / 6)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_opens_at_the_failure_threshold(clock):
+    breaker = _breaker()
+    _record(breaker, (True, True, False, False))
+
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_only_the_window_counts(clock):
+    breaker = _breaker(window=4)
+    _record(breaker, (False, False, False, True))
+    assert breaker.state == CLOSED
+    # The oldest failure has left the window
+    breaker.record_success()
+    assert breaker.failure_rate() == pytest.approx(0.5)
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = _breaker()
+    _trip(breaker)
+
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    assert breaker.failure_rate() == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_released_probe_can_be_retried(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.release()
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from download_service import ACCESS_DAYS, DownloadService, access_expires_at
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "buyer@example.com"
+
+
+async def _insert_paid(db, session_id, **fields):
+    transaction = {
+        "_id": ObjectId(), "session_id": session_id, "package_id": "guru_killer_main",
+        "amount": 49.0, "currency": "gbp", "email": EMAIL, "payment_status": "paid"
+    }
+    transaction.update(fields)
+    await db.payment_transactions.insert_one(transaction)
+
+
+def test_access_expiry_falls_back_to_older_timestamps():
+    paid_at = datetime(2026, 1, 1)
+    assert access_expires_at({"paid_at": paid_at, "updated_at": datetime(2026, 2, 1)}) == paid_at + timedelta(days=ACCESS_DAYS)
+    assert access_expires_at({"updated_at": paid_at}) == paid_at + timedelta(days=ACCESS_DAYS)
+    legacy_id = ObjectId.from_datetime(paid_at)
+    assert access_expires_at({"_id": legacy_id}) == paid_at + timedelta(days=ACCESS_DAYS)
+
+
+async def test_access_follows_the_payment_time_not_the_downloads_record(db):
+    service = DownloadService(db)
+    await _insert_paid(db, "cs_recent", paid_at=datetime.utcnow() - timedelta(days=1))
+    await _insert_paid(db, "cs_old", paid_at=datetime.utcnow() - timedelta(days=ACCESS_DAYS + 1))
+
+    allowed, valid_until = await service._check_download_access(EMAIL, "cs_recent")
+    assert allowed
+    assert valid_until > datetime.utcnow() + timedelta(days=ACCESS_DAYS - 2)
+    # No downloads record exists, as after the TTL index removed it, and access is still decided
+    assert await service._check_download_access(EMAIL, "cs_old") == (False, None)
+    assert await service._check_download_access("someone@example.com", "cs_recent") == (False, None)
+
+
+async def test_generating_links_after_expiry_is_refused(db):
+    service = DownloadService(db)
+    await _insert_paid(db, "cs_old", paid_at=datetime.utcnow() - timedelta(days=ACCESS_DAYS + 1))
+
+    with pytest.raises(HTTPException) as error:
+        await service.generate_download_links(EMAIL, "cs_old", "guru_killer_main")
+    assert error.value.status_code == 403
+    assert await db.downloads.count_documents({}) == 0
+
+
+async def test_links_are_reused_and_never_outlive_access(db):
+    service = DownloadService(db)
+    paid_at = datetime.utcnow() - timedelta(days=ACCESS_DAYS - 1)
+    await _insert_paid(db, "cs_1", paid_at=paid_at)
+
+    first = await service.generate_download_links(EMAIL, "cs_1", "guru_killer_main")
+    second = await service.generate_download_links(EMAIL, "cs_1", "guru_killer_main")
+
+    assert [link.url for link in first] == [link.url for link in second]
+    assert await db.downloads.count_documents({"session_id": "cs_1"}) == 1
+    access_ends = (paid_at + timedelta(days=ACCESS_DAYS)).replace(tzinfo=timezone.utc).timestamp()
+    signed = [parse_qs(urlparse(link.url).query) for link in first if "/api/downloads/fetch/" in link.url]
+    assert signed
+    assert all(int(query["expires"][0]) <= access_ends for query in signed)
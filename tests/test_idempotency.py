@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyStore, request_fingerprint
+
+pytestmark = pytest.mark.anyio
+
+
+def _counting_create(response):
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return dict(response)
+
+    return create, calls
+
+
+def test_fingerprint_ignores_key_order():
+    assert request_fingerprint({"a": 1, "b": "x"}) == request_fingerprint({"b": "x", "a": 1})
+    assert request_fingerprint({"a": 1}) != request_fingerprint({"a": 2})
+
+
+async def test_repeated_key_replays_the_stored_response(db):
+    store = IdempotencyStore(db)
+    create, calls = _counting_create({"session_id": "cs_1"})
+    fingerprint = request_fingerprint({"package_id": "guru_killer_main"})
+
+    first = await store.run("key-1", fingerprint, create)
+    second = await store.run("key-1", fingerprint, create)
+
+    assert first == second == {"session_id": "cs_1"}
+    assert len(calls) == 1
+    record = await db.idempotency_keys.find_one({"_id": "key-1"})
+    assert record["status"] == "completed"
+
+
+async def test_concurrent_duplicates_share_one_call(db):
+    store = IdempotencyStore(db)
+    create, calls = _counting_create({"session_id": "cs_1"})
+    fingerprint = request_fingerprint({"package_id": "guru_killer_main"})
+
+    responses = await asyncio.gather(*(store.run("key-1", fingerprint, create) for _ in range(5)))
+
+    assert all(response == {"session_id": "cs_1"} for response in responses)
+    assert len(calls) == 1
+
+
+async def test_key_reused_with_a_different_request_is_rejected(db):
+    store = IdempotencyStore(db)
+    create, calls = _counting_create({"session_id": "cs_1"})
+    await store.run("key-1", request_fingerprint({"package_id": "guru_killer_main"}), create)
+
+    with pytest.raises(HTTPException) as error:
+        await store.run("key-1", request_fingerprint({"package_id": "guru_killer_consulting"}), create)
+
+    assert error.value.status_code == 422
+    assert len(calls) == 1
+
+
+async def test_failed_attempt_releases_the_key(db):
+    store = IdempotencyStore(db)
+    fingerprint = request_fingerprint({"package_id": "guru_killer_main"})
+
+    async def fail():
+        raise HTTPException(status_code=503, detail="Payment provider is unavailable")
+
+    with pytest.raises(HTTPException):
+        await store.run("key-1", fingerprint, fail)
+    assert await db.idempotency_keys.find_one({"_id": "key-1"}) is None
+
+    create, calls = _counting_create({"session_id": "cs_2"})
+    assert await store.run("key-1", fingerprint, create) == {"session_id": "cs_2"}
+
+
+async def test_expired_lease_is_taken_over(db):
+    store = IdempotencyStore(db, poll_interval=0.01)
+    fingerprint = request_fingerprint({"package_id": "guru_killer_main"})
+    now = datetime.utcnow()
+    # Claimed by a worker that died before storing a response
+    await db.idempotency_keys.insert_one({
+        "_id": "key-1", "fingerprint": fingerprint, "status": "pending", "lock_id": "dead",
+        "locked_until": now - timedelta(seconds=1), "created_at": now, "expires_at": now + timedelta(hours=1)
+    })
+    create, calls = _counting_create({"session_id": "cs_1"})
+
+    assert await store.run("key-1", fingerprint, create) == {"session_id": "cs_1"}
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("key", ["", "k" * 256])
+async def test_invalid_keys_are_rejected(db, key):
+    create, calls = _counting_create({})
+    with pytest.raises(HTTPException) as error:
+        await IdempotencyStore(db).run(key, "fingerprint", create)
+    assert error.value.status_code == 400
+    assert not calls
@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from index_manager import IndexManager
+
+pytestmark = pytest.mark.anyio
+
+
+async def _legacy_indexes(db):
+    # Built by an older release: a plain index where the spec now has a TTL index, and duplicate downloads
+    await db.downloads.create_index([("access_expires", 1)], name="access_expires_1")
+    for generated_at in (datetime(2026, 1, 1), datetime(2026, 1, 2)):
+        await db.downloads.insert_one({
+            "session_id": "cs_1", "package_type": "guru_killer_main", "generated_at": generated_at
+        })
+
+
+async def test_workers_leave_migrations_to_the_deploy_step(db):
+    await _legacy_indexes(db)
+
+    created = await IndexManager(db).ensure_indexes(migrate=False)
+
+    indexes = await db.downloads.index_information()
+    assert "access_expires_1" in indexes
+    assert "access_expires_ttl" not in indexes
+    assert "session_package_unique" not in indexes
+    assert "payment_transactions.session_id_unique" in created
+    assert await db.downloads.count_documents({}) == 2
+
+
+async def test_concurrent_migrations_tolerate_an_index_already_dropped(db):
+    await _legacy_indexes(db)
+
+    await asyncio.gather(*(IndexManager(db).ensure_indexes() for _ in range(3)))
+
+    indexes = await db.downloads.index_information()
+    assert "access_expires_1" not in indexes
+    assert indexes["access_expires_ttl"]["expireAfterSeconds"] == 0
+    assert "session_package_unique" in indexes
+    remaining = await db.downloads.find({}).to_list(None)
+    assert [doc["generated_at"] for doc in remaining] == [datetime(2026, 1, 2)]
@@ -0,0 +1,66 @@
+import pytest
+
+from invalidation import InvalidationBus
+
+pytestmark = pytest.mark.anyio
+
+
+class Stream:
+    def __init__(self, changes):
+        self.changes = changes
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def __aiter__(self):
+        for index, change in enumerate(self.changes):
+            self.resume_token = {"_data": index}
+            yield change
+
+
+class Collection:
+    def __init__(self, changes):
+        self.changes = changes
+
+    def watch(self, pipeline, **options):
+        return Stream(self.changes)
+
+
+def _update(session_id, fields):
+    return {
+        "operationType": "update", "documentKey": {"_id": session_id},
+        "fullDocument": {"session_id": session_id} if session_id else None, "changedFields": fields
+    }
+
+
+async def test_changes_without_a_document_are_not_broadcast():
+    changes = [
+        _update("cs_1", ["payment_status"]),
+        # Deleted after the update, so the lookup found nothing
+        _update(None, ["payment_status"]),
+        {"operationType": "insert", "documentKey": {"_id": "cs_2"}, "fullDocument": {"session_id": "cs_2"}},
+    ]
+    bus = InvalidationBus({"payment_transactions": Collection(changes)})
+    seen, status_seen = [], []
+    bus.subscribe("payment_transactions", seen.append)
+    bus.subscribe("payment_transactions", status_seen.append, fields=["payment_status"])
+
+    await bus._watch("payment_transactions")
+
+    assert seen == ["cs_1", "cs_2"]
+    assert status_seen == ["cs_1"]
+    assert bus._tokens["payment_transactions"] == {"_data": 2}
+
+
+def test_lost_token_drops_everything():
+    bus = InvalidationBus({})
+    seen = []
+    bus.subscribe("payment_transactions", seen.append, fields=["payment_status"])
+
+    bus.publish("payment_transactions", None)
+
+    assert seen == [None]
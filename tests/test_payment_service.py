@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import PaymentTransaction
+from payment_service import PaymentService
+from stats_service import COUNTERS_ID
+
+pytestmark = pytest.mark.anyio
+
+
+async def _insert(db, session_id, **fields):
+    transaction = PaymentTransaction(
+        session_id=session_id, package_id="guru_killer_main", amount=49.0, currency="gbp",
+        email="buyer@example.com"
+    ).dict()
+    transaction.update(fields)
+    await db.payment_transactions.insert_one(transaction)
+
+
+async def _counters(db):
+    return await db.stats_counters.find_one({"_id": COUNTERS_ID}) or {}
+
+
+async def test_concurrent_updates_count_paid_once(db):
+    service = PaymentService(db)
+    await _insert(db, "cs_1")
+
+    results = await asyncio.gather(*(
+        service._update_transaction("cs_1", {"payment_status": "paid", "updated_at": datetime.utcnow()})
+        for _ in range(5)
+    ))
+
+    assert all(results)
+    assert (await _counters(db))["paid_count"] == 1
+    transaction = await db.payment_transactions.find_one({"session_id": "cs_1"})
+    assert transaction["payment_status"] == "paid"
+    assert transaction["paid_at"] is not None
+    assert "pending_effects" not in transaction
+    assert "status_batch_id" not in transaction
+
+
+async def test_paid_transaction_is_never_moved_back(db):
+    service = PaymentService(db)
+    await _insert(db, "cs_1", payment_status="paid")
+
+    assert not await service._update_transaction("cs_1", {"payment_status": "unpaid"})
+    assert not await service._update_transaction("cs_1", {"payment_status": "expired"})
+    await service.apply_status_updates([("cs_1", {"payment_status": "expired"}), ("cs_1", {"payment_status": "unpaid"})])
+
+    assert (await db.payment_transactions.find_one({"session_id": "cs_1"}))["payment_status"] == "paid"
+    assert await _counters(db) == {}
+
+
+async def test_batch_counts_each_transaction_once(db):
+    service = PaymentService(db)
+    await _insert(db, "cs_1")
+    await _insert(db, "cs_2")
+
+    matched = await service.apply_status_updates([
+        ("cs_1", {"payment_status": "paid"}),
+        ("cs_1", {"payment_status": "paid", "email": "later@example.com"}),
+        ("cs_2", {"payment_status": "expired"}),
+    ])
+    # A redelivered batch is applied but counted nowhere
+    await service.apply_status_updates([("cs_1", {"payment_status": "paid"}), ("cs_2", {"payment_status": "expired"})])
+
+    assert matched == 3
+    counters = await _counters(db)
+    assert counters["paid_count"] == 1
+    assert counters["expired_count"] == 1
+    assert (await db.payment_transactions.find_one({"session_id": "cs_1"}))["email"] == "later@example.com"
+    assert await db.payment_transactions.count_documents({"status_batch_id": {"$exists": True}}) == 0
+
+
+async def test_expired_then_paid_counts_only_paid(db):
+    service = PaymentService(db)
+    await _insert(db, "cs_1")
+    await _insert(db, "cs_2")
+
+    await service._update_transaction("cs_1", {"payment_status": "expired"})
+    await service._update_transaction("cs_2", {"payment_status": "expired"})
+    assert (await _counters(db))["expired_count"] == 2
+    await service.apply_status_updates([("cs_1", {"payment_status": "paid"})])
+
+    counters = await _counters(db)
+    assert counters["expired_count"] == 1
+    assert counters["paid_count"] == 1
+    # The incremental counters agree with a rebuild from the transactions
+    rebuilt = await service.stats.rebuild()
+    assert (rebuilt["expired_count"], rebuilt["paid_count"]) == (1, 1)
+
+
+async def test_rebuild_lets_a_later_payment_uncount_the_expiry(db):
+    service = PaymentService(db)
+    # Expired before expiries were tracked on the transaction
+    await _insert(db, "cs_1", payment_status="expired")
+    await service.stats.rebuild()
+
+    await service._update_transaction("cs_1", {"payment_status": "paid"})
+
+    counters = await _counters(db)
+    assert (counters["expired_count"], counters["paid_count"]) == (0, 1)
+
+
+async def test_effects_left_by_a_crash_are_replayed_once(db, monkeypatch):
+    service = PaymentService(db)
+    await _insert(db, "cs_1")
+    run_effect = service._run_effect
+
+    async def crash_on_rollups(effect, transaction):
+        if effect == "rollups":
+            raise RuntimeError("worker died")
+        await run_effect(effect, transaction)
+
+    monkeypatch.setattr(service, "_run_effect", crash_on_rollups)
+    with pytest.raises(RuntimeError):
+        await service.apply_status_updates([("cs_1", {"payment_status": "paid"})])
+
+    transaction = await db.payment_transactions.find_one({"session_id": "cs_1"})
+    assert transaction["pending_effects"] == ["rollups", "entitlements"]
+    # A claim younger than the replay delay may still be running in its worker
+    assert await service.replay_pending_effects() == 0
+
+    monkeypatch.setattr(service, "_run_effect", run_effect)
+    assert await service.replay_pending_effects(older_than=0) == 1
+    assert await service.replay_pending_effects(older_than=0) == 0
+
+    transaction = await db.payment_transactions.find_one({"session_id": "cs_1"})
+    assert "pending_effects" not in transaction
+    assert "status_batch_id" not in transaction
+    assert (await _counters(db))["paid_count"] == 1
+    assert await service.entitlements.has("buyer@example.com", "guru_killer_main")
+    rollup = await db.revenue_rollups.find_one({"granularity": "day"})
+    assert rollup["paid"] == 1
+
+
+async def test_replay_clears_stale_batch_tags(db):
+    service = PaymentService(db)
+    await _insert(db, "cs_1", payment_status="paid", status_batch_id="lost",
+                  effects_claimed_at=datetime.utcnow() - timedelta(hours=1))
+
+    assert await service.replay_pending_effects() == 1
+    assert "status_batch_id" not in await db.payment_transactions.find_one({"session_id": "cs_1"})
+    assert await _counters(db) == {}
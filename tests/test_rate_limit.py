@@ -0,0 +1,114 @@
+import pytest
+
+import rate_limit
+from rate_limit import MemoryBackend, MongoBackend, RateLimitRule, client_ip, parse_trusted_proxies
+
+
+class Clock:
+    def __init__(self):
+        self.now = 500.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def _rule(capacity=10, period=60):
+    return RateLimitRule("test", (), "ip", capacity, period)
+
+
+def test_rule_from_env(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_TEST", "30/15")
+    rule = RateLimitRule.from_env("test", (), "ip", "10/60")
+    assert (rule.capacity, rule.period, rule.refill_rate) == (30, 15.0, 2.0)
+
+
+@pytest.mark.anyio
+async def test_memory_bucket_allows_a_burst_of_capacity(clock):
+    backend, rule = MemoryBackend(), _rule()
+
+    waits = [await backend.take("ip:1", rule) for _ in range(10)]
+
+    assert waits == [0.0] * 10
+    # One token refills every period / capacity seconds
+    assert await backend.take("ip:1", rule) == pytest.approx(6.0)
+
+
+@pytest.mark.anyio
+async def test_memory_bucket_refills_evenly(clock):
+    backend, rule = MemoryBackend(), _rule()
+    for _ in range(10):
+        await backend.take("ip:1", rule)
+
+    clock.now += 3
+    assert await backend.take("ip:1", rule) == pytest.approx(3.0)
+    clock.now += 3
+    assert await backend.take("ip:1", rule) == 0.0
+    clock.now += 12
+    assert await backend.take("ip:1", rule) == 0.0
+    assert await backend.take("ip:1", rule) == 0.0
+    assert await backend.take("ip:1", rule) == pytest.approx(6.0)
+
+
+@pytest.mark.anyio
+async def test_memory_bucket_never_refills_past_capacity(clock):
+    backend, rule = MemoryBackend(), _rule(capacity=2, period=10)
+    await backend.take("ip:1", rule)
+
+    clock.now += 1000
+    waits = [await backend.take("ip:1", rule) for _ in range(3)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(5.0)
+
+
+@pytest.mark.anyio
+async def test_buckets_are_per_key(clock):
+    backend, rule = MemoryBackend(), _rule(capacity=1)
+
+    assert await backend.take("ip:1", rule) == 0.0
+    assert await backend.take("ip:1", rule) > 0
+    assert await backend.take("ip:2", rule) == 0.0
+
+
+@pytest.mark.anyio
+async def test_mongo_bucket_shares_tokens_between_instances(db):
+    rule = _rule(capacity=3, period=3600)
+    workers = [MongoBackend(db), MongoBackend(db)]
+
+    waits = [await workers[index % 2].take("ip:1", rule) for index in range(4)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(1200, rel=0.01)
+    bucket = await db.rate_limits.find_one({"_id": "ip:1"})
+    assert bucket["tokens"] == pytest.approx(0, abs=0.01)
+
+
+def _scope(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded or []]
+    return {"client": (peer, 51000), "headers": headers}
+
+
+def test_client_ip_without_trusted_proxies_is_the_peer():
+    assert client_ip(_scope("10.0.0.5", ["1.2.3.4"]), []) == "10.0.0.5"
+
+
+def test_client_ip_walks_forwarded_for_from_the_right():
+    trusted = parse_trusted_proxies("10.0.0.0/8, 192.168.1.1")
+
+    # The left-most entry was written by the client and is not believed
+    assert client_ip(_scope("10.0.0.5", ["6.6.6.6, 1.2.3.4, 192.168.1.1"]), trusted) == "1.2.3.4"
+    assert client_ip(_scope("10.0.0.5", ["6.6.6.6", "1.2.3.4"]), trusted) == "1.2.3.4"
+    assert client_ip(_scope("10.0.0.5", ["10.0.0.7"]), trusted) == "10.0.0.7"
+    assert client_ip(_scope("10.0.0.5"), trusted) == "10.0.0.5"
+
+
+def test_client_ip_ignores_forwarded_for_from_untrusted_peers():
+    trusted = parse_trusted_proxies("10.0.0.0/8")
+    assert client_ip(_scope("8.8.8.8", ["1.2.3.4"]), trusted) == "8.8.8.8"
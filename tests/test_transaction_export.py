@@ -0,0 +1,98 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from transaction_export import TransactionExporter, decode_cursor, encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+
+async def _insert(db, count, created_at=None, **fields):
+    for _ in range(count):
+        transaction_id = ObjectId()
+        transaction = {"_id": transaction_id, "session_id": f"cs_{transaction_id}", "payment_status": "paid"}
+        if created_at is not None:
+            transaction["created_at"] = created_at
+        transaction.update(fields)
+        await db.payment_transactions.insert_one(transaction)
+
+
+async def _walk(exporter, query, limit):
+    seen, cursor = [], None
+    while True:
+        page = await exporter.list_page(query, ["session_id"], limit, cursor)
+        seen += [row["session_id"] for row in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+def test_cursor_round_trip():
+    transaction = {"_id": ObjectId(), "created_at": datetime(2026, 3, 1, 12, 30, 15, 250000)}
+    assert decode_cursor(encode_cursor(transaction)) == (transaction["created_at"], transaction["_id"])
+
+
+def test_cursor_of_a_legacy_row_uses_its_object_id_time():
+    created = datetime(2025, 6, 1, 8, 0, 0)
+    transaction = {"_id": ObjectId.from_datetime(created)}
+    assert decode_cursor(encode_cursor(transaction)) == (created, transaction["_id"])
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "e30", "eyJjcmVhdGVkX2F0IjogMX0"])
+def test_malformed_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+async def test_pages_cover_every_row_once_newest_first(db):
+    exporter = TransactionExporter(db)
+    now = datetime.utcnow()
+    # Rows sharing a created_at are split across pages by _id
+    await _insert(db, 4, created_at=now)
+    await _insert(db, 3, created_at=now - timedelta(minutes=1))
+    await _insert(db, 1, created_at=now + timedelta(minutes=1))
+
+    seen = await _walk(exporter, {}, 3)
+
+    assert len(seen) == len(set(seen)) == 8
+    created = [
+        (await db.payment_transactions.find_one({"session_id": session_id}))["created_at"] for session_id in seen
+    ]
+    assert created == sorted(created, reverse=True)
+
+
+async def test_filters_apply_on_every_page(db):
+    exporter = TransactionExporter(db)
+    await _insert(db, 5, created_at=datetime.utcnow())
+    await _insert(db, 5, created_at=datetime.utcnow(), payment_status="expired")
+
+    seen = await _walk(exporter, exporter.build_query(status="expired"), 2)
+
+    assert len(set(seen)) == 5
+
+
+async def test_legacy_rows_page_after_backfill(db):
+    exporter = TransactionExporter(db)
+    await _insert(db, 3)
+    await _insert(db, 3, created_at=datetime.utcnow())
+
+    assert await exporter.backfill_created_at(batch_size=2) == 3
+    assert await exporter.backfill_created_at() == 0
+    seen = await _walk(exporter, {}, 2)
+
+    assert len(seen) == len(set(seen)) == 6
+
+
+async def test_export_streams_every_row(db):
+    exporter = TransactionExporter(db, batch_size=2)
+    await _insert(db, 5, created_at=datetime.utcnow())
+
+    chunks = [chunk async for chunk in await exporter.export({}, ["session_id"], "ndjson")]
+
+    rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert len(rows) == 5
+    assert len(chunks) == 3
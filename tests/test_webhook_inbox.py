@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from payment_service import PaymentService
+from webhook_inbox import WebhookInbox
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingPaymentService(PaymentService):
+    def __init__(self, db):
+        super().__init__(db)
+        self.applied = []
+
+    async def apply_status_updates(self, updates):
+        self.applied += [session_id for session_id, _ in updates]
+        await asyncio.sleep(0)
+        return await super().apply_status_updates(updates)
+
+
+async def _enqueue(db, count, **fields):
+    for index in range(count):
+        await db.webhook_inbox.insert_one({
+            "_id": f"evt_{index}", "event_type": "checkout.session.completed", "session_id": f"cs_{index}",
+            "payment_status": "paid", "metadata": {}, "status": "pending",
+            "received_at": datetime.utcnow() + timedelta(milliseconds=index), **fields
+        })
+
+
+async def test_concurrent_workers_apply_each_event_once(db):
+    service = RecordingPaymentService(db)
+    workers = [WebhookInbox(db, service, batch_size=4) for _ in range(3)]
+    await _enqueue(db, 10)
+
+    processed = 0
+    while True:
+        counts = await asyncio.gather(*(worker.drain_once() for worker in workers))
+        if not any(counts):
+            break
+        processed += sum(counts)
+
+    assert processed == 10
+    assert sorted(service.applied) == sorted(f"cs_{index}" for index in range(10))
+    assert await db.webhook_inbox.count_documents({"status": "applied"}) == 10
+    assert await db.webhook_inbox.count_documents({"claim_id": {"$exists": True}}) == 0
+
+
+async def test_stale_claim_is_taken_over(db):
+    service = RecordingPaymentService(db)
+    inbox = WebhookInbox(db, service, claim_timeout=60)
+    # Claimed by a worker that died mid-batch, and one still being applied elsewhere
+    await _enqueue(db, 1, status="applying", claim_id="dead", claimed_at=datetime.utcnow() - timedelta(minutes=5))
+    await db.webhook_inbox.insert_one({
+        "_id": "evt_live", "event_type": "checkout.session.completed", "session_id": "cs_live",
+        "payment_status": "paid", "metadata": {}, "status": "applying", "claim_id": "live",
+        "claimed_at": datetime.utcnow(), "received_at": datetime.utcnow()
+    })
+
+    assert await inbox.drain_once() == 1
+
+    assert service.applied == ["cs_0"]
+    assert (await db.webhook_inbox.find_one({"_id": "evt_0"}))["status"] == "applied"
+    assert (await db.webhook_inbox.find_one({"_id": "evt_live"}))["claim_id"] == "live"
+    stats = await inbox.get_stats()
+    assert stats["queue_depth"] == 1